@@ -1,23 +1,59 @@
-from fastapi import FastAPI
+# imported first so that the report can time the rest of the imports
+from src.telemetry.Startup import PROCESS_STARTED, get_startup_report, startup_step
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from src.history.BasicHistory import BaseHistory, OneShotHistory
+from src.history.BasicHistory import OneShotHistory
+from src.history.HistoryStore import make_history_store
+from src.history.TokenBudgetHistory import TokenBudgetHistory
 from src.schemas.ChatSchemas import ChatMessage
-from src.chat.HMRCRag import HMRCRAG
-from src.chat.SingleShotAgent import SingleShotAgent
-
-from src.chat.SingleShotAgentOASCreate import SingleShotAgentCreate
-from src.chat.Discovery import DiscoveryRAGChat
+from src.chat.LazyChat import LazyChat
+from src.clients.ClientRegistry import get_client_registry
+from src.oas.Validation import get_validation_engine
 from src.prompts import OASCheckerPrompt, OASCreatePrompt
+from src.retrieval.DiscoveryIndex import get_discovery_index
+from src.telemetry.Metrics import configure_tracing, export_request
+from src.telemetry.Timings import start_timings
 import logging
 import uvicorn
-from routers import chat, test, oasChecker, oasCreate, discovery
+from routers import chat, test, oasChecker, oasCreate, discovery, metrics
+
+get_startup_report().record(
+    "main imports", "import", (time.perf_counter() - PROCESS_STARTED) * 1000
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Chat objects and clients are built on first use, so starting up is just the imports.
+    With PREWARM_CHAT_OBJECTS=true they are built in the background once the app is up (and
+    the OAS validation worker processes are started and the discovery index loaded).
+    """
+    logger.info(f"Startup report: {get_startup_report().as_dict()}")
+    configure_tracing()
+    if os.getenv("PREWARM_CHAT_OBJECTS", "false").lower() == "true":
+        app.state.prewarm = asyncio.gather(
+            *(lazy.aget() for lazy in LAZY_CHAT_OBJECTS), return_exceptions=True
+        )
+        get_validation_engine().start()
+        get_discovery_index()
+    yield
+    if get_client_registry.cache_info().currsize:
+        await get_client_registry().aclose()
+    if get_validation_engine.cache_info().currsize:
+        get_validation_engine().close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +63,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_stage_timings(request: Request, call_next):
+    """
+    Collect the per-stage timings, token counts and sizes of each request and return the
+    timings as Server-Timing. They are logged and exported to Prometheus and OpenTelemetry
+    once the body has been sent, so streamed answers are measured to their last token.
+    """
+    timings = start_timings()
+    started = time.perf_counter()
+    response = await call_next(request)
+    if timings.stages:
+        response.headers["Server-Timing"] = timings.server_timing()
+    body = response.body_iterator
+
+    async def body_then_export():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            if not timings.empty:
+                logger.info(
+                    f"Stage timings for {request.url.path}: {timings.as_dict()}"
+                )
+                export_request(request.url.path, timings, time.perf_counter() - started)
+
+    response.body_iterator = body_then_export()
+    return response
+
+
 # Input and output schemas
 
 
@@ -45,37 +111,37 @@ class HistoryResponse(BaseModel):
 # Initialise History and RAG objects
 
 
-# def get_chat_instance_hmrc_api_agent() -> Chat:
-#     chat_class_path = "src.chat.HMRCRag.HMRCRAG"
-#     logger.info(f"Using chat implementation: {chat_class_path}")
-#     module_name, class_name = chat_class_path.rsplit(".", 1)
-#     module = importlib.import_module(module_name)
-#     chat_class = getattr(module, class_name)
-#     return chat_class()
-
-
-# def get_chat_instance_oas_checker_agent() -> Chat:
-#     chat_class_path = "src.chat.SingleShotAgent.SingleShotAgent"
-#     logger.info(f"Using chat implementation: {chat_class_path}")
-#     module_name, class_name = chat_class_path.rsplit(".", 1)
-#     module = importlib.import_module(module_name)
-#     chat_class = getattr(module, class_name)
-#     return chat_class()
-
-
-HistoryObjectHMRC = BaseHistory()
-HistoryObjectOASChecker = OneShotHistory()  # one-shot: only last message used
-HistoryObjectOASCreate = OneShotHistory()  # one-shot: only last message used
-HistoryObjectDiscovery = OneShotHistory()  # one-shot: only last message used
+with startup_step("histories"):
+    HistoryObjectHMRC = TokenBudgetHistory(
+        store=make_history_store()
+    )  # keyed by session id
+    HistoryObjectOASChecker = OneShotHistory()  # one-shot: only last message used
+    HistoryObjectOASCreate = OneShotHistory()  # one-shot: only last message used
+    HistoryObjectDiscovery = OneShotHistory()  # one-shot: only last message used
 logger.info("HistoryObject initialized.")
 
-ChatObjectHmrcApiAgent: HMRCRAG = HMRCRAG()
-ChatObjectOasAgent: SingleShotAgent = SingleShotAgent(sysPromptContent=OASCheckerPrompt)
-ChatObjectOasCreate: SingleShotAgentCreate = SingleShotAgentCreate(
-    sysPromptContent=OASCreatePrompt
+# built on first use, routers get them with `await app.state.ChatObject....aget()`
+# identical concurrent questions to /chat and /discover share one answer unless disabled
+COALESCE_CHAT_REQUESTS = os.getenv("COALESCE_CHAT_REQUESTS", "true").lower() == "true"
+ChatObjectHmrcApiAgent = LazyChat(
+    "src.chat.HMRCRag.HMRCRAG", coalesce=COALESCE_CHAT_REQUESTS
+)
+ChatObjectOasAgent = LazyChat(
+    "src.chat.OASChecker.OASCheckerAgent", sysPromptContent=OASCheckerPrompt
+)
+ChatObjectOasCreate = LazyChat(
+    "src.chat.SingleShotAgentOASCreate.SingleShotAgentCreate",
+    sysPromptContent=OASCreatePrompt,
+)
+ChatObjectDiscovery = LazyChat(
+    "src.chat.Discovery.DiscoveryRAGChat", coalesce=COALESCE_CHAT_REQUESTS
 )
-ChatObjectDiscovery: DiscoveryRAGChat = DiscoveryRAGChat()
-logger.info("ChatObjects initialized.")
+LAZY_CHAT_OBJECTS = [
+    ChatObjectHmrcApiAgent,
+    ChatObjectOasAgent,
+    ChatObjectOasCreate,
+    ChatObjectDiscovery,
+]
 
 app.state.HistoryObjectHMRC = HistoryObjectHMRC
 app.state.HistoryObjectOASChecker = HistoryObjectOASChecker
@@ -92,6 +158,7 @@ app.include_router(test.router)
 app.include_router(oasCreate.router)
 app.include_router(oasChecker.router)
 app.include_router(discovery.router)
+app.include_router(metrics.router)
 
 # Startup script for direct running
 if __name__ == "__main__":
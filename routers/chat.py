@@ -2,6 +2,13 @@ from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from fastapi.responses import StreamingResponse
 from src.schemas.ChatSchemas import ChatMessage
+from src.chat.EventStream import (
+    EVENT_STREAM,
+    EVENT_STREAM_HEADERS,
+    chat_events,
+    wants_events,
+)
+from src.history.BasicHistory import DEFAULT_SESSION_ID
 import logging
 
 # Configure logging
@@ -16,6 +23,7 @@ router = APIRouter()
 class QueryRequest(BaseModel):
     content: str
     streaming: bool = False
+    session_id: str = DEFAULT_SESSION_ID
 
 
 class QueryResponse(BaseModel):
@@ -26,37 +34,69 @@ class QueryResponse(BaseModel):
 
 
 @router.post("/chat")
-def chat(query: QueryRequest, request: Request):
+async def chat(query: QueryRequest, request: Request):
+    """
+    Answers with a ChatMessage, or streams the answer as plain text when `streaming` is set.
+    Streaming clients that accept text/event-stream get Server-Sent Events instead (see
+    src/chat/EventStream.py), where the first event is sent before retrieval starts.
+    """
     HistoryObject = request.app.state.HistoryObjectHMRC
-    ChatObject = request.app.state.ChatObjectHmrcApiAgent
     logger.info(f"Received chat request: {query.content} streaming={query.streaming}")
     message = ChatMessage(role="user", content=query.content)
-    HistoryObject.record_message(message)
+    HistoryObject.record_message(message, session_id=query.session_id)
     logger.info("Message recorded in history.")
 
-    context_history = HistoryObject.get_context_history()
+    if query.streaming and wants_events(request):
+        return StreamingResponse(
+            chat_events(
+                answer_stream(query, request),
+                on_complete=lambda content: record_answer(
+                    HistoryObject, content, query.session_id
+                ),
+            ),
+            media_type=EVENT_STREAM,
+            headers=EVENT_STREAM_HEADERS,
+        )
+
+    ChatObject = await request.app.state.ChatObjectHmrcApiAgent.aget()
+
+    context_history = await HistoryObject.aget_context_history(query.session_id)
     logger.info(f"Context history retrieved: {context_history}")
 
-    chat_response = ChatObject.chat_query(
+    chat_response = await ChatObject.achat_query(
         chat_history=context_history, streamed=query.streaming
     )
 
     if not query.streaming:
         logger.info(f"Chat response generated: {chat_response}")
 
-        HistoryObject.record_message(chat_response)
+        HistoryObject.record_message(chat_response, session_id=query.session_id)
         logger.info("Chat response recorded in history.")
         return chat_response
 
-    def stream_chat():
-        response_content = ""
-        for chunk in chat_response:
+    async def stream_chat():
+        pieces = []
+        async for chunk in chat_response:
             yield chunk
-            response_content += chunk
+            pieces.append(chunk)
+        response_content = "".join(pieces)
 
-        logger.info(f"Chat response generated: {response_content}")
-        HistoryObject.record_message(
-            ChatMessage(role="assistant", content=response_content)
-        )
+        record_answer(HistoryObject, response_content, query.session_id)
 
     return StreamingResponse(stream_chat(), media_type="text/plain")
+
+
+async def answer_stream(query: QueryRequest, request: Request):
+    "Everything between the question and the first token, run once the event stream has started"
+    HistoryObject = request.app.state.HistoryObjectHMRC
+    ChatObject = await request.app.state.ChatObjectHmrcApiAgent.aget()
+    context_history = await HistoryObject.aget_context_history(query.session_id)
+    logger.info(f"Context history retrieved: {context_history}")
+    return await ChatObject.achat_query(chat_history=context_history, streamed=True)
+
+
+def record_answer(HistoryObject, content: str, session_id: str):
+    logger.info(f"Chat response generated: {content}")
+    HistoryObject.record_message(
+        ChatMessage(role="assistant", content=content), session_id=session_id
+    )
@@ -1,8 +1,11 @@
+import asyncio
 from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from fastapi.responses import StreamingResponse
 from src.schemas.ChatSchemas import ChatMessage
-from src.history.BasicHistory import OneShotHistory
+from src.history.BasicHistory import DEFAULT_SESSION_ID, OneShotHistory
+from src.oas.Digest import payload_summary
+from src.retrieval.DiscoveryIndex import get_discovery_index
 from src.chat.SingleShotAgent import SingleShotAgent
 import logging
 
@@ -18,6 +21,7 @@ router = APIRouter()
 class QueryRequest(BaseModel):
     content: str
     streaming: bool = False
+    session_id: str = DEFAULT_SESSION_ID
 
 
 class QueryResponse(BaseModel):
@@ -28,26 +32,26 @@ class QueryResponse(BaseModel):
 
 
 @router.post("/discover")
-def discover(query: QueryRequest, request: Request):
+async def discover(query: QueryRequest, request: Request):
     HistoryObject: OneShotHistory = request.app.state.HistoryObjectDiscovery
-    ChatObject: SingleShotAgent = request.app.state.ChatObjectDiscovery
-    logger.info(f"Received chat request: {query.content} streaming={query.streaming}")
+    ChatObject: SingleShotAgent = await request.app.state.ChatObjectDiscovery.aget()
+    logger.info(
+        f"Received chat request: {payload_summary(query.content)} streaming={query.streaming}"
+    )
 
     message = ChatMessage(role="user", content=query.content)
-    HistoryObject.record_message(message)
+    HistoryObject.record_message(message, session_id=query.session_id)
     logger.info("Message recorded in history.")
 
-    context_history = HistoryObject.get_context_history()
-    print(f"Context history: {context_history}")
-    logger.info(f"Context history retrieved: {context_history}")
+    context_history = await HistoryObject.aget_context_history(query.session_id)
+    logger.info(f"Context history retrieved: {len(context_history)} messages")
 
     try:
-        logger.info("content passed to yaml_to_json:")
-        logger.info(query.content)
-        json_api_spec = ChatObject.yaml_to_json(query.content)
+        # in a worker: a large spec takes seconds to parse, the chat reuses the parse
+        json_api_spec = await asyncio.to_thread(ChatObject.yaml_to_json, query.content)
         logger.info("Converted YAML to JSON successfully.")
         try:
-            oas_validity = ChatObject.validate_oas_spec(json_api_spec)
+            oas_validity = await ChatObject.avalidate_oas_spec(json_api_spec)
         except Exception as e:
             logger.error(f"Failed to validate OAS spec: {e}")
             return "The provided OpenAPI Specification is invalid or could not be processed"
@@ -55,26 +59,39 @@ def discover(query: QueryRequest, request: Request):
         logger.error(f"Failed to convert YAML to JSON: {e}")
         return "The provided OpenAPI Specification is invalid or could not be processed"
 
-    chat_response = ChatObject.chat_query(
+    chat_response = await ChatObject.achat_query(
         chat_history=context_history, streamed=query.streaming
     )
 
     if not query.streaming:
         logger.info(f"Chat response generated: {chat_response}")
 
-        HistoryObject.record_message(chat_response)
+        HistoryObject.record_message(chat_response, session_id=query.session_id)
         logger.info("Chat response recorded in history.")
         return chat_response
 
-    def stream_chat():
-        response_content = ""
-        for chunk in chat_response:
+    async def stream_chat():
+        pieces = []
+        async for chunk in chat_response:
             yield chunk
-            response_content += chunk
+            pieces.append(chunk)
+        response_content = "".join(pieces)
 
         logger.info(f"Chat response generated: {response_content}")
         HistoryObject.record_message(
-            ChatMessage(role="assistant", content=response_content)
+            ChatMessage(role="assistant", content=response_content),
+            session_id=query.session_id,
         )
 
     return StreamingResponse(stream_chat(), media_type="text/plain")
+
+
+@router.post("/discover/matches")
+async def discover_matches(query: QueryRequest, request: Request):
+    "The deployed APIs ranked by the discovery index, without asking the LLM to explain them"
+    if get_discovery_index() is None:
+        return "The discovery index has not been built"
+    ChatObject = await request.app.state.ChatObjectDiscovery.aget()
+    logger.info(f"Received matches request: {payload_summary(query.content)}")
+    matches = await ChatObject.arank([ChatMessage(role="user", content=query.content)])
+    return [m.as_dict() for m in matches]
@@ -2,6 +2,7 @@ from fastapi import Request
 from fastapi.routing import APIRouter
 from pydantic import BaseModel
 from src.schemas.ChatSchemas import ChatMessage
+from src.history.BasicHistory import DEFAULT_SESSION_ID
 import logging
 
 # Configure logging
@@ -21,9 +22,11 @@ class HistoryResponse(BaseModel):
 
 
 @router.get("/history", response_model=HistoryResponse)
-def history_request(request: Request) -> HistoryResponse:
+def history_request(
+    request: Request, session_id: str = DEFAULT_SESSION_ID
+) -> HistoryResponse:
     HistoryObject = request.app.state.HistoryObject
     logger.info("Received history request.")
-    history_list = HistoryObject.get_history()
+    history_list = HistoryObject.get_history(session_id)
     logger.info(f"History retrieved: {history_list}")
     return HistoryResponse(content=history_list)
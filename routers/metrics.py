@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    "Prometheus metrics of the app (see src/telemetry/Metrics.py)"
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,7 +1,10 @@
+import asyncio
 from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from fastapi.responses import StreamingResponse
 from src.schemas.ChatSchemas import ChatMessage
+from src.history.BasicHistory import DEFAULT_SESSION_ID
+from src.oas.Digest import payload_summary
 import logging
 from src.chat.SingleShotAgent import SingleShotAgent
 
@@ -17,6 +20,7 @@ router = APIRouter()
 class QueryRequest(BaseModel):
     content: str
     streaming: bool = False
+    session_id: str = DEFAULT_SESSION_ID
 
 
 class QueryResponse(BaseModel):
@@ -27,24 +31,25 @@ class QueryResponse(BaseModel):
 
 
 @router.post("/oas-checker")
-def oasChecker(query: QueryRequest, request: Request):
+async def oasChecker(query: QueryRequest, request: Request):
     HistoryObject = request.app.state.HistoryObjectOASChecker
-    ChatObject: SingleShotAgent = request.app.state.ChatObjectOasAgent
-    logger.info(f"Received chat request: {query.content} streaming={query.streaming}")
+    ChatObject: SingleShotAgent = await request.app.state.ChatObjectOasAgent.aget()
+    logger.info(
+        f"Received chat request: {payload_summary(query.content)} streaming={query.streaming}"
+    )
     message = ChatMessage(role="user", content=query.content)
-    HistoryObject.record_message(message)
+    HistoryObject.record_message(message, session_id=query.session_id)
     logger.info("Message recorded in history.")
 
-    context_history = HistoryObject.get_context_history()
-    logger.info(f"Context history retrieved: {context_history}")
+    context_history = await HistoryObject.aget_context_history(query.session_id)
+    logger.info(f"Context history retrieved: {len(context_history)} messages")
 
     try:
-        logger.info("content passed to yaml_to_json:")
-        logger.info(query.content)
-        json_api_spec = ChatObject.yaml_to_json(query.content)
+        # in a worker: a large spec takes seconds to parse, the chat reuses the parse
+        json_api_spec = await asyncio.to_thread(ChatObject.yaml_to_json, query.content)
         logger.info("Converted YAML to JSON successfully.")
         try:
-            oas_validity = ChatObject.validate_oas_spec(json_api_spec)
+            oas_validity = await ChatObject.avalidate_oas_spec(json_api_spec)
         except Exception as e:
             logger.error(f"Failed to validate OAS spec: {e}")
             return "The provided OpenAPI Specification is invalid or could not be processed"
@@ -52,26 +57,28 @@ def oasChecker(query: QueryRequest, request: Request):
         logger.error(f"Failed to convert YAML to JSON: {e}")
         return "The provided OpenAPI Specification is invalid or could not be processed"
 
-    chat_response = ChatObject.chat_query(
+    chat_response = await ChatObject.achat_query(
         chat_history=context_history, streamed=query.streaming
     )
 
     if not query.streaming:
         logger.info(f"Chat response generated: {chat_response}")
 
-        HistoryObject.record_message(chat_response)
+        HistoryObject.record_message(chat_response, session_id=query.session_id)
         logger.info("Chat response recorded in history.")
         return chat_response
 
-    def stream_chat():
-        response_content = ""
-        for chunk in chat_response:
+    async def stream_chat():
+        pieces = []
+        async for chunk in chat_response:
             yield chunk
-            response_content += chunk
+            pieces.append(chunk)
+        response_content = "".join(pieces)
 
         logger.info(f"Chat response generated: {response_content}")
         HistoryObject.record_message(
-            ChatMessage(role="assistant", content=response_content)
+            ChatMessage(role="assistant", content=response_content),
+            session_id=query.session_id,
         )
 
     return StreamingResponse(stream_chat(), media_type="text/plain")
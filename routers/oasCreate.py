@@ -2,8 +2,16 @@ from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from fastapi.responses import StreamingResponse
 from src.schemas.ChatSchemas import ChatMessage
+from src.chat.EventStream import (
+    EVENT_STREAM,
+    EVENT_STREAM_HEADERS,
+    spec_events,
+    wants_events,
+)
+from src.history.BasicHistory import DEFAULT_SESSION_ID
 import logging
-from src.chat.SingleShotAgent import SingleShotAgent
+import time
+from src.chat.SingleShotAgentOASCreate import SingleShotAgentCreate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +24,8 @@ router = APIRouter()
 
 class QueryRequestCreate(BaseModel):
     content: str
+    streaming: bool = False
+    session_id: str = DEFAULT_SESSION_ID
 
 
 class QueryResponse(BaseModel):
@@ -26,41 +36,80 @@ class QueryResponse(BaseModel):
 
 
 @router.post("/oas-create")
-def oasCreate(query: QueryRequestCreate, request: Request):
+async def oasCreate(query: QueryRequestCreate, request: Request):
+    """
+    Answers with the generated spec once it is valid. With `streaming` set the YAML is streamed
+    as plain text while it is generated, or as Server-Sent Events for clients that accept
+    text/event-stream, with the early validation of each top-level block and a final event
+    carrying the validated spec (see `spec_events` in src/chat/EventStream.py).
+    """
     HistoryObject = request.app.state.HistoryObjectOASCreate
-    ChatObject: SingleShotAgent = request.app.state.ChatObjectOasCreate
+    ChatObject: SingleShotAgentCreate = (
+        await request.app.state.ChatObjectOasCreate.aget()
+    )
     logger.info(f"Received chat request: {query.content}")
     message = ChatMessage(role="user", content=query.content)
-    HistoryObject.record_message(message)
+    HistoryObject.record_message(message, session_id=query.session_id)
     logger.info("Message recorded in history.")
 
-    context_history = HistoryObject.get_context_history()
+    context_history = await HistoryObject.aget_context_history(query.session_id)
     logger.info(f"Context history retrieved: {context_history}")
 
-    chat_response = ChatObject.chat_query(chat_history=context_history, streamed=False)
-    logger.info("Chat response generated.")
-    logger.info(f"Chat response content: {chat_response}")
-
-    if not chat_response:
-        logger.error("Chat response is empty or None.")
-        return "The provided response is invalid or could not be processed"
-
-    try:
-        logger.info("content passed to yaml_to_json:")
-        logger.info(chat_response.content)
-        json_api_spec = ChatObject.yaml_to_json(chat_response.content)
-        logger.info("Converted YAML to JSON successfully.")
-        try:
-            oas_validity = ChatObject.validate_oas_spec(json_api_spec)
-        except Exception as e:
-            logger.error(f"Failed to validate OAS spec: {e}")
-            return "The provided OpenAPI Specification is invalid or could not be processed"
-    except Exception as e:
-        logger.error(f"Failed to convert YAML to JSON: {e}")
+    if query.streaming and wants_events(request):
+        return StreamingResponse(
+            spec_events(
+                ChatObject,
+                context_history,
+                on_complete=lambda content: record_answer(
+                    HistoryObject, content, query.session_id
+                ),
+            ),
+            media_type=EVENT_STREAM,
+            headers=EVENT_STREAM_HEADERS,
+        )
+
+    if query.streaming:
+        deadline = time.monotonic() + ChatObject.time_budget
+        chat_response = await ChatObject.achat_query(
+            chat_history=context_history, streamed=True
+        )
+
+        async def stream_spec():
+            pieces = []
+            async for chunk in chat_response:
+                yield chunk
+                pieces.append(chunk)
+            # like the other paths, only a spec that is (or could be repaired to be) valid is
+            # recorded; the client got the raw stream, the history gets the repaired spec
+            generation = await ChatObject.arepair(
+                "".join(pieces), context_history, deadline
+            )
+            if generation.valid:
+                record_answer(HistoryObject, generation.content, query.session_id)
+            else:
+                logger.error(
+                    f"The streamed spec could not be repaired: {generation.errors}"
+                )
+
+        return StreamingResponse(stream_spec(), media_type="text/plain")
+
+    # generate, validate and repair the parts that fail, see src/oas/Repair.py
+    generation = await ChatObject.acreate(context_history)
+    logger.info(
+        f"Spec generated in {generation.attempts} attempt(s), valid: {generation.valid}, "
+        f"cached: {generation.cached}"
+    )
+
+    if not generation.valid:
+        logger.error(f"The generated spec could not be repaired: {generation.errors}")
         return "The provided OpenAPI Specification is invalid or could not be processed"
 
-    logger.info(f"Chat response generated: {chat_response}")
+    record_answer(HistoryObject, generation.content, query.session_id)
+    return generation.content
 
-    HistoryObject.record_message(chat_response)
+
+def record_answer(HistoryObject, content: str, session_id: str):
+    HistoryObject.record_message(
+        ChatMessage(role="assistant", content=content), session_id=session_id
+    )
     logger.info("Chat response recorded in history.")
-    return chat_response.content
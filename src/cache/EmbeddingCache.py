@@ -0,0 +1,214 @@
+"""
+A content-hashed cache for embeddings so that repeated queries skip the embedding round trip.
+
+There are two tiers: an in-process LRU dictionary and an optional SQLite file. Both store the
+vectors as float32 (the file survives restarts / is shared by workers).
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+# the most "?" of a query that every SQLite build accepts
+SQLITE_MAX_VARIABLES = 999
+
+
+def normalize_text(text: str) -> str:
+    "Canonical form of a text for caching: NFKC, trimmed, with whitespace runs collapsed"
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Caches embeddings keyed by (model, normalized text).
+
+    Lookups go to the LRU tier first, then to the persistent tier (if a path was given),
+    whose hits are promoted to the LRU. Hit and miss counts are kept for each tier.
+    """
+
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        # float32 vectors, converted to lists of floats only when returned
+        self._entries: OrderedDict[str, array] = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(
+                path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                )
+                """
+            )
+
+    def _remember(self, key: str, vector: array):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_memory(self, key: str) -> Optional[list[float]]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return self._entries[key].tolist()
+
+    def _get_disk_many(self, keys: list[str]) -> dict[str, list[float]]:
+        "Look the persistent tier up (blocking), counting a miss for each key it has no entry for"
+        rows = []
+        if self._connection is not None:
+            for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[i : i + SQLITE_MAX_VARIABLES]
+                rows += self._connection.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+        found = {}
+        with self._lock:
+            for key, blob in rows:
+                vector = array("f", blob)
+                self._remember(key, vector)
+                found[key] = vector.tolist()
+            self.disk_hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def _get_disk(self, key: str) -> Optional[list[float]]:
+        return self._get_disk_many([key]).get(key)
+
+    def _put_disk(self, rows: list[tuple[str, str, array]]):
+        if self._connection is not None:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                [(key, model, vector.tobytes()) for key, model, vector in rows],
+            )
+
+    def get(self, model: str, text: str) -> Optional[list[float]]:
+        "Return the cached embedding or None"
+        key = cache_key(model, text)
+        embedding = self._get_memory(key)
+        return embedding if embedding is not None else self._get_disk(key)
+
+    async def aget(self, model: str, text: str) -> Optional[list[float]]:
+        "Async version of `get`, reading the persistent tier in a worker thread"
+        key = cache_key(model, text)
+        embedding = self._get_memory(key)
+        if embedding is not None:
+            return embedding
+        if self._connection is None:
+            return self._get_disk(key)
+        return await asyncio.to_thread(self._get_disk, key)
+
+    def put(self, model: str, text: str, embedding: list[float]):
+        "Store an embedding in every tier"
+        key = cache_key(model, text)
+        vector = array("f", embedding)
+        with self._lock:
+            self._remember(key, vector)
+        self._put_disk([(key, model, vector)])
+
+    async def aput(self, model: str, text: str, embedding: list[float]):
+        "Async version of `put`, writing the persistent tier in a worker thread"
+        await self.aput_many(model, [text], [embedding])
+
+    async def aget_many(
+        self, model: str, texts: list[str]
+    ) -> list[Optional[list[float]]]:
+        "The cached embeddings of many texts (None for each miss), with one persistent tier query"
+        keys = [cache_key(model, text) for text in texts]
+        embeddings = [self._get_memory(key) for key in keys]
+        missing = [key for key, e in zip(keys, embeddings) if e is None]
+        if not missing:
+            return embeddings
+        if self._connection is None:
+            found = self._get_disk_many(missing)
+        else:
+            found = await asyncio.to_thread(self._get_disk_many, missing)
+        return [
+            e if e is not None else found.get(key) for key, e in zip(keys, embeddings)
+        ]
+
+    async def aput_many(
+        self, model: str, texts: list[str], embeddings: list[list[float]]
+    ):
+        "Store many embeddings in every tier, writing the persistent tier in one worker thread call"
+        rows = [
+            (cache_key(model, text), model, array("f", embedding))
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            for key, _, vector in rows:
+                self._remember(key, vector)
+        if self._connection is not None:
+            await asyncio.to_thread(self._put_disk, rows)
+
+    def get_or_compute(
+        self, model: str, text: str, compute: Callable[[str], list[float]]
+    ) -> list[float]:
+        "Return the cached embedding, calling `compute(text)` (and caching it) on a miss"
+        embedding = self.get(model, text)
+        if embedding is None:
+            embedding = compute(text)
+            self.put(model, text, embedding)
+        return embedding
+
+    async def aget_or_compute(
+        self, model: str, text: str, compute: Callable[[str], Awaitable[list[float]]]
+    ) -> list[float]:
+        "Async version of `get_or_compute`"
+        embedding = await self.aget(model, text)
+        if embedding is None:
+            embedding = await compute(text)
+            await self.aput(model, text, embedding)
+        return embedding
+
+    def stats(self) -> dict:
+        "Hit/miss counters and the hit rate"
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups
+            if lookups
+            else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    The process-wide embedding cache, configured by the environment:
+
+    - EMBEDDING_CACHE_SIZE: number of embeddings kept in memory
+    - EMBEDDING_CACHE_PATH: SQLite file for the persistent tier (disabled if unset)
+    """
+    return EmbeddingCache(
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+    )
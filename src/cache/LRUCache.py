@@ -0,0 +1,75 @@
+"A small thread-safe LRU cache with an optional time to live, shared by the various caches"
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Keeps at most `max_entries` values, evicting the least recently used first. If
+    `ttl_seconds` is set, values older than that are treated as missing.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        "Return the cached value (and mark it as recently used) or `default`"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                self.ttl_seconds is None
+                or time.monotonic() - entry[0] <= self.ttl_seconds
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        "A snapshot of the unexpired (key, value) pairs, least recently used first"
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (created, value) in self._entries.items()
+                if self.ttl_seconds is None or now - created <= self.ttl_seconds
+            ]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,103 @@
+"""
+A semantic cache of chat answers.
+
+An answer is reused when a new query retrieved exactly the same documents and its embedding
+is close enough (cosine similarity above a threshold) to the query the answer was generated
+for. Entries expire after a TTL and the least recently used are evicted first.
+"""
+
+import hashlib
+import itertools
+import os
+import re
+from typing import AsyncGenerator, Generator, Optional
+
+import numpy as np
+
+from src.cache.LRUCache import LRUCache
+
+WORD_WITH_SPACE = re.compile(r"\S+\s*|\s+")
+
+
+def document_ids(documents: list[str]) -> tuple[str, ...]:
+    "Stable ids for the retrieved documents (their content hashes, in retrieval order)"
+    return tuple(hashlib.sha256(str(d).encode()).hexdigest()[:16] for d in documents)
+
+
+def _unit(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticResponseCache:
+    """
+    Args:
+        similarity_threshold: minimum cosine similarity between the query embeddings
+        ttl_seconds: how long an answer can be reused
+        max_entries: how many answers are kept
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: Optional[float] = 3600,
+        max_entries: int = 1000,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self._entries = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "SemanticResponseCache":
+        "Configured by HMRC_RESPONSE_CACHE_THRESHOLD, HMRC_RESPONSE_CACHE_TTL and HMRC_RESPONSE_CACHE_SIZE"
+        return cls(
+            similarity_threshold=float(
+                os.getenv("HMRC_RESPONSE_CACHE_THRESHOLD", "0.95")
+            ),
+            ttl_seconds=float(os.getenv("HMRC_RESPONSE_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("HMRC_RESPONSE_CACHE_SIZE", "1000")),
+        )
+
+    def lookup(self, embedding, doc_ids: tuple[str, ...]) -> Optional[str]:
+        "Return the cached answer for a query with the same documents and a similar embedding"
+        candidates = [
+            (key, entry) for key, entry in self._entries.items() if key[0] == doc_ids
+        ]
+        if candidates:
+            matrix = np.stack([entry[0] for _, entry in candidates])
+            scores = matrix @ _unit(embedding)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                key, (_, answer) = candidates[best]
+                self._entries.get(key)  # mark as recently used
+                self.hits += 1
+                return answer
+        self.misses += 1
+        return None
+
+    def store(self, embedding, doc_ids: tuple[str, ...], answer: str):
+        if answer:
+            self._entries.put((doc_ids, next(self._ids)), (_unit(embedding), answer))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def replay(answer: str) -> Generator[str, None, None]:
+    "Stream a cached answer word by word, like a completion stream"
+    yield from WORD_WITH_SPACE.findall(answer)
+
+
+async def areplay(answer: str) -> AsyncGenerator[str, None]:
+    "Async version of `replay`"
+    for piece in WORD_WITH_SPACE.findall(answer):
+        yield piece
@@ -1,6 +1,7 @@
+import asyncio
 from abc import ABC, abstractmethod
 from src.schemas.ChatSchemas import ChatMessage
-from typing import Generator, Optional
+from typing import AsyncGenerator, Generator, Optional
 
 # Chat -> SimpleRAG -> HistoryRAG -> HMRCRag
 
@@ -38,3 +39,31 @@ class Chat(ABC):
             A ChatMessage object containing the response to the latest user query.
         """
         pass
+
+    async def achat_query(
+        self, chat_history: list[ChatMessage], streamed: bool = False
+    ) -> ChatMessage | AsyncGenerator[str, None]:
+        """
+        The async counterpart of `chat_query`, used by the routers.
+
+        Implementations that have async clients should override this so that an in-flight
+        LLM call only holds a socket rather than a thread. The default implementation runs
+        `chat_query` (and the iteration of its stream) in worker threads so that every Chat
+        can still be awaited.
+
+        Returns:
+        --------
+        ChatMessage | AsyncGenerator[str, None]
+        """
+        response = await asyncio.to_thread(
+            self.chat_query, chat_history, streamed=streamed
+        )
+        if not streamed:
+            return response
+
+        async def stream_response():
+            done = object()
+            while (chunk := await asyncio.to_thread(next, response, done)) is not done:
+                yield chunk
+
+        return stream_response()
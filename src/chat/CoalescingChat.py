@@ -0,0 +1,139 @@
+"""
+Single-flight coalescing of identical concurrent chat queries.
+
+When the same question is asked several times at once (a demo, a training session) every
+request would embed, retrieve and call the LLM on its own. A CoalescingChat wraps a Chat so
+that concurrent `achat_query` calls with the same (normalised) history share one in-flight
+computation; a streamed answer is fanned out to every caller through a Broadcast.
+"""
+
+import asyncio
+import hashlib
+from typing import AsyncGenerator, AsyncIterator, Callable, Optional
+
+from src.cache.EmbeddingCache import normalize_text
+from src.chat.Chat import Chat
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import count
+
+
+class Broadcast:
+    """
+    Reads a stream once and replays it to any number of subscribers. Subscribers that join
+    late get the pieces they missed first; an error in the stream is raised to all of them
+    (a cancelled stream as a RuntimeError, so that only the pump itself is cancelled).
+    `on_finished` is called when the stream has ended, before any subscriber is told.
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[str],
+        on_finished: Optional[Callable[[], None]] = None,
+    ):
+        self.pieces: list[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.on_finished = on_finished
+        self._changed = asyncio.Event()
+        # reading starts straight away, independently of the subscribers
+        self.finished = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for piece in source:
+                self.pieces.append(piece)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("upstream generation cancelled")
+            raise
+        except BaseException as e:
+            self.error = e
+        finally:
+            if self.on_finished is not None:
+                self.on_finished()
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        i = 0
+        while True:
+            if i < len(self.pieces):
+                yield self.pieces[i]
+                i += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+
+class CoalescingChat(Chat):
+    """
+    Wraps a Chat (everything but `achat_query` is delegated to it).
+
+    The shared computation runs in the context of the first caller, so only that caller's
+    RequestTimings get its stages; the callers that joined it only count as "coalesced".
+
+    Args:
+        chat: the Chat doing the work
+        scope: what the queries are for (e.g. the endpoint), part of the key; by default the class name
+    """
+
+    def __init__(self, chat: Chat, scope: Optional[str] = None):
+        self.chat = chat
+        self.scope = scope or type(chat).__name__
+        self.implements_streaming = chat.implements_streaming
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    def __getattr__(self, name):
+        return getattr(self.chat, name)
+
+    def key(self, chat_history: list[ChatMessage], streamed: bool) -> str:
+        h = hashlib.sha256(f"{self.scope}\0{streamed}\0".encode())
+        for m in chat_history:
+            h.update(f"{m.role}\0{normalize_text(m.content)}\0".encode())
+        return h.hexdigest()
+
+    def chat_query(self, chat_history: list[ChatMessage], streamed=False):
+        "Not coalesced, only the async path is shared"
+        return self.chat.chat_query(chat_history, streamed=streamed)
+
+    async def _start(self, key: str, chat_history: list[ChatMessage], streamed: bool):
+        response = await self.chat.achat_query(chat_history, streamed=streamed)
+        if not streamed:
+            return response
+        # a streamed query stays in flight (and can be joined) until its stream ends
+        task = asyncio.current_task()
+        return Broadcast(response, on_finished=lambda: self._forget(key, task))
+
+    def _forget(self, key: str, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def _settle(self, key: str, task: asyncio.Future):
+        if (
+            task.cancelled()
+            or task.exception() is not None
+            or not isinstance(task.result(), Broadcast)
+        ):
+            self._forget(key, task)
+
+    async def achat_query(
+        self, chat_history: list[ChatMessage], streamed: bool = False
+    ) -> ChatMessage | AsyncGenerator[str, None]:
+        key = self.key(chat_history, streamed)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._start(key, chat_history, streamed))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._settle(key, t))
+        else:
+            count("coalesced")
+        # shielded so that a caller going away does not cancel the query for the others
+        response = await asyncio.shield(task)
+        return response.subscribe() if streamed else response
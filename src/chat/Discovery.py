@@ -1,20 +1,45 @@
 """a class that implements SimpleRAG but uses a different prompt and handles the weird HMRC vector database chunking stuff"""
 
+import os
+from typing import Optional
 from src.loaders import hmrcLoader1
 from src.chat.HistoryRAG import HistoryRAG
-from src.prompts import DiscoveryPrompt_v2
-import yaml
-from openapi_spec_validator import validate
+from src.oas.Digest import bounded_digest
+from src.oas.Parsing import parse_spec
+from src.oas.Validation import get_validation_engine
+from src.prompts import DiscoveryExplainPrompt, DiscoveryPrompt_v2
+from src.retrieval.DiscoveryIndex import (
+    DiscoveryMatch,
+    Fingerprint,
+    describe_spec,
+    fingerprint,
+    get_discovery_index,
+)
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import stage
+from src.telemetry.Usage import record_retrieved
 
 # Chat -> SimpleRAG -> HistoryRAG -> HMRCRag
 # Chat -> SimpleRAG -> HistoryRAG -> Discovery
 
+# posted specs are replaced by a digest of at most this many tokens for retrieval and the prompt
+DIGEST_MAX_TOKENS = int(os.getenv("DISCOVERY_DIGEST_MAX_TOKENS", "3000"))
+# how many of the APIs ranked by the discovery index the LLM is asked to explain
+TOP_K = int(os.getenv("DISCOVERY_TOP_K", "5"))
+
 
 class DiscoveryRAGChat(HistoryRAG):
+    """
+    When the discovery index has been built (see src/retrieval/DiscoveryIndex.py) the deployed
+    APIs are ranked against the posted spec in-process and the LLM only explains the ranking,
+    otherwise the APIs are retrieved from the HMRC collection.
+    """
+
     systemprompt = {
         "role": "system",
         "content": DiscoveryPrompt_v2,
     }
+    explainprompt = {"role": "system", "content": DiscoveryExplainPrompt}
 
     def yaml_to_json(self, yaml_string):
         """
@@ -27,8 +52,8 @@ class DiscoveryRAGChat(HistoryRAG):
         str: The converted JSON string
         """
         try:
-            # Parse YAML string to Python dictionary
-            yaml_dict: dict = yaml.safe_load(yaml_string)
+            # Parse YAML (or JSON) string to Python dictionary, see src/oas/Parsing.py
+            yaml_dict: dict = parse_spec(yaml_string)
             return yaml_dict
         except Exception as e:
             return f"Error converting YAML to JSON: {str(e)}"
@@ -43,15 +68,88 @@ class DiscoveryRAGChat(HistoryRAG):
         Returns:
             bool: True if the OAS is valid, False otherwise.
         """
-        try:
-            # Parse the OAS spec
-            # Validate the OAS spec
-            validate(oas_spec)
-            return True
-        except Exception:
-            return False
+        result = get_validation_engine().validate(oas_spec)
+        return result.valid
+
+    async def avalidate_oas_spec(self, oas_spec: dict) -> bool:
+        "Async version of `validate_oas_spec`, validating in a worker process"
+        result = await get_validation_engine().avalidate(oas_spec)
+        return result.valid
 
     def retrieve(self, input: str, chunk_limit: int = 1):
         """
         This retriever will return a description of one api plus at most `chunk_limit` YAML specifications of endpoints"""
         return hmrcLoader1.retrieve(input, endpoint_limit=chunk_limit)
+
+    async def aretrieve(self, input: str, chunk_limit: int = 1):
+        "Async version of `retrieve`"
+        return await hmrcLoader1.aretrieve(input, endpoint_limit=chunk_limit)
+
+    def condense(self, chat_history: list[ChatMessage]) -> list[ChatMessage]:
+        "Replace a spec in the last message by its digest, so that any size of spec fits"
+        if not chat_history:
+            return chat_history
+        spec = self.yaml_to_json(chat_history[-1].content)
+        if not (isinstance(spec, dict) and ("openapi" in spec or "swagger" in spec)):
+            return chat_history
+        with stage("oas_digest"):
+            digest = bounded_digest(spec, DIGEST_MAX_TOKENS)
+        return chat_history[:-1] + [
+            ChatMessage(
+                role=chat_history[-1].role,
+                content=f"OpenAPI specification digest:\n{digest}",
+            )
+        ]
+
+    def index_query(
+        self, chat_history: list[ChatMessage]
+    ) -> tuple[str, Optional[Fingerprint]]:
+        "The text to embed and, when it holds a spec, the fingerprint of the last message"
+        content = chat_history[-1].content if chat_history else ""
+        spec = self.yaml_to_json(content)
+        if not (isinstance(spec, dict) and ("openapi" in spec or "swagger" in spec)):
+            return content, None
+        text = describe_spec(spec) or bounded_digest(spec, DIGEST_MAX_TOKENS)
+        return text, fingerprint(spec)
+
+    def rank(self, chat_history: list[ChatMessage]) -> list[DiscoveryMatch]:
+        "The deployed APIs closest to the last message, best first"
+        text, query = self.index_query(chat_history)
+        embedding = self.embed(text)
+        with stage("discovery_index"):
+            return get_discovery_index().search(embedding, query, TOP_K)
+
+    async def arank(self, chat_history: list[ChatMessage]) -> list[DiscoveryMatch]:
+        "Async version of `rank`"
+        text, query = self.index_query(chat_history)
+        embedding = await self.aembed(text)
+        with stage("discovery_index"):
+            return get_discovery_index().search(embedding, query, TOP_K)
+
+    def explain_prompt(
+        self, chat_history: list[ChatMessage], matches: list[DiscoveryMatch]
+    ) -> list[dict]:
+        "Asks the LLM to explain the ranked matches"
+        chunks = [f"{rank}. {m.describe()}" for rank, m in enumerate(matches, 1)]
+        record_retrieved(chunks)
+        context = {"role": "user", "content": "context:\n" + "\n".join(chunks)}
+        return [self.explainprompt] + [m.model_dump() for m in chat_history] + [context]
+
+    def chat_query(self, chat_history: list[ChatMessage], streamed=False):
+        if get_discovery_index() is None:
+            return super().chat_query(self.condense(chat_history), streamed)
+        with stage("retrieval"):
+            matches = self.rank(chat_history)
+        return self.complete(
+            self.explain_prompt(self.condense(chat_history), matches), streamed
+        )
+
+    async def achat_query(self, chat_history: list[ChatMessage], streamed=False):
+        "Async version of `chat_query`"
+        if get_discovery_index() is None:
+            return await super().achat_query(self.condense(chat_history), streamed)
+        with stage("retrieval"):
+            matches = await self.arank(chat_history)
+        return await self.acomplete(
+            self.explain_prompt(self.condense(chat_history), matches), streamed
+        )
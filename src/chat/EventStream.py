@@ -0,0 +1,168 @@
+"""
+Streams a chat answer as Server-Sent Events.
+
+The events, in order:
+- start: sent as soon as the response begins, before any work is done
+- retrieval-done: the context has been retrieved and the completion is starting
+- token: a piece of the answer, `{"text": ...}`
+- done: the whole answer and the time to its first token, `{"content": ..., "ttft_ms": ...}`
+- error: sent instead of the remaining events if something failed, `{"message": ...}`
+
+`spec_events` streams the generation of an OpenAPI spec in the same way, with its own events.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncGenerator, Awaitable, Callable, Optional, Union
+
+from fastapi import Request
+
+from src.oas.Streaming import BlockParser, acheck_block
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import current_timings, mark
+
+logger = logging.getLogger(__name__)
+
+EVENT_STREAM = "text/event-stream"
+# stop caches and proxies (nginx in particular) from buffering the events
+EVENT_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def wants_events(request: Request) -> bool:
+    "Whether the client asked for Server-Sent Events in its Accept header"
+    return EVENT_STREAM in request.headers.get("accept", "")
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _elapsed_ms(started: float) -> float:
+    "Milliseconds since the request started (or since the stream did, outside of a request)"
+    timings = current_timings()
+    origin = timings.started if timings is not None else started
+    return round((time.perf_counter() - origin) * 1000, 1)
+
+
+async def _single(content: str) -> AsyncGenerator[str, None]:
+    yield content
+
+
+async def chat_events(
+    answer: Awaitable[Union[ChatMessage, AsyncGenerator[str, None]]],
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Args:
+        answer: what produces the answer stream, typically a pending `achat_query(..., streamed=True)`;
+            it is only awaited after the start event has been sent
+        on_complete: called with the whole answer once it has been streamed (e.g. to record it in the history)
+    """
+    started = time.perf_counter()
+    try:
+        yield sse("start", {})
+    except GeneratorExit:
+        # the client went away before the answer was started
+        if asyncio.iscoroutine(answer):
+            answer.close()
+        raise
+    try:
+        response = await answer
+        yield sse("retrieval-done", {"elapsed_ms": _elapsed_ms(started)})
+
+        pieces = []
+        ttft_ms = None
+        if isinstance(response, ChatMessage):
+            response = _single(response.content)
+        async for piece in response:
+            if ttft_ms is None:
+                mark("first_token")
+                ttft_ms = _elapsed_ms(started)
+            pieces.append(piece)
+            yield sse("token", {"text": piece})
+
+        content = "".join(pieces)
+        if on_complete is not None:
+            on_complete(content)
+        yield sse("done", {"content": content, "ttft_ms": ttft_ms})
+    except Exception as e:
+        logger.exception("Error while streaming chat events")
+        yield sse("error", {"message": str(e)})
+
+
+async def spec_events(
+    chat,
+    chat_history: list[ChatMessage],
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Streams the generation of an OpenAPI spec by a SingleShotAgentCreate.
+
+    The events, in order:
+    - start: sent as soon as the response begins
+    - token: a piece of the YAML, `{"text": ...}`
+    - block: a top-level block has been parsed and the spec so far validated,
+      `{"key": ..., "line": ..., "valid": ..., "errors": [...]}`; sent as soon as it is ready,
+      between the tokens that follow the block
+    - done: the validated (and, where needed, repaired) spec,
+      `{"content": ..., "valid": ..., "errors": [...], "attempts": ..., "cached": ..., "ttft_ms": ...}`
+    - error: sent instead of the remaining events if something failed, `{"message": ...}`
+
+    Args:
+        on_complete: called with the spec once it is valid (e.g. to record it in the history)
+    """
+    started = time.perf_counter()
+    yield sse("start", {})
+    checks: list[asyncio.Task] = []
+    try:
+        generation = chat.cached_generation(chat_history)
+        ttft_ms = None
+        if generation is not None:
+            yield sse("token", {"text": generation.content})
+        else:
+            deadline = time.monotonic() + chat.time_budget
+            stream = await chat.acomplete(chat.messages(chat_history), streamed=True)
+            parser = BlockParser()
+            pieces = []
+            async for piece in stream:
+                if ttft_ms is None:
+                    mark("first_token")
+                    ttft_ms = _elapsed_ms(started)
+                pieces.append(piece)
+                yield sse("token", {"text": piece})
+                for block in parser.feed(piece):
+                    checks.append(
+                        asyncio.ensure_future(acheck_block(block, dict(parser.blocks)))
+                    )
+                # the checks run while the generation goes on, report those that are done
+                while checks and checks[0].done():
+                    yield sse("block", checks.pop(0).result().as_dict())
+            for block in parser.close():
+                checks.append(
+                    asyncio.ensure_future(acheck_block(block, dict(parser.blocks)))
+                )
+            while checks:
+                yield sse("block", (await checks.pop(0)).as_dict())
+            generation = await chat.arepair("".join(pieces), chat_history, deadline)
+
+        if generation.valid and on_complete is not None:
+            on_complete(generation.content)
+        yield sse(
+            "done",
+            {
+                "content": generation.content,
+                "valid": generation.valid,
+                "errors": generation.errors,
+                "attempts": generation.attempts,
+                "cached": generation.cached,
+                "ttft_ms": ttft_ms,
+            },
+        )
+    except Exception as e:
+        logger.exception("Error while streaming spec events")
+        yield sse("error", {"message": str(e)})
+    finally:
+        for check in checks:
+            check.cancel()
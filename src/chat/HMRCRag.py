@@ -1,8 +1,19 @@
 """a class that implements SimpleRAG but uses a different prompt and handles the weird HMRC vector database chunking stuff"""
 
+from typing import AsyncGenerator, Generator, Optional
+
 from src.loaders import hmrcLoader1
 from src.chat.HistoryRAG import HistoryRAG
+from src.clients.ClientRegistry import ClientRegistry
+from src.cache.ResponseCache import (
+    SemanticResponseCache,
+    areplay,
+    document_ids,
+    replay,
+)
 from src.prompts import HMRC_Prompt
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import stage
 
 # Chat -> SimpleRAG -> HistoryRAG -> HMRCRag
 
@@ -13,7 +24,85 @@ class HMRCRAG(HistoryRAG):
         "content": HMRC_Prompt,
     }
 
+    def __init__(self, clients: Optional[ClientRegistry] = None):
+        super().__init__(clients)
+        self.response_cache = SemanticResponseCache.from_env()
+
     def retrieve(self, input: str, chunk_limit: int = 1):
         """
         This retriever will return a description of one api plus at most `chunk_limit` YAML specifications of endpoints"""
         return hmrcLoader1.retrieve(input, endpoint_limit=chunk_limit)
+
+    async def aretrieve(self, input: str, chunk_limit: int = 1):
+        "Async version of `retrieve`"
+        return await hmrcLoader1.aretrieve(input, endpoint_limit=chunk_limit)
+
+    def _store_stream(self, stream, embedding, ids) -> Generator[str, None, None]:
+        "Pass a completion stream through and cache the answer once it has finished"
+        pieces = []
+        for piece in stream:
+            pieces.append(piece)
+            yield piece
+        self.response_cache.store(embedding, ids, "".join(pieces))
+
+    async def _astore_stream(self, stream, embedding, ids) -> AsyncGenerator[str, None]:
+        "Async version of `_store_stream`"
+        pieces = []
+        async for piece in stream:
+            pieces.append(piece)
+            yield piece
+        self.response_cache.store(embedding, ids, "".join(pieces))
+
+    def chat_query(
+        self, chat_history: list[ChatMessage], streamed=False
+    ) -> ChatMessage | Generator[str, None, None]:
+        """
+        Like `RagChat.chat_query`, but answers are reused for queries that retrieved the same
+        documents and whose embeddings are similar enough (see SemanticResponseCache).
+        """
+        with stage("retrieval"):
+            query, chunks = self.get_query_and_chunks(chat_history)
+            # already computed (and cached) by the retrieval
+            embedding = self.embed(query)
+
+        ids = document_ids(chunks)
+        with stage("response_cache"):
+            answer = self.response_cache.lookup(embedding, ids)
+        if answer is not None:
+            return (
+                replay(answer)
+                if streamed
+                else ChatMessage(role="assistant", content=answer)
+            )
+
+        response = self.complete(self.build_prompt(chat_history, chunks), streamed)
+        if streamed:
+            return self._store_stream(response, embedding, ids)
+        self.response_cache.store(embedding, ids, response.content)
+        return response
+
+    async def achat_query(
+        self, chat_history: list[ChatMessage], streamed=False
+    ) -> ChatMessage | AsyncGenerator[str, None]:
+        "Async version of `chat_query`"
+        with stage("retrieval"):
+            query, chunks = await self.aget_query_and_chunks(chat_history)
+            embedding = await self.aembed(query)
+
+        ids = document_ids(chunks)
+        with stage("response_cache"):
+            answer = self.response_cache.lookup(embedding, ids)
+        if answer is not None:
+            return (
+                areplay(answer)
+                if streamed
+                else ChatMessage(role="assistant", content=answer)
+            )
+
+        response = await self.acomplete(
+            self.build_prompt(chat_history, chunks), streamed
+        )
+        if streamed:
+            return self._astore_stream(response, embedding, ids)
+        self.response_cache.store(embedding, ids, response.content)
+        return response
@@ -1,7 +1,10 @@
 "A version of Simple RAG that intelligently creates the retrieval query for better retrieval in long chats"
 
+from typing import Optional
+
 from src.chat.SimpleRAG import RagChat
-from src.prompts import HistoryRetrievalPrompt
+from src.clients.ClientRegistry import ClientRegistry
+from src.retrieval.QueryRewriter import QueryRewriter
 from src.schemas.ChatSchemas import ChatMessage
 from icecream import ic
 
@@ -9,6 +12,31 @@ from icecream import ic
 
 
 class HistoryRAG(RagChat):
+    def __init__(self, clients: Optional[ClientRegistry] = None):
+        super().__init__(clients)
+        self.rewriter = QueryRewriter(llm=self.llm)
+
+    def get_query_and_chunks(self, chat_history: list[ChatMessage]) -> tuple[str, list]:
+        """
+        Returns the retrieval query and what it retrieved. The query comes from the
+        QueryRewriter, which only calls the LLM when the latest user turn depends on the
+        earlier ones and the rewrite is not cached.
+        """
+        retrieval_query = self.rewriter.rewrite(chat_history)
+
+        ic(retrieval_query)
+        return retrieval_query, self.retrieve(retrieval_query)
+
+    async def aget_query_and_chunks(
+        self, chat_history: list[ChatMessage]
+    ) -> tuple[str, list]:
+        "Async version of `get_query_and_chunks`, retrieval may start speculatively on the raw message"
+
+        async def retrieve(query: str) -> tuple[str, list]:
+            return query, await self.aretrieve(query)
+
+        return await self.rewriter.aretrieve(chat_history, retrieve)
+
     def get_context(self, chat_history: list[ChatMessage]) -> list[dict]:
         """
         Augments the chat history with the context and returns it in openai chat format to be passed to an llm:
@@ -21,28 +49,12 @@ class HistoryRAG(RagChat):
         Returns:
             list[dict]
         """
-        if len(chat_history) > 2:
-            prompt = [
-                {"role": "user", "content": HistoryRetrievalPrompt + str(chat_history)}
-            ]
-
-            response = self.llm.completion(
-                "azure/rag_pocs", messages=prompt, temperature=0, max_tokens=200
-            )
+        _, chunks = self.get_query_and_chunks(chat_history)
 
-            retrieval_query = response.choices[0].message.content
-
-        else:
-            retrieval_query = str(chat_history[0].content)
-
-        ic(retrieval_query)
-        chunks = self.retrieve(retrieval_query)
+        return self.build_prompt(chat_history, chunks)
 
-        context = {"role": "user", "content": "context: " + str(chunks)}
-        prompt = (
-            [type(self).systemprompt]
-            + [m.model_dump() for m in chat_history]
-            + [context]
-        )
+    async def aget_context(self, chat_history: list[ChatMessage]) -> list[dict]:
+        "Async version of `get_context`"
+        _, chunks = await self.aget_query_and_chunks(chat_history)
 
-        return prompt
+        return self.build_prompt(chat_history, chunks)
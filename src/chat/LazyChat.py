@@ -0,0 +1,50 @@
+"Builds a Chat object (and imports its module) the first time it is needed"
+
+import asyncio
+import importlib
+import threading
+
+from src.chat.Chat import Chat
+from src.chat.CoalescingChat import CoalescingChat
+from src.telemetry.Startup import startup_step
+
+
+class LazyChat:
+    """
+    Holds the import path of a Chat class and the arguments to build it with, e.g.
+    `LazyChat("src.chat.HMRCRag.HMRCRAG")`. The module is imported and the object built once,
+    on the first call to `get` (or `aget`); both steps are recorded in the startup report.
+    With `coalesce=True` the object is wrapped in a CoalescingChat, so that identical
+    concurrent queries share their computation.
+    """
+
+    def __init__(self, chat_class_path: str, coalesce: bool = False, **kwargs):
+        self.chat_class_path = chat_class_path
+        self.coalesce = coalesce
+        self.kwargs = kwargs
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> Chat:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    module_name, class_name = self.chat_class_path.rsplit(".", 1)
+                    with startup_step(module_name, "import"):
+                        module = importlib.import_module(module_name)
+                    with startup_step(class_name):
+                        chat = getattr(module, class_name)(**self.kwargs)
+                    if self.coalesce:
+                        chat = CoalescingChat(chat)
+                    self._instance = chat
+        return self._instance
+
+    async def aget(self) -> Chat:
+        "Like `get`, but building happens in a thread so the event loop is not blocked"
+        if self._instance is not None:
+            return self._instance
+        return await asyncio.to_thread(self.get)
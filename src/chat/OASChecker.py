@@ -0,0 +1,255 @@
+"""a SingleShotAgent for /oas-checker that runs the rule engine before asking the LLM anything"""
+
+import asyncio
+import itertools
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import AsyncGenerator, Generator, List, Optional, Union
+
+from src.chat.SingleShotAgent import SingleShotAgent
+from src.clients.ClientRegistry import ClientRegistry
+from src.oas.Digest import spec_digest, spec_shards
+from src.oas.Review import (
+    Partition,
+    format_review,
+    get_review_executor,
+    parse_findings,
+    partition_spec,
+    reduce_findings,
+    review_slots,
+)
+from src.oas.Rules import Finding, check_spec, format_findings
+from src.oas.Validation import get_validation_engine
+from src.prompts import OASPartitionReviewPrompt, OASReviewPrompt
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import run_in_context, stage
+from src.telemetry.Tokens import count_tokens
+
+# Chat -> SingleShotAgent -> OASCheckerAgent
+
+
+def _operation(finding: Finding) -> str:
+    "The `METHOD /path` a finding is about (locations such as `GET /a responses/404` included)"
+    return " ".join(finding.location.split(" ")[:2])
+
+
+class OASCheckerAgent(SingleShotAgent):
+    """
+    The findings of the rule engine (src/oas/Rules.py) are answered straight away, and the LLM
+    only gets a digest of the spec and the questions the rules cannot answer, instead of the
+    whole file. Messages that are not specifications go to the LLM with the system prompt as before.
+
+    A spec whose digest is longer than OAS_DIGEST_MAX_TOKENS is split into shards of the
+    operations of each tag, reviewed concurrently (at most OAS_SHARD_CONCURRENCY at a time).
+
+    With OAS_REVIEW_MODE=map-reduce the LLM reviews the operations themselves instead of the
+    digest: the spec is partitioned by path and operation (OAS_REVIEW_PARTITION_TOKENS each),
+    the partitions are reviewed concurrently and their findings merged (see src/oas/Review.py).
+    """
+
+    reviewprompt = {"role": "system", "content": OASReviewPrompt}
+    partitionprompt = {"role": "system", "content": OASPartitionReviewPrompt}
+
+    def __init__(
+        self, sysPromptContent="No content", clients: Optional[ClientRegistry] = None
+    ):
+        super().__init__(sysPromptContent, clients)
+        self.max_digest_tokens = int(os.getenv("OAS_DIGEST_MAX_TOKENS", "6000"))
+        self.shard_concurrency = int(os.getenv("OAS_SHARD_CONCURRENCY", "4"))
+        self.review_mode = os.getenv("OAS_REVIEW_MODE", "digest")
+        self.partition_tokens = int(os.getenv("OAS_REVIEW_PARTITION_TOKENS", "1500"))
+
+    def spec(self, chat_history: List[ChatMessage]) -> Optional[dict]:
+        "The parsed spec of the last message, if it is one"
+        if not chat_history:
+            return None
+        spec = self.yaml_to_json(chat_history[-1].content)
+        if isinstance(spec, dict) and ("openapi" in spec or "swagger" in spec):
+            return spec
+        return None
+
+    def review_messages(self, digest: str, findings: list[Finding]) -> list[dict]:
+        return [
+            self.reviewprompt,
+            {
+                "role": "user",
+                "content": f"Specification digest:\n{digest}\n\n"
+                + format_findings(findings),
+            },
+        ]
+
+    def reviews(
+        self, spec: dict, findings: list[Finding]
+    ) -> list[tuple[Optional[str], list[dict]]]:
+        "The (shard name, messages) of the reviews a spec needs: one, or one per shard"
+        with stage("oas_digest"):
+            digest = spec_digest(spec)
+            if count_tokens(digest) <= self.max_digest_tokens:
+                return [(None, self.review_messages(digest, findings))]
+            return [
+                (
+                    shard.name,
+                    self.review_messages(
+                        shard.digest,
+                        [f for f in findings if _operation(f) in shard.operations],
+                    ),
+                )
+                for shard in spec_shards(spec, self.max_digest_tokens)
+            ]
+
+    def _findings(self, spec: dict, validation) -> tuple[list[Finding], str]:
+        with stage("oas_rules"):
+            findings = check_spec(spec, validation)
+        return findings, format_findings(findings) + "\n\n"
+
+    @staticmethod
+    def _section(name: str, review: str) -> str:
+        return f"#### Review of {name}\n{review}\n\n"
+
+    def partition_messages(self, partition: Partition) -> list[dict]:
+        return [self.partitionprompt, {"role": "user", "content": partition.content}]
+
+    def map_reduce(self, spec: dict) -> str:
+        "Review the partitions of the spec in the shared review threads and merge their findings"
+        partitions = partition_spec(spec, self.partition_tokens)
+
+        def review(partition: Partition):
+            response = self.complete(self.partition_messages(partition))
+            return parse_findings(response.content, partition)
+
+        executor = get_review_executor()
+        with stage("oas_review_map"):
+            futures = [run_in_context(executor, review, p) for p in partitions]
+            findings = [f for future in futures for f in future.result()]
+        return format_review(reduce_findings(findings))
+
+    async def amap_reduce(self, spec: dict) -> str:
+        "Async version of `map_reduce`, sharing the process wide concurrency limit"
+        partitions = await asyncio.to_thread(
+            partition_spec, spec, self.partition_tokens
+        )
+        slots = review_slots()
+
+        async def review(partition: Partition):
+            async with slots:
+                response = await self.acomplete(self.partition_messages(partition))
+            return parse_findings(response.content, partition)
+
+        with stage("oas_review_map"):
+            results = await asyncio.gather(*(review(p) for p in partitions))
+        return format_review(reduce_findings([f for r in results for f in r]))
+
+    def chat_query(
+        self, chat_history: List[ChatMessage], streamed: bool = False
+    ) -> Union[ChatMessage, Generator[str, None, None]]:
+        spec = self.spec(chat_history)
+        if spec is None:
+            return super().chat_query(chat_history, streamed)
+
+        findings, report = self._findings(spec, get_validation_engine().validate(spec))
+        if self.review_mode == "map-reduce":
+            if not streamed:
+                return ChatMessage(
+                    role="assistant", content=report + self.map_reduce(spec)
+                )
+
+            def stream_review():
+                yield report
+                yield self.map_reduce(spec)
+
+            return stream_review()
+
+        reviews = self.reviews(spec, findings)
+        if len(reviews) == 1:
+            review = self.complete(reviews[0][1], streamed)
+            if not streamed:
+                return ChatMessage(role="assistant", content=report + review.content)
+            return itertools.chain([report], review)
+
+        sections = self._threaded_shard_reviews(reviews)
+        if not streamed:
+            return ChatMessage(role="assistant", content=report + "".join(sections))
+        return itertools.chain([report], sections)
+
+    def _threaded_shard_reviews(
+        self, reviews: list[tuple[Optional[str], list[dict]]]
+    ) -> Generator[str, None, None]:
+        """
+        Review the shards in the shared review threads, at most OAS_SHARD_CONCURRENCY at a
+        time, yielding each shard's section as soon as it is ready
+        """
+        executor = get_review_executor()
+        waiting = iter(reviews)
+        running: set[Future] = set()
+
+        def review(name: str, messages: list[dict]) -> str:
+            return self._section(name, self.complete(messages).content)
+
+        def submit():
+            for name, messages in itertools.islice(
+                waiting, self.shard_concurrency - len(running)
+            ):
+                running.add(run_in_context(executor, review, name, messages))
+
+        submit()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            running.difference_update(done)
+            submit()
+            for future in done:
+                yield future.result()
+
+    def _shard_reviews(self, reviews: list[tuple[Optional[str], list[dict]]]) -> list:
+        "A coroutine per shard, reviewing it once one of OAS_SHARD_CONCURRENCY slots is free"
+        semaphore = asyncio.Semaphore(self.shard_concurrency)
+
+        async def review(name: str, messages: list[dict]) -> str:
+            async with semaphore:
+                return self._section(name, (await self.acomplete(messages)).content)
+
+        return [review(*r) for r in reviews]
+
+    async def achat_query(
+        self, chat_history: List[ChatMessage], streamed: bool = False
+    ) -> Union[ChatMessage, AsyncGenerator[str, None]]:
+        """
+        Async version of `chat_query`, validating in a worker process and running the rules,
+        digests and partitioning (hundreds of milliseconds for a large spec) in threads
+        """
+        spec = self.spec(chat_history)
+        if spec is None:
+            return await super().achat_query(chat_history, streamed)
+
+        validation = await get_validation_engine().avalidate(spec)
+        findings, report = await asyncio.to_thread(self._findings, spec, validation)
+        if self.review_mode == "map-reduce":
+            if not streamed:
+                review = await self.amap_reduce(spec)
+                return ChatMessage(role="assistant", content=report + review)
+
+            async def stream_review():
+                yield report
+                yield await self.amap_reduce(spec)
+
+            return stream_review()
+
+        reviews = await asyncio.to_thread(self.reviews, spec, findings)
+        if not streamed:
+            if len(reviews) == 1:
+                review = await self.acomplete(reviews[0][1])
+                return ChatMessage(role="assistant", content=report + review.content)
+            sections = await asyncio.gather(*self._shard_reviews(reviews))
+            return ChatMessage(role="assistant", content=report + "".join(sections))
+
+        async def stream_response():
+            # the findings are sent before the LLM is even called
+            yield report
+            if len(reviews) == 1:
+                async for piece in await self.acomplete(reviews[0][1], streamed=True):
+                    yield piece
+            else:
+                # each shard's review is sent as soon as it is ready
+                for section in asyncio.as_completed(self._shard_reviews(reviews)):
+                    yield await section
+
+        return stream_response()
@@ -1,11 +1,19 @@
 "A simple minimal implementation of RAG that uses the AstraDB and AzureOpenAI APIs"
 
-import litellm
-from astrapy import DataAPIClient
 from dotenv import load_dotenv
 from src.chat.Chat import Chat
+from src.cache.EmbeddingCache import get_embedding_cache
+from src.clients.ClientRegistry import ClientRegistry, get_client_registry
+from src.telemetry.Timings import stage
+from src.telemetry.Usage import (
+    ainstrument_stream,
+    instrument_stream,
+    record_completion,
+    record_prompt,
+    record_retrieved,
+)
 import os
-from typing import Generator
+from typing import AsyncGenerator, Generator, Optional
 from src.prompts import standard_rag_system_prompt
 from src.schemas.ChatSchemas import ChatMessage
 
@@ -21,16 +29,16 @@ class RagChat(Chat):
     It is designed to be highly modular so that one can easily create a derived class and just change one part of it such as the retrieval strategy.
     """
 
-    def __init__(self):
-        "Initialises the various clients"
-        client = DataAPIClient(os.getenv("ASTRA_DB_APPLICATION_TOKEN"))
-        database = client.get_database(
-            os.getenv("ASTRA_DB_API_ENDPOINT"), keyspace=os.getenv("ASTRA_DB_KEYSPACE")
+    def __init__(self, clients: Optional[ClientRegistry] = None):
+        "Takes the various clients from the shared registry"
+        self.clients = clients or get_client_registry()
+        keyspace = os.getenv("ASTRA_DB_KEYSPACE")
+        collection_name = os.getenv("DS_COLLECTION_NAME", "funding_for_farmers")
+        self.vectordb = self.clients.astra_collection(collection_name, keyspace)
+        self.async_vectordb = self.clients.async_astra_collection(
+            collection_name, keyspace
         )
-        self.vectordb = database.get_collection(
-            os.getenv("DS_COLLECTION_NAME", "funding_for_farmers")
-        )
-        self.llm = litellm
+        self.llm = self.clients.litellm()
 
     implements_streaming = True
 
@@ -39,13 +47,30 @@ class RagChat(Chat):
         "content": standard_rag_system_prompt,
     }
 
+    embedding_model = "azure/text-embedding-ada-002"
+
     def embed(self, input: str) -> list[float]:
-        "A function that calls the embed client to get the vector embedding of a given string"
-        embedding = self.llm.embedding(
-            "azure/text-embedding-ada-002",
-            input=input,
-        ).data[0]["embedding"]
-        return embedding
+        "A function that calls the embed client to get the vector embedding of a given string (cached)"
+
+        def compute(text: str) -> list[float]:
+            return self.llm.embedding(self.embedding_model, input=text).data[0][
+                "embedding"
+            ]
+
+        return get_embedding_cache().get_or_compute(
+            self.embedding_model, input, compute
+        )
+
+    async def aembed(self, input: str) -> list[float]:
+        "Async version of `embed`"
+
+        async def compute(text: str) -> list[float]:
+            response = await self.llm.aembedding(self.embedding_model, input=text)
+            return response.data[0]["embedding"]
+
+        return await get_embedding_cache().aget_or_compute(
+            self.embedding_model, input, compute
+        )
 
     def retrieve(self, input: str, chunk_limit=5) -> list[str]:
         embedding = self.embed(input)
@@ -56,6 +81,28 @@ class RagChat(Chat):
         )
         return [c["content"] for c in chunks]
 
+    async def aretrieve(self, input: str, chunk_limit=5) -> list[str]:
+        "Async version of `retrieve`"
+        embedding = await self.aembed(input)
+        chunks = self.async_vectordb.find(
+            {},
+            sort={"$vector": embedding},
+            limit=chunk_limit,
+        )
+        return [c["content"] async for c in chunks]
+
+    def build_prompt(self, chat_history: list[ChatMessage], chunks: list) -> list[dict]:
+        "Puts the system prompt, the chat history and the retrieved chunks together in openai chat format"
+        record_retrieved(chunks)
+        context = {"role": "user", "content": "context: " + str(chunks)}
+        prompt = (
+            [type(self).systemprompt]
+            + [m.model_dump() for m in chat_history]
+            + [context]
+        )
+
+        return prompt
+
     def get_context(self, chat_history: list[ChatMessage]) -> list[dict]:
         """
         Augments the chat history with the context and returns it in openai chat format to be passed to an llm:
@@ -74,14 +121,73 @@ class RagChat(Chat):
             )  # this is a kind of dodgy way of using the history for retrieval???
         )
 
-        context = {"role": "user", "content": "context: " + str(chunks)}
-        prompt = (
-            [type(self).systemprompt]
-            + [m.model_dump() for m in chat_history]
-            + [context]
-        )
+        return self.build_prompt(chat_history, chunks)
 
-        return prompt
+    async def aget_context(self, chat_history: list[ChatMessage]) -> list[dict]:
+        "Async version of `get_context`"
+        chunks = await self.aretrieve(str(chat_history))
+
+        return self.build_prompt(chat_history, chunks)
+
+    def complete(
+        self, prompt: list[dict], streamed=False
+    ) -> ChatMessage | Generator[str, None, None]:
+        "Calls the LLM on a prepared prompt"
+        record_prompt(prompt)
+        with stage("completion"):
+            response = self.llm.completion(
+                "azure/rag_pocs",
+                messages=prompt,
+                temperature=0.2,
+                max_tokens=500,
+                stream=streamed,
+            )
+
+        if not streamed:
+            record_completion(response)
+            m: str = response.choices[0].message
+            cm: ChatMessage = ChatMessage(role=m.role, content=m.content)
+            return cm
+        else:
+
+            def stream_response():
+                for chunk in response:
+                    if chunk and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+            return instrument_stream(stream_response())
+
+    async def acomplete(
+        self, prompt: list[dict], streamed=False
+    ) -> ChatMessage | AsyncGenerator[str, None]:
+        """
+        Async version of `complete`. A streamed completion is only requested once the stream
+        is iterated, so callers get the stream (and can report that retrieval is done) straight away.
+        """
+        record_prompt(prompt)
+
+        async def request(stream: bool):
+            with stage("completion"):
+                return await self.llm.acompletion(
+                    "azure/rag_pocs",
+                    messages=prompt,
+                    temperature=0.2,
+                    max_tokens=500,
+                    stream=stream,
+                )
+
+        if not streamed:
+            response = await request(False)
+            record_completion(response)
+            m = response.choices[0].message
+            return ChatMessage(role=m.role, content=m.content)
+
+        async def stream_response():
+            async for chunk in await request(True):
+                if chunk and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        return ainstrument_stream(stream_response())
 
     def chat_query(
         self, chat_history: list[ChatMessage], streamed=False
@@ -97,25 +203,26 @@ class RagChat(Chat):
             ChatMessage
         """
 
-        prompt = self.get_context(chat_history)
+        with stage("retrieval"):
+            prompt = self.get_context(chat_history)
 
-        response = self.llm.completion(
-            "azure/rag_pocs",
-            messages=prompt,
-            temperature=0.2,
-            max_tokens=500,
-            stream=streamed,
-        )
+        return self.complete(prompt, streamed)
 
-        if not streamed:
-            m: str = response.choices[0].message
-            cm: ChatMessage = ChatMessage(role=m.role, content=m.content)
-            return cm
-        else:
+    async def achat_query(
+        self, chat_history: list[ChatMessage], streamed=False
+    ) -> ChatMessage | AsyncGenerator[str, None]:
+        """
+        Async version of `chat_query`, the completion is awaited (or streamed) on the event loop.
 
-            def stream_response():
-                for chunk in response:
-                    if chunk and chunk.choices[0].delta.content:
-                        yield chunk.choices[0].delta.content
+        Args:
+            chat_history (list[ChatMessage]): The conversation history.
+            streamed (bool): whether or not to stream the response
+
+        Returns:
+            ChatMessage | AsyncGenerator[str, None]
+        """
+
+        with stage("retrieval"):
+            prompt = await self.aget_context(chat_history)
 
-            return stream_response()
+        return await self.acomplete(prompt, streamed)
@@ -1,13 +1,20 @@
 import os
-from openai import AzureOpenAI
 from dotenv import load_dotenv
 from src.chat.Chat import Chat
+from src.clients.ClientRegistry import ClientRegistry, get_client_registry
+from src.oas.Parsing import parse_spec
+from src.oas.Validation import get_validation_engine
 from src.schemas.ChatSchemas import ChatMessage
-from typing import Generator, List, Union
+from src.telemetry.Timings import stage
+from src.telemetry.Usage import (
+    ainstrument_stream,
+    instrument_stream,
+    record_completion,
+    record_prompt,
+)
+from typing import AsyncGenerator, Generator, List, Optional, Union
 import logging
-import yaml
 import json
-from openapi_spec_validator import validate
 
 load_dotenv()
 
@@ -29,7 +36,9 @@ class SingleShotAgent(Chat):
 
     implements_streaming = True
 
-    def __init__(self, sysPromptContent="No content"):
+    def __init__(
+        self, sysPromptContent="No content", clients: Optional[ClientRegistry] = None
+    ):
         """Initialize the Azure OpenAI client and set up the system prompt"""
         self.endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
         self.deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_OAS")
@@ -39,12 +48,10 @@ class SingleShotAgent(Chat):
             logger.error("Missing Azure OpenAI environment variables.")
             raise ValueError("Missing Azure OpenAI environment variables.")
 
-        # Initialize Azure OpenAI Service client with key-based authentication
-        self.client = AzureOpenAI(
-            azure_endpoint=self.endpoint,
-            api_key=self.subscription_key,
-            api_version="2024-05-01-preview",
-        )
+        # Azure OpenAI Service clients (key-based authentication) sharing the pooled connections
+        self.clients = clients or get_client_registry()
+        self.client = self.clients.azure_openai()
+        self.async_client = self.clients.async_azure_openai()
 
         # Use the provided system prompt or the default OASCheckerPrompt
         self.systemprompt = {
@@ -63,8 +70,8 @@ class SingleShotAgent(Chat):
         str: The converted JSON string
         """
         try:
-            # Parse YAML string to Python dictionary
-            yaml_dict: dict = yaml.safe_load(yaml_string)
+            # Parse YAML (or JSON) string to Python dictionary, see src/oas/Parsing.py
+            yaml_dict: dict = parse_spec(yaml_string)
             return yaml_dict
         except Exception as e:
             return f"Error converting YAML to JSON: {str(e)}"
@@ -79,14 +86,17 @@ class SingleShotAgent(Chat):
         Returns:
             bool: True if the OAS is valid, False otherwise.
         """
-        try:
-            # Parse the OAS spec
-            # Validate the OAS spec
-            validate(oas_spec)
-            return True
-        except Exception as e:
-            logger.error(f"OpenAPI Specification validation error: {e}")
-            return False
+        result = get_validation_engine().validate(oas_spec)
+        if not result.valid:
+            logger.error(f"OpenAPI Specification validation errors: {result.errors}")
+        return result.valid
+
+    async def avalidate_oas_spec(self, oas_spec: dict) -> bool:
+        "Async version of `validate_oas_spec`, validating in a worker process"
+        result = await get_validation_engine().avalidate(oas_spec)
+        if not result.valid:
+            logger.error(f"OpenAPI Specification validation errors: {result.errors}")
+        return result.valid
 
     def chat_query(
         self, chat_history: List[ChatMessage], streamed: bool = False
@@ -105,24 +115,33 @@ class SingleShotAgent(Chat):
         for message in chat_history:
             messages.append({"role": message.role, "content": message.content})
 
+        return self.complete(messages, streamed)
+
+    def complete(
+        self, messages: list[dict], streamed: bool = False
+    ) -> Union[ChatMessage, Generator[str, None, None]]:
+        "Calls the LLM on prepared messages"
+        record_prompt(messages)
         try:
-            completion = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=messages,
-                max_tokens=800,
-                temperature=0.7,
-                top_p=0.95,
-                frequency_penalty=0,
-                presence_penalty=0,
-                stop=None,
-                stream=streamed,
-            )
+            with stage("completion"):
+                completion = self.client.chat.completions.create(
+                    model=self.deployment,
+                    messages=messages,
+                    max_tokens=800,
+                    temperature=0.7,
+                    top_p=0.95,
+                    frequency_penalty=0,
+                    presence_penalty=0,
+                    stop=None,
+                    stream=streamed,
+                )
         except Exception as e:
             logger.exception("Error during OpenAI completion call")
             raise RuntimeError(f"OpenAI completion error: {e}")
 
         if not streamed:
             try:
+                record_completion(completion)
                 response_content = completion.choices[0].message.content
                 return ChatMessage(role="assistant", content=response_content)
             except Exception as e:
@@ -139,4 +158,65 @@ class SingleShotAgent(Chat):
                     logger.exception("Error during streaming OpenAI response")
                     raise RuntimeError(f"Error during streaming OpenAI response: {e}")
 
-            return stream_response()
+            return instrument_stream(stream_response())
+
+    async def achat_query(
+        self, chat_history: List[ChatMessage], streamed: bool = False
+    ) -> Union[ChatMessage, AsyncGenerator[str, None]]:
+        """
+        Async version of `chat_query` using the AsyncAzureOpenAI client.
+
+        Args:
+            chat_history (list[ChatMessage]): The conversation history.
+            streamed (bool): whether or not to stream the response
+
+        Returns:
+            ChatMessage or async generator for streaming
+        """
+        messages = [self.systemprompt]
+        for message in chat_history:
+            messages.append({"role": message.role, "content": message.content})
+
+        return await self.acomplete(messages, streamed)
+
+    async def acomplete(
+        self, messages: list[dict], streamed: bool = False
+    ) -> Union[ChatMessage, AsyncGenerator[str, None]]:
+        "Async version of `complete`"
+        record_prompt(messages)
+        try:
+            with stage("completion"):
+                completion = await self.async_client.chat.completions.create(
+                    model=self.deployment,
+                    messages=messages,
+                    max_tokens=800,
+                    temperature=0.7,
+                    top_p=0.95,
+                    frequency_penalty=0,
+                    presence_penalty=0,
+                    stop=None,
+                    stream=streamed,
+                )
+        except Exception as e:
+            logger.exception("Error during OpenAI completion call")
+            raise RuntimeError(f"OpenAI completion error: {e}")
+
+        if not streamed:
+            try:
+                record_completion(completion)
+                response_content = completion.choices[0].message.content
+                return ChatMessage(role="assistant", content=response_content)
+            except Exception as e:
+                logger.exception("Error parsing OpenAI response")
+                raise RuntimeError(f"Error parsing OpenAI response: {e}")
+
+        async def stream_response():
+            try:
+                async for chunk in completion:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                logger.exception("Error during streaming OpenAI response")
+                raise RuntimeError(f"Error during streaming OpenAI response: {e}")
+
+        return ainstrument_stream(stream_response())
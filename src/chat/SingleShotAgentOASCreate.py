@@ -1,141 +1,205 @@
+import asyncio
+import logging
 import os
-from openai import AzureOpenAI
-from dotenv import load_dotenv
-from src.chat.Chat import Chat
+import time
+from typing import Any, Generator, List, Optional
+
+from src.cache.LRUCache import LRUCache
+from src.chat.SingleShotAgent import SingleShotAgent
+from src.clients.ClientRegistry import ClientRegistry
+from src.oas.Parsing import SpecParseError, parse_spec
+from src.oas.Repair import (
+    Generation,
+    Patch,
+    apply_patches,
+    get_repair_executor,
+    line_patch,
+    node_patches,
+    repair_messages,
+    request_key,
+    strip_fences,
+)
+from src.oas.Validation import get_validation_engine
 from src.schemas.ChatSchemas import ChatMessage
-from typing import Generator, List, Union
-import logging
-import yaml
-import json
-from openapi_spec_validator import validate
-
-load_dotenv()
+from src.telemetry.Timings import run_in_context, stage
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    import sys
-
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
-    logger.addHandler(handler)
 
 
-class SingleShotAgentCreate(Chat):
+class SingleShotAgentCreate(SingleShotAgent):
     """
-    This class implements the Chat interface for OAS checking functionality.
-    It uses Azure OpenAI to validate OAS specifications.
+    A SingleShotAgent for OAS creation: generated specs are validated and repaired (see
+    src/oas/Repair.py) and the valid ones cached by the request text.
     """
 
-    implements_streaming = False
-
-    def __init__(self, sysPromptContent="No content"):
-        """Initialize the Azure OpenAI client and set up the system prompt"""
-        self.endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        self.deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_OAS")
-        self.subscription_key = os.getenv("AZURE_OPENAI_API_KEY")
-
-        if not self.endpoint or not self.deployment or not self.subscription_key:
-            logger.error("Missing Azure OpenAI environment variables.")
-            raise ValueError("Missing Azure OpenAI environment variables.")
-
-        # Initialize Azure OpenAI Service client with key-based authentication
-        self.client = AzureOpenAI(
-            azure_endpoint=self.endpoint,
-            api_key=self.subscription_key,
-            api_version="2024-05-01-preview",
+    def __init__(
+        self, sysPromptContent="No content", clients: Optional[ClientRegistry] = None
+    ):
+        super().__init__(sysPromptContent, clients)
+        # generate-validate-repair loop, see src/oas/Repair.py
+        self.max_repairs = int(os.getenv("OAS_CREATE_MAX_REPAIRS", "2"))
+        self.time_budget = float(os.getenv("OAS_CREATE_TIME_BUDGET_SECONDS", "60"))
+        self.generations = LRUCache(
+            max_entries=int(os.getenv("OAS_CREATE_CACHE_SIZE", "256")),
+            ttl_seconds=float(os.getenv("OAS_CREATE_CACHE_TTL", "86400")),
         )
 
-        # Use the provided system prompt or the default OASCheckerPrompt
-        self.systemprompt = {
-            "role": "system",
-            "content": [{"type": "text", "text": sysPromptContent}],
-        }
-
-    def yaml_to_json(self, yaml_string):
-        """
-        Convert a YAML string to JSON string
-
-        Parameters:
-        yaml_string (str): The YAML content as a string
+    def messages(self, chat_history: List[ChatMessage]) -> list[dict]:
+        messages = [self.systemprompt]
+        for message in chat_history:
+            messages.append({"role": message.role, "content": message.content})
+        return messages
 
-        Returns:
-        str: The converted JSON string
-        """
+    def diagnose(self, content: str) -> tuple[Any, list[str], list[Patch]]:
+        "Parse and validate a generated spec: (spec, errors, patches to repair them)"
         try:
-            # Parse YAML string to Python dictionary
-            yaml_dict: dict = yaml.safe_load(yaml_string)
-            return yaml_dict
-        except Exception as e:
-            return f"Error converting YAML to JSON: {str(e)}"
-
-    def validate_oas_spec(self, oas_spec: dict) -> bool:
+            spec = parse_spec(content)
+        except SpecParseError as e:
+            patch = line_patch(content, e)
+            return None, [str(e)], [patch] if patch else []
+        result = get_validation_engine().validate(spec)
+        return spec, result.errors, node_patches(spec, result.errors)
+
+    async def adiagnose(self, content: str) -> tuple[Any, list[str], list[Patch]]:
+        "Async version of `diagnose`, validating in a worker process"
+        try:
+            spec = parse_spec(content)
+        except SpecParseError as e:
+            patch = line_patch(content, e)
+            return None, [str(e)], [patch] if patch else []
+        result = await get_validation_engine().avalidate(spec)
+        return spec, result.errors, node_patches(spec, result.errors)
+
+    def create(self, chat_history: List[ChatMessage]) -> Generation:
         """
-        Validate an OpenAPI Specification (OAS) string.
-
-        Args:
-            oas_spec (dict): The OAS content as a dict.
-
-        Returns:
-            bool: True if the OAS is valid, False otherwise.
+        Generate a spec and repair it until it validates, within OAS_CREATE_MAX_REPAIRS rounds
+        and OAS_CREATE_TIME_BUDGET_SECONDS. Valid specs are cached by the request text.
         """
-        try:
-            # Parse the OAS spec
-            # Validate the OAS spec
-            validate(oas_spec)
-            return True
-        except Exception as e:
-            logger.error(f"OpenAPI Specification validation error: {e}")
-            return False
-
-    def chat_query(
-        self, chat_history: List[ChatMessage], streamed: bool = False
-    ) -> Union[ChatMessage, Generator[str, None, None]]:
+        cached = self.cached_generation(chat_history)
+        if cached is not None:
+            return cached
+        deadline = time.monotonic() + self.time_budget
+        response = self.complete(self.messages(chat_history))
+        return self.repair(response.content, chat_history, deadline)
+
+    async def acreate(self, chat_history: List[ChatMessage]) -> Generation:
+        "Async version of `create`, repairing the parts of a spec concurrently"
+        cached = self.cached_generation(chat_history)
+        if cached is not None:
+            return cached
+        deadline = time.monotonic() + self.time_budget
+        response = await self.acomplete(self.messages(chat_history))
+        return await self.arepair(response.content, chat_history, deadline)
+
+    def cached_generation(
+        self, chat_history: List[ChatMessage]
+    ) -> Optional[Generation]:
+        content = self.generations.get(request_key(self.request_text(chat_history)))
+        if content is None:
+            return None
+        return Generation(content=content, valid=True, attempts=0, cached=True)
+
+    def _repair_loop(
+        self, content: str, chat_history: List[ChatMessage], deadline: float
+    ) -> Generator[tuple, Any, Generation]:
         """
-        Queries the LLM with chat history for OAS checking.
-
-        Args:
-            chat_history (list[ChatMessage]): The conversation history.
-            streamed (bool): whether or not to stream the response
-
-        Returns:
-            ChatMessage or generator for streaming
+        The validate-repair loop shared by `repair` and `arepair`. It yields the steps for them
+        to run, ("diagnose", content) and ("repair", patches), is sent their results (None for
+        repairs that overran the deadline) and returns the final Generation.
         """
-        messages = [self.systemprompt]
-        for message in chat_history:
-            messages.append({"role": message.role, "content": message.content})
-
+        content = strip_fences(content)
+        attempts = 1
+        while True:
+            spec, errors, patches = yield "diagnose", content
+            if not errors:
+                key = request_key(self.request_text(chat_history))
+                self.generations.put(key, content)
+                return Generation(content=content, valid=True, attempts=attempts)
+            if (
+                attempts > self.max_repairs
+                or not patches
+                or time.monotonic() >= deadline
+            ):
+                return Generation(
+                    content, valid=False, attempts=attempts, errors=errors
+                )
+
+            logger.info(f"Repairing {len(patches)} part(s) of a generated spec")
+            answers = yield "repair", patches
+            if answers is None:
+                return Generation(
+                    content, valid=False, attempts=attempts, errors=errors
+                )
+            content = apply_patches(content, spec, patches, answers)
+            attempts += 1
+
+    def repair(
+        self, content: str, chat_history: List[ChatMessage], deadline: float
+    ) -> Generation:
+        "Validate a generated spec and repair it until it is valid, caching it if it is"
+        loop = self._repair_loop(content, chat_history, deadline)
+        result = None
+        try:
+            while True:
+                step, argument = loop.send(result)
+                if step == "diagnose":
+                    result = self.diagnose(argument)
+                else:
+                    result = self._repairs(argument, deadline)
+        except StopIteration as done:
+            return done.value
+
+    async def arepair(
+        self, content: str, chat_history: List[ChatMessage], deadline: float
+    ) -> Generation:
+        "Async version of `repair`"
+        loop = self._repair_loop(content, chat_history, deadline)
+        result = None
         try:
-            completion = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=messages,
-                max_tokens=800,
-                temperature=0.7,
-                top_p=0.95,
-                frequency_penalty=0,
-                presence_penalty=0,
-                stop=None,
-            )
-        except Exception as e:
-            logger.exception("Error during OpenAI completion call")
-            raise RuntimeError(f"OpenAI completion error: {e}")
-
-        if not streamed:
+            while True:
+                step, argument = loop.send(result)
+                if step == "diagnose":
+                    result = await self.adiagnose(argument)
+                else:
+                    result = await self._arepairs(argument, deadline)
+        except StopIteration as done:
+            return done.value
+
+    def _repairs(self, patches: list[Patch], deadline: float) -> Optional[list[str]]:
+        "The corrected parts, repaired in the shared repair threads, None if they overran the deadline"
+        executor = get_repair_executor()
+        with stage("oas_repair"):
+            futures = [
+                run_in_context(executor, self.complete, repair_messages(p))
+                for p in patches
+            ]
             try:
-                response_content = completion.choices[0].message.content
-                return ChatMessage(role="assistant", content=response_content)
-            except Exception as e:
-                logger.exception("Error parsing OpenAI response")
-                raise RuntimeError(f"Error parsing OpenAI response: {e}")
-        else:
-
-            def stream_response():
-                try:
-                    for chunk in completion:
-                        if chunk.choices and chunk.choices[0].delta.content:
-                            yield chunk.choices[0].delta.content
-                except Exception as e:
-                    logger.exception("Error during streaming OpenAI response")
-                    raise RuntimeError(f"Error during streaming OpenAI response: {e}")
-
-            return stream_response()
+                return [
+                    f.result(timeout=max(0, deadline - time.monotonic())).content
+                    for f in futures
+                ]
+            except TimeoutError:
+                # don't run repairs that overran the time budget
+                for future in futures:
+                    future.cancel()
+                return None
+
+    async def _arepairs(
+        self, patches: list[Patch], deadline: float
+    ) -> Optional[list[str]]:
+        "Async version of `_repairs`, repairing the parts concurrently"
+        try:
+            with stage("oas_repair"):
+                responses = await asyncio.wait_for(
+                    asyncio.gather(
+                        *(self.acomplete(repair_messages(p)) for p in patches)
+                    ),
+                    deadline - time.monotonic(),
+                )
+        except asyncio.TimeoutError:
+            return None
+        return [response.content for response in responses]
+
+    @staticmethod
+    def request_text(chat_history: List[ChatMessage]) -> str:
+        return "\n".join(m.content for m in chat_history if m.role == "user")
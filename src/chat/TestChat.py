@@ -7,7 +7,9 @@ class TestChat(Chat):
     This class implements the Chat interface in a trivial way for testing purposes
     """
 
-    def chat_query(self, chat_history: list[ChatMessage]) -> ChatMessage:
+    def chat_query(
+        self, chat_history: list[ChatMessage], streamed: bool = False
+    ) -> ChatMessage:
         "Simply echoes back the last message in this history"
         if not chat_history:
             raise ValueError("TestChat expects non empty chat history")
@@ -0,0 +1,209 @@
+"""
+One place that owns the network clients, so every Chat object shares the same keep-alive
+connection pools instead of each building its own with default limits.
+
+All clients are built lazily on first use (their imports are timed in the startup report)
+from a pair of pooled httpx clients (HTTP/2 when enabled), configured by:
+- HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE_CONNECTIONS: pool sizes
+- HTTP_KEEPALIVE_EXPIRY: seconds an idle connection is kept
+- HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT: timeouts in seconds
+- HTTP2: "true" (default) or "false"
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from src.telemetry.Startup import startup_step, timed_import
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+AZURE_OPENAI_API_VERSION = "2024-05-01-preview"
+
+
+@dataclass(frozen=True)
+class ClientSettings:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 60.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls) -> "ClientSettings":
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(
+                os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+            ),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "60")),
+            http2=os.getenv("HTTP2", "true").lower() == "true",
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+
+class ClientRegistry:
+    "Builds each client once and hands out the same instance afterwards"
+
+    def __init__(self, settings: Optional[ClientSettings] = None):
+        self.settings = settings or ClientSettings.from_env()
+        self._clients: dict[str, object] = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, build):
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = build()
+            return self._clients[name]
+
+    def http_client(self) -> httpx.Client:
+        return self._get(
+            "http",
+            lambda: httpx.Client(
+                http2=self.settings.http2,
+                limits=self.settings.limits(),
+                timeout=self.settings.timeout(),
+            ),
+        )
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        return self._get(
+            "async_http",
+            lambda: httpx.AsyncClient(
+                http2=self.settings.http2,
+                limits=self.settings.limits(),
+                timeout=self.settings.timeout(),
+            ),
+        )
+
+    def litellm(self):
+        "The litellm module, with its sessions pointed at the shared pools"
+
+        def build():
+            litellm = timed_import("litellm")
+            litellm.client_session = self.http_client()
+            litellm.aclient_session = self.async_http_client()
+            return litellm
+
+        return self._get("litellm", build)
+
+    def azure_openai(self):
+        def build():
+            return timed_import("openai").AzureOpenAI(
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=AZURE_OPENAI_API_VERSION,
+                http_client=self.http_client(),
+            )
+
+        return self._get("azure_openai", build)
+
+    def async_azure_openai(self):
+        def build():
+            return timed_import("openai").AsyncAzureOpenAI(
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=AZURE_OPENAI_API_VERSION,
+                http_client=self.async_http_client(),
+            )
+
+        return self._get("async_azure_openai", build)
+
+    def astra_database(self, keyspace: Optional[str] = None):
+        """
+        The AstraDB database. astrapy has no way to pass in an http client, its sync
+        requests all go through the class level `APICommander.client`, which is replaced
+        by the shared one here (with a warning, and astrapy's own client, on versions of
+        astrapy that no longer have it).
+        """
+
+        def build():
+            astrapy = timed_import("astrapy")
+            try:
+                from astrapy.api_commander import APICommander
+            except ImportError:
+                APICommander = None
+            if APICommander is not None and hasattr(APICommander, "client"):
+                APICommander.client = self.http_client()
+            else:
+                logger.warning(
+                    "astrapy has no APICommander.client, AstraDB requests do not use "
+                    "the shared connection pool"
+                )
+            with startup_step("astra database"):
+                client = astrapy.DataAPIClient(os.getenv("ASTRA_DB_APPLICATION_TOKEN"))
+                return client.get_database(
+                    os.getenv("ASTRA_DB_API_ENDPOINT"), keyspace=keyspace
+                )
+
+        return self._get(f"astra_database:{keyspace}", build)
+
+    def astra_collection(self, name: str, keyspace: Optional[str] = None):
+        return self._get(
+            f"astra_collection:{keyspace}:{name}",
+            lambda: self.astra_database(keyspace).get_collection(name),
+        )
+
+    def async_astra_collection(self, name: str, keyspace: Optional[str] = None):
+        """
+        The async version of a collection, its requests go through the shared async pool
+        (by replacing the private client of astrapy's commander, when there is one)
+        """
+
+        def build():
+            collection = self.astra_collection(name, keyspace).to_async()
+            commander = getattr(collection, "_api_commander", None)
+            if hasattr(commander, "async_client"):
+                commander.async_client = self.async_http_client()
+            else:
+                logger.warning(
+                    f"astrapy collections have no _api_commander.async_client, async "
+                    f"requests to {name} do not use the shared connection pool"
+                )
+            return collection
+
+        return self._get(f"async_astra_collection:{keyspace}:{name}", build)
+
+    def _reset(self) -> dict[str, object]:
+        "Forget every client (they all share the pools being closed) and return them"
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        return clients
+
+    def close(self):
+        "Close the sync pool, the async one is closed by `aclose`"
+        client = self._reset().get("http")
+        if client is not None:
+            client.close()
+
+    async def aclose(self):
+        clients = self._reset()
+        if "async_http" in clients:
+            await clients["async_http"].aclose()
+        if "http" in clients:
+            clients["http"].close()
+
+
+@lru_cache(maxsize=1)
+def get_client_registry() -> ClientRegistry:
+    return ClientRegistry()
@@ -1,35 +1,59 @@
+from typing import Optional
+from src.history.HistoryStore import HistoryStore, InMemoryHistoryStore
 from src.schemas.ChatSchemas import ChatMessage
 
+DEFAULT_SESSION_ID = "default"
+
 
 class BaseHistory:
     """
-    A class that implements chat history by simply storing a list of chat messages in
-    memory and returning them fully. This can be used as is or as a baseclass to define
+    A class that implements chat history by simply storing a list of chat messages per
+    session and returning them fully. This can be used as is or as a baseclass to define
     other history implementations
 
-    The generic class T is used so ChatMessages can be defined elsewhere
+    The messages are kept in a HistoryStore (a bounded in-memory one unless another is
+    given) so that sessions do not grow forever and can be shared between workers
     """
 
-    def __init__(self):
-        self._history: list[ChatMessage] = []
+    def __init__(self, *, store: Optional[HistoryStore] = None):
+        self._store: HistoryStore = (
+            store if store is not None else InMemoryHistoryStore()
+        )
 
-    def record_message(self, message: ChatMessage):
-        "Add a message to the history"
+    def record_message(
+        self, message: ChatMessage, session_id: str = DEFAULT_SESSION_ID
+    ):
+        "Add a message to the history of a session"
         if not isinstance(message, ChatMessage):
             raise TypeError("Message must be of type ChatMessage")
-        self._history.append(message)
+        self._store.append_message(session_id, message)
 
-    def get_history(self) -> list[ChatMessage]:
-        "Return the full history"
-        return self._history
+    def get_history(self, session_id: str = DEFAULT_SESSION_ID) -> list[ChatMessage]:
+        "Return the full (stored) history of a session"
+        return self._store.get_messages(session_id)
 
-    def get_context_history(self) -> list[ChatMessage]:
+    def get_context_history(
+        self, session_id: str = DEFAULT_SESSION_ID
+    ) -> list[ChatMessage]:
         """
         This method can be used to define a different behaviour for getting to history
         to use as context in RAG (such as returning a summary of the chat history).
         In the BaseHistory class this just returns the full history
         """
-        return self.get_history()
+        return self.get_history(session_id)
+
+    async def aget_context_history(
+        self, session_id: str = DEFAULT_SESSION_ID
+    ) -> list[ChatMessage]:
+        """
+        Async version of `get_context_history` for implementations that need to call out
+        (e.g. to summarise), by default it is the same as the sync version
+        """
+        return self.get_context_history(session_id)
+
+    def clear(self, session_id: Optional[str] = None):
+        "Forget the history of one session, or of every session"
+        self._store.clear(session_id)
 
 
 class OneShotHistory(BaseHistory):
@@ -38,12 +62,14 @@ class OneShotHistory(BaseHistory):
     Always returns only the most recent user message as context.
     """
 
-    def get_context_history(self) -> list[ChatMessage]:
+    def get_context_history(
+        self, session_id: str = DEFAULT_SESSION_ID
+    ) -> list[ChatMessage]:
         """
         Return only the most recent user message as context.
         Scan history in reverse to find the last ChatMessage(role='user').
         """
-        for msg in reversed(self._history):
+        for msg in reversed(self.get_history(session_id)):
             if msg.role == "user":
                 return [msg]
         return []
@@ -0,0 +1,236 @@
+"""
+Storage backends for chat history, keyed by session id.
+
+A HistoryStore only knows how to keep the messages of many sessions within some bounds,
+the BaseHistory classes decide which of those messages are used as context.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from src.schemas.ChatSchemas import ChatMessage
+
+
+class HistoryStore(ABC):
+    """
+    This is the Abstract Base Class for history storage backends.
+
+    Every backend keeps at most `max_messages` messages per session (the oldest are dropped
+    first) and forgets sessions that have not been touched for `ttl_seconds`.
+    """
+
+    @abstractmethod
+    def get_messages(self, session_id: str) -> list[ChatMessage]:
+        "Return the stored messages of a session, oldest first"
+        pass
+
+    @abstractmethod
+    def append_message(self, session_id: str, message: ChatMessage):
+        "Add a message to the end of a session"
+        pass
+
+    @abstractmethod
+    def clear(self, session_id: Optional[str] = None):
+        "Forget one session, or every session if no session id is given"
+        pass
+
+
+class InMemoryHistoryStore(HistoryStore):
+    """
+    Keeps sessions in a process-local LRU dictionary.
+
+    Memory is bounded by `max_sessions` x `max_messages`, least recently used sessions are
+    evicted first and idle sessions expire after `ttl_seconds`.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_messages: int = 50,
+        ttl_seconds: Optional[float] = 3600,
+    ):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self._sessions: OrderedDict[str, tuple[float, list[ChatMessage]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        "Drop idle sessions, the dictionary is ordered by last access so we can stop early"
+        if self.ttl_seconds is None:
+            return
+        while self._sessions:
+            session_id, (last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+
+    def get_messages(self, session_id: str) -> list[ChatMessage]:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if session_id not in self._sessions:
+                return []
+            _, messages = self._sessions.pop(session_id)
+            self._sessions[session_id] = (now, messages)
+            return list(messages)
+
+    def append_message(self, session_id: str, message: ChatMessage):
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            _, messages = self._sessions.pop(session_id, (now, []))
+            messages.append(message)
+            del messages[: -self.max_messages]
+            self._sessions[session_id] = (now, messages)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, session_id: Optional[str] = None):
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Keeps sessions in a SQLite database file.
+
+    The database runs in WAL mode so several uvicorn workers (processes) can share the same
+    file and therefore the same conversations.
+    """
+
+    def __init__(
+        self,
+        path: str = "history.sqlite3",
+        max_messages: int = 50,
+        ttl_seconds: Optional[float] = 3600,
+    ):
+        self.path = path
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS messages_created ON messages (created)"
+        )
+
+    def _expire(self, now: float):
+        "Drop every session whose newest message is older than the ttl"
+        if self.ttl_seconds is None:
+            return
+        self._connection.execute(
+            """
+            DELETE FROM messages WHERE session_id IN (
+                SELECT session_id FROM messages
+                GROUP BY session_id HAVING MAX(created) < ?
+            )
+            """,
+            (now - self.ttl_seconds,),
+        )
+
+    def get_messages(self, session_id: str) -> list[ChatMessage]:
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT role, content, created FROM messages
+                WHERE session_id = ? ORDER BY id
+                """,
+                (session_id,),
+            ).fetchall()
+        if (
+            rows
+            and self.ttl_seconds is not None
+            and time.time() - rows[-1][2] > self.ttl_seconds
+        ):
+            return []
+        return [ChatMessage(role=role, content=content) for role, content, _ in rows]
+
+    def append_message(self, session_id: str, message: ChatMessage):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(now)
+                self._connection.execute(
+                    """
+                    INSERT INTO messages (session_id, role, content, created)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (session_id, message.role, message.content, now),
+                )
+                self._connection.execute(
+                    """
+                    DELETE FROM messages WHERE session_id = ? AND id NOT IN (
+                        SELECT id FROM messages WHERE session_id = ?
+                        ORDER BY id DESC LIMIT ?
+                    )
+                    """,
+                    (session_id, session_id, self.max_messages),
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def clear(self, session_id: Optional[str] = None):
+        with self._lock:
+            if session_id is None:
+                self._connection.execute("DELETE FROM messages")
+            else:
+                self._connection.execute(
+                    "DELETE FROM messages WHERE session_id = ?", (session_id,)
+                )
+
+
+def make_history_store() -> HistoryStore:
+    """
+    Build the history store selected by the environment:
+
+    - HISTORY_BACKEND: "memory" (default) or "sqlite"
+    - HISTORY_SQLITE_PATH: database file for the sqlite backend
+    - HISTORY_MAX_SESSIONS, HISTORY_MAX_MESSAGES, HISTORY_TTL_SECONDS: the bounds
+    """
+    backend = os.getenv("HISTORY_BACKEND", "memory").lower()
+    max_messages = int(os.getenv("HISTORY_MAX_MESSAGES", "50"))
+    ttl_seconds = float(os.getenv("HISTORY_TTL_SECONDS", "3600"))
+
+    if backend == "memory":
+        return InMemoryHistoryStore(
+            max_sessions=int(os.getenv("HISTORY_MAX_SESSIONS", "1000")),
+            max_messages=max_messages,
+            ttl_seconds=ttl_seconds,
+        )
+    if backend == "sqlite":
+        return SQLiteHistoryStore(
+            path=os.getenv("HISTORY_SQLITE_PATH", "history.sqlite3"),
+            max_messages=max_messages,
+            ttl_seconds=ttl_seconds,
+        )
+    raise ValueError(f"Unknown HISTORY_BACKEND: {backend}")
@@ -0,0 +1,183 @@
+"A history implementation that keeps the context sent to the LLM within a token budget"
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from src.clients.ClientRegistry import get_client_registry
+from src.history.BasicHistory import DEFAULT_SESSION_ID, BaseHistory
+from src.history.HistoryStore import HistoryStore
+from src.prompts import HistorySummaryPrompt
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# roughly what the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+Summariser = Callable[[str, list[ChatMessage]], str]
+AsyncSummariser = Callable[[str, list[ChatMessage]], Awaitable[str]]
+
+
+def _summary_prompt(summary: str, messages: list[ChatMessage]) -> list[dict]:
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in messages)
+    return [
+        {"role": "system", "content": HistorySummaryPrompt},
+        {
+            "role": "user",
+            "content": f"Current summary:\n{summary}\n\nOlder messages:\n{transcript}",
+        },
+    ]
+
+
+def llm_summariser(summary: str, messages: list[ChatMessage]) -> str:
+    "Folds `messages` into `summary` with one completion"
+    llm = get_client_registry().litellm()
+    response = llm.completion(
+        "azure/rag_pocs",
+        messages=_summary_prompt(summary, messages),
+        temperature=0,
+        max_tokens=300,
+    )
+    return response.choices[0].message.content
+
+
+async def allm_summariser(summary: str, messages: list[ChatMessage]) -> str:
+    "Async version of `llm_summariser`"
+    llm = get_client_registry().litellm()
+    response = await llm.acompletion(
+        "azure/rag_pocs",
+        messages=_summary_prompt(summary, messages),
+        temperature=0,
+        max_tokens=300,
+    )
+    return response.choices[0].message.content
+
+
+def _anchor(messages: list[ChatMessage], i: int) -> str:
+    "A fingerprint of message i and its predecessor, used to find it again after the store trims"
+    h = hashlib.sha256()
+    for m in messages[max(0, i - 1) : i + 1]:
+        h.update(f"{m.role}\0{m.content}\0".encode())
+    return h.hexdigest()
+
+
+class TokenBudgetHistory(BaseHistory):
+    """
+    Returns the newest messages that fit in `max_context_tokens` as context, preceded by a
+    running summary of everything older.
+
+    The summary is cached per session and updated incrementally: each call only folds in
+    the messages that dropped out of the window since the previous summary, so most turns
+    cost no summarisation call at all.
+    """
+
+    def __init__(
+        self,
+        *,
+        store: Optional[HistoryStore] = None,
+        max_context_tokens: Optional[int] = None,
+        summariser: Summariser = llm_summariser,
+        asummariser: AsyncSummariser = allm_summariser,
+        token_counter: Callable[[str], int] = count_tokens,
+        max_cached_summaries: int = 1000,
+    ):
+        super().__init__(store=store)
+        self.max_context_tokens = max_context_tokens or int(
+            os.getenv("HISTORY_MAX_CONTEXT_TOKENS", "2000")
+        )
+        self.summariser = summariser
+        self.asummariser = asummariser
+        self.token_counter = token_counter
+        self.max_cached_summaries = max_cached_summaries
+        # session id -> (anchor of the newest summarised message, summary)
+        self._summaries: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def message_tokens(self, message: ChatMessage) -> int:
+        return self.token_counter(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+    def split_window(self, messages: list[ChatMessage]) -> int:
+        """
+        Return the index of the first message of the window: the newest messages that fit in
+        the budget (always at least the last one), starting on a user turn where possible.
+        """
+        budget = self.max_context_tokens
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            budget -= self.message_tokens(messages[i])
+            if budget < 0 and start < len(messages):
+                break
+            start = i
+        while start < len(messages) - 1 and messages[start].role != "user":
+            start += 1
+        return start
+
+    def _pending(
+        self, session_id: str, messages: list[ChatMessage], start: int
+    ) -> tuple[str, list[ChatMessage]]:
+        "The cached summary and the older messages that it does not cover yet"
+        with self._lock:
+            anchor, summary = self._summaries.get(session_id, (None, ""))
+        pending_from = 0
+        for i in range(start - 1, -1, -1):
+            if _anchor(messages, i) == anchor:
+                pending_from = i + 1
+                break
+        # if the anchor is not found it has been trimmed from the store, so every
+        # message that is still stored is newer than the summary
+        return summary, messages[pending_from:start]
+
+    def _store_summary(
+        self, session_id: str, messages: list[ChatMessage], start: int, summary: str
+    ):
+        with self._lock:
+            self._summaries.pop(session_id, None)
+            self._summaries[session_id] = (_anchor(messages, start - 1), summary)
+            while len(self._summaries) > self.max_cached_summaries:
+                self._summaries.popitem(last=False)
+
+    def _context(self, summary: str, window: list[ChatMessage]) -> list[ChatMessage]:
+        if not summary:
+            return window
+        return [
+            ChatMessage(role="assistant", content=SUMMARY_PREFIX + summary)
+        ] + window
+
+    def get_context_history(
+        self, session_id: str = DEFAULT_SESSION_ID
+    ) -> list[ChatMessage]:
+        "Return the running summary (if any) followed by the newest messages within the budget"
+        messages = self.get_history(session_id)
+        start = self.split_window(messages)
+        summary, pending = self._pending(session_id, messages, start)
+        if pending:
+            summary = self.summariser(summary, pending)
+            self._store_summary(session_id, messages, start, summary)
+        return self._context(summary, messages[start:])
+
+    async def aget_context_history(
+        self, session_id: str = DEFAULT_SESSION_ID
+    ) -> list[ChatMessage]:
+        "Async version of `get_context_history`"
+        messages = self.get_history(session_id)
+        start = self.split_window(messages)
+        summary, pending = self._pending(session_id, messages, start)
+        if pending:
+            summary = await self.asummariser(summary, pending)
+            self._store_summary(session_id, messages, start, summary)
+        return self._context(summary, messages[start:])
+
+    def clear(self, session_id: Optional[str] = None):
+        super().clear(session_id)
+        with self._lock:
+            if session_id is None:
+                self._summaries.clear()
+            else:
+                self._summaries.pop(session_id, None)
@@ -0,0 +1,79 @@
+"""
+The manifest of what is in the collection, used to re-index incrementally.
+
+Every document gets a deterministic `_id` (from what it describes: api, path, method or
+chunk number) and a content hash (of its fields and the text its vector is embedded from).
+The manifest maps ids to content hashes; diffing it against the documents built from the
+current specs gives what has to be inserted, replaced and deleted.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+MANIFEST_PATH = "data/hmrc_manifest.json"
+
+
+def document_id(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32]
+
+
+def content_hash(document: dict, text: str = "") -> str:
+    "Hash of a document's fields (not its id or vector) and of the text its vector embeds"
+    fields = {k: v for k, v in document.items() if k not in ("_id", "$vector")}
+    payload = json.dumps(fields, sort_keys=True, default=str) + "\0" + text
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class ManifestDiff:
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    def summary(self) -> dict:
+        return {
+            "added": len(self.added),
+            "changed": len(self.changed),
+            "removed": len(self.removed),
+            "unchanged": self.unchanged,
+        }
+
+
+class IndexManifest:
+    "Document id -> content hash of the last indexing run"
+
+    def __init__(self, hashes: dict[str, str] = None):
+        self.hashes = dict(hashes or {})
+
+    @classmethod
+    def load(cls, path: str = MANIFEST_PATH) -> "IndexManifest":
+        "The saved manifest, or an empty one if there is none yet"
+        if not Path(path).is_file():
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["documents"])
+
+    def save(self, path: str = MANIFEST_PATH):
+        "Written to a temporary file first, so a failed run never leaves half a manifest"
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "documents": self.hashes}, f, sort_keys=True)
+        os.replace(tmp, path)
+
+    def diff(self, hashes: dict[str, str]) -> ManifestDiff:
+        "What changed going from this manifest to `hashes`"
+        diff = ManifestDiff()
+        for id, h in hashes.items():
+            if id not in self.hashes:
+                diff.added.append(id)
+            elif self.hashes[id] != h:
+                diff.changed.append(id)
+            else:
+                diff.unchanged += 1
+        diff.removed = [id for id in self.hashes if id not in hashes]
+        return diff
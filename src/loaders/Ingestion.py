@@ -0,0 +1,387 @@
+"""
+Ingestion of the HMRC OpenAPI specs into the AstraDB collection.
+
+Run `python -m src.loaders.Ingestion <directory of yaml specs>` (see `--help`). With
+`--incremental` only the documents that changed since the last run (according to the
+manifest, see IndexManifest) are embedded and written and the ones that are gone deleted.
+
+The texts to embed are sent in batches (many inputs per embedding call), batches run
+concurrently under a requests/tokens per minute rate limiter and are retried with
+exponential backoff on rate limits and transient errors. Documents are inserted as soon as
+they are ready, in bounded chunks, and the throughput is reported at the end. Inserts are
+idempotent (documents already in the collection are replaced), so that a re-run or a retried
+chunk does not fail on the ones a previous attempt inserted.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from src.loaders import hmrcLoader1
+from src.loaders.IndexManifest import (
+    MANIFEST_PATH,
+    IndexManifest,
+    ManifestDiff,
+    content_hash,
+    document_id,
+)
+from src.loaders.OASChunker import HTTP_METHODS
+from src.telemetry.Tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# status codes worth retrying: timeouts, rate limits and server side errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# the Data API error of an insert of an _id already in the collection
+DUPLICATE_ID = "DOCUMENT_ALREADY_EXISTS"
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+async def retry_with_backoff(
+    call: Callable[[], Awaitable],
+    attempts: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+):
+    "Await `call()`, retrying retryable errors after exponentially growing (jittered) delays"
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * 2**attempt) * random.uniform(0.5, 1)
+            logger.warning(f"Retrying in {delay:.1f}s after: {e}")
+            await asyncio.sleep(delay)
+
+
+class RateLimiter:
+    """
+    Keeps calls under `requests_per_minute` and their total size under `tokens_per_minute`
+    (the two limits of an Azure OpenAI deployment), using a token bucket for each.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.capacity = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.available = dict(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        for kind, capacity in self.capacity.items():
+            self.available[kind] = min(
+                capacity, self.available[kind] + capacity * (now - self.updated) / 60
+            )
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        "Wait until one request of `tokens` tokens fits in both budgets, then use it"
+        # a single call bigger than the whole budget has to be let through eventually
+        tokens = min(tokens, self.capacity["tokens"])
+        async with self._lock:
+            while True:
+                self._refill()
+                needed = {"requests": 1, "tokens": tokens}
+                wait = max(
+                    (needed[k] - self.available[k]) * 60 / self.capacity[k]
+                    for k in self.capacity
+                )
+                if wait <= 0:
+                    for k in self.capacity:
+                        self.available[k] -= needed[k]
+                    return
+                await asyncio.sleep(wait)
+
+
+@dataclass
+class Throughput:
+    started: float = field(default_factory=time.perf_counter)
+    documents: int = 0
+    embedded: int = 0
+    tokens: int = 0
+    embedding_calls: int = 0
+
+    def report(self) -> dict:
+        seconds = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            "seconds": round(seconds, 2),
+            "documents": self.documents,
+            "embedded": self.embedded,
+            "embedding_calls": self.embedding_calls,
+            "tokens": self.tokens,
+            "docs_per_second": round(self.documents / seconds, 1),
+            "tokens_per_second": round(self.tokens / seconds, 1),
+        }
+
+
+class ChunkedInserter:
+    "Buffers documents and inserts them `chunk_size` at a time, at most `concurrency` inserts at once"
+
+    def __init__(
+        self,
+        insert: Callable[[list[dict]], Awaitable],
+        chunk_size: int = 100,
+        concurrency: int = 4,
+    ):
+        self.insert = insert
+        self.chunk_size = chunk_size
+        self.buffer: list[dict] = []
+        self.inserted = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: list[asyncio.Task] = []
+
+    async def _insert(self, documents: list[dict]):
+        async with self._semaphore:
+            await retry_with_backoff(lambda: self.insert(documents))
+        self.inserted += len(documents)
+
+    def add(self, documents: list[dict]):
+        self.buffer.extend(documents)
+        while len(self.buffer) >= self.chunk_size:
+            chunk, self.buffer = (
+                self.buffer[: self.chunk_size],
+                self.buffer[self.chunk_size :],
+            )
+            self._tasks.append(asyncio.ensure_future(self._insert(chunk)))
+
+    async def flush(self):
+        "Insert what is left and wait for every insert"
+        if self.buffer:
+            chunk, self.buffer = self.buffer, []
+            self._tasks.append(asyncio.ensure_future(self._insert(chunk)))
+        await asyncio.gather(*self._tasks)
+
+
+def endpoint_documents(
+    path: str, endpoint: dict, api: str = "", spec: Optional[dict] = None
+) -> list[tuple[dict, str]]:
+    """
+    The documents of one endpoint, as (document, text to embed its vector from):
+    - a vector document per operation, for its description (see `hmrcLoader1.describe`).
+      The first operation's only has a path, the others also keep their description
+    - its chunks, one per section of an operation (see OASChunker, `$ref`s are resolved
+      against `spec`), embedded so that retrieval can pick out single sections
+    Ids are derived from (api, path, method) and (api, path, method, section).
+    """
+    to_embed = []
+    for method, operation in endpoint.items():
+        if method not in HTTP_METHODS or not isinstance(operation, dict):
+            continue
+        description = hmrcLoader1.describe(operation)
+        document = (
+            {"path": path}
+            if not to_embed
+            else {"path": path, "description": description}
+        )
+        document["_id"] = document_id(api, path, method)
+        to_embed.append((document, description))
+    for chunk in hmrcLoader1.endpoint_chunks(path, endpoint, spec):
+        chunk = {
+            "_id": document_id(api, path, chunk["method"], chunk["section"]),
+            **chunk,
+        }
+        to_embed.append((chunk, path + chunk["content"]))
+    return to_embed
+
+
+def spec_documents(
+    specs: list[dict], apis: Optional[list[str]] = None
+) -> list[tuple[dict, str]]:
+    "The documents of every endpoint of `specs`, plus those of the API descriptions `apis`"
+    to_embed = []
+    for spec in specs:
+        api = spec.get("info", {}).get("title", "")
+        for path, endpoint in hmrcLoader1.get_endpoints(spec):
+            to_embed.extend(endpoint_documents(path, endpoint, api, spec))
+    for description in apis or []:
+        to_embed.append(
+            ({"_id": document_id("api", description), "api": description}, description)
+        )
+    return to_embed
+
+
+def manifest_hashes(to_embed: list[tuple[dict, str]]) -> dict[str, str]:
+    return {d["_id"]: content_hash(d, text) for d, text in to_embed}
+
+
+def plan_incremental(
+    to_embed: list[tuple[dict, str]], manifest: IndexManifest
+) -> tuple[list[tuple[dict, str]], ManifestDiff, dict[str, str]]:
+    "Keep only the added and changed documents, with the diff and the new manifest hashes"
+    hashes = manifest_hashes(to_embed)
+    diff = manifest.diff(hashes)
+    write = set(diff.added) | set(diff.changed)
+    return (
+        [(d, text) for d, text in to_embed if d["_id"] in write],
+        diff,
+        hashes,
+    )
+
+
+async def upsert_many(
+    collection, documents: list[dict], existing: Optional[set[str]] = None
+):
+    """
+    Insert documents with an unordered insert_many (the fast path for new ones) and replace
+    those whose _id is `existing` or turns out to be in the collection already. Other insert
+    errors are raised.
+    """
+    from astrapy.exceptions import InsertManyException
+
+    existing = existing or set()
+    replace = [d for d in documents if d["_id"] in existing]
+    new = [d for d in documents if d["_id"] not in existing]
+    if new:
+        try:
+            await collection.insert_many(new, ordered=False)
+        except InsertManyException as e:
+            if any(d.error_code != DUPLICATE_ID for d in e.error_descriptors):
+                raise
+            inserted = set(e.partial_result.inserted_ids)
+            replace += [d for d in new if d["_id"] not in inserted]
+    await asyncio.gather(
+        *(collection.replace_one({"_id": d["_id"]}, d, upsert=True) for d in replace)
+    )
+
+
+def batches(items: list, size: int) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+async def ingest(
+    to_embed: list[tuple[dict, str]],
+    insert: Callable[[list[dict]], Awaitable],
+    embed_many: Callable[
+        [list[str]], Awaitable[list[list[float]]]
+    ] = hmrcLoader1.aembed_many,
+    batch_size: int = 64,
+    concurrency: int = 4,
+    limiter: Optional[RateLimiter] = None,
+    insert_chunk_size: int = 100,
+) -> dict:
+    """
+    Insert the documents of `to_embed` once their text has been embedded (as "$vector").
+    Returns the throughput report.
+    """
+    throughput = Throughput()
+    inserter = ChunkedInserter(
+        insert, chunk_size=insert_chunk_size, concurrency=concurrency
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed_batch(batch: list[tuple[dict, str]]):
+        texts = [text for _, text in batch]
+        tokens = sum(count_tokens(t) for t in texts)
+        async with semaphore:
+            if limiter is not None:
+                await limiter.acquire(tokens)
+            vectors = await retry_with_backoff(lambda: embed_many(texts))
+        throughput.embedding_calls += 1
+        throughput.tokens += tokens
+        throughput.embedded += len(batch)
+        inserter.add(
+            [{**document, "$vector": v} for (document, _), v in zip(batch, vectors)]
+        )
+
+    await asyncio.gather(*(embed_batch(b) for b in batches(to_embed, batch_size)))
+    await inserter.flush()
+    throughput.documents = inserter.inserted
+    return throughput.report()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("directory", help="directory of OpenAPI yaml files")
+    parser.add_argument("--collection", default=hmrcLoader1.COLLECTION_NAME)
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="texts per embedding call"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="embedding calls in flight"
+    )
+    parser.add_argument("--requests-per-minute", type=float, default=300)
+    parser.add_argument("--tokens-per-minute", type=float, default=120000)
+    parser.add_argument(
+        "--insert-chunk-size", type=int, default=100, help="documents per insert_many"
+    )
+    parser.add_argument(
+        "--with-apis", action="store_true", help="also load the API descriptions"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="embed but do not insert anything"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only embed and write what changed since the manifest, delete what is gone",
+    )
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    to_embed = spec_documents(
+        hmrcLoader1.load_yamls(args.directory),
+        hmrcLoader1.APIs if args.with_apis else None,
+    )
+    hashes = manifest_hashes(to_embed)
+    diff = None
+    if args.incremental:
+        to_embed, diff, hashes = plan_incremental(
+            to_embed, IndexManifest.load(args.manifest)
+        )
+        logger.info(f"Changes since the last run: {diff.summary()}")
+    changed = set(diff.changed) if diff else set()
+
+    if args.dry_run:
+
+        async def write(chunk: list[dict]):
+            pass
+
+        async def delete(ids: list[str]):
+            pass
+
+    else:
+        from src.clients.ClientRegistry import get_client_registry
+
+        collection = get_client_registry().async_astra_collection(args.collection)
+
+        async def write(chunk: list[dict]):
+            await upsert_many(collection, chunk, changed)
+
+        async def delete(ids: list[str]):
+            for chunk in batches(ids, args.insert_chunk_size):
+                await collection.delete_many({"_id": {"$in": chunk}})
+
+    async def run() -> dict:
+        report = await ingest(
+            to_embed,
+            write,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            limiter=RateLimiter(args.requests_per_minute, args.tokens_per_minute),
+            insert_chunk_size=args.insert_chunk_size,
+        )
+        if diff is not None:
+            await delete(diff.removed)
+            report["changes"] = diff.summary()
+        return report
+
+    report = asyncio.run(run())
+    if not args.dry_run:
+        IndexManifest(hashes).save(args.manifest)
+    logger.info(f"Ingestion finished: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Splits OpenAPI endpoints into chunks that follow the structure of the spec.
+
+Every operation of a path gives one chunk for its summary, one for its parameters (path
+and operation level), one for its request body and one per response, each with the local
+`$ref`s resolved so that a chunk can be read on its own. A chunk that is still longer than
+`max_tokens` is split on line boundaries. Chunks record their token count, so retrieval can
+pick sections within a token budget.
+"""
+
+from typing import Any, Optional
+
+import yaml
+
+from src.telemetry.Tokens import count_tokens
+
+HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+SUMMARY_FIELDS = ("summary", "description", "operationId", "tags", "deprecated")
+MAX_REF_DEPTH = 8
+
+
+def _lookup(spec: dict, ref: str) -> Optional[Any]:
+    "The node a local reference such as `#/components/schemas/Agent` points to"
+    node = spec
+    for part in ref[2:].split("/"):
+        part = part.replace("~1", "/").replace("~0", "~")
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def resolve_refs(node: Any, spec: dict, _stack: tuple[str, ...] = ()) -> Any:
+    """
+    Replace local `$ref`s with what they point to. Recursive references (and chains deeper
+    than MAX_REF_DEPTH) are left as `$ref`s.
+    """
+    if isinstance(node, list):
+        return [resolve_refs(v, spec, _stack) for v in node]
+    if not isinstance(node, dict):
+        return node
+    ref = node.get("$ref")
+    if isinstance(ref, str) and ref.startswith("#/"):
+        target = _lookup(spec, ref)
+        if target is None or ref in _stack or len(_stack) >= MAX_REF_DEPTH:
+            return node
+        resolved = resolve_refs(target, spec, _stack + (ref,))
+        siblings = {k: v for k, v in node.items() if k != "$ref"}
+        if not isinstance(resolved, dict):
+            return resolved
+        return {**resolved, **resolve_refs(siblings, spec, _stack)}
+    return {k: resolve_refs(v, spec, _stack) for k, v in node.items()}
+
+
+def _split_lines(text: str, max_tokens: int) -> list[str]:
+    "Split on line boundaries into parts of at most `max_tokens` (a longer line is one part)"
+    parts, current, tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        n = count_tokens(line)
+        if current and tokens + n > max_tokens:
+            parts.append("".join(current))
+            current, tokens = [], 0
+        current.append(line)
+        tokens += n
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def operation_sections(method: str, operation: dict, path_parameters: list) -> list:
+    "The (section name, yaml-able value) pairs of an operation"
+    sections = []
+    summary = {k: operation[k] for k in SUMMARY_FIELDS if k in operation}
+    if summary:
+        sections.append(("operation", {method: summary}))
+    parameters = path_parameters + operation.get("parameters", [])
+    if parameters:
+        sections.append(("parameters", {method: {"parameters": parameters}}))
+    if "requestBody" in operation:
+        sections.append(
+            ("requestBody", {method: {"requestBody": operation["requestBody"]}})
+        )
+    for code, response in (operation.get("responses") or {}).items():
+        sections.append(
+            (f"responses/{code}", {method: {"responses": {code: response}}})
+        )
+    return sections
+
+
+def chunk_endpoint(
+    path: str, endpoint: dict, spec: Optional[dict] = None, max_tokens: int = 800
+) -> list[dict]:
+    """
+    The chunks of one path item of `spec`, as documents:
+    {"path", "method", "section", "content", "tokens", "chunk"}
+    """
+    endpoint = resolve_refs(endpoint, spec or {})
+    path_parameters = endpoint.get("parameters", [])
+    chunks = []
+    for method, operation in endpoint.items():
+        if method not in HTTP_METHODS or not isinstance(operation, dict):
+            continue
+        for section, value in operation_sections(method, operation, path_parameters):
+            body = yaml.dump(value, sort_keys=False, allow_unicode=True)
+            parts = _split_lines(body, max_tokens)
+            for i, part in enumerate(parts):
+                name = section if len(parts) == 1 else f"{section}#{i + 1}"
+                content = f"\n# {method.upper()} {path} {name}\n{part}"
+                chunks.append(
+                    {
+                        "path": path,
+                        "method": method,
+                        "section": name,
+                        "content": content,
+                        "tokens": count_tokens(content),
+                        "chunk": len(chunks),
+                    }
+                )
+    if not chunks:
+        # not a path item we understand, keep it whole
+        content = yaml.dump(endpoint, sort_keys=False, allow_unicode=True)
+        chunks.append(
+            {
+                "path": path,
+                "method": "",
+                "section": "endpoint",
+                "content": content,
+                "tokens": count_tokens(content),
+                "chunk": 0,
+            }
+        )
+    return chunks
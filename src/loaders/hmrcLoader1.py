@@ -6,23 +6,47 @@ it simply takes the openapi yaml paths and embeds their descriptions
 There will be no need to run it again once I have created the db, but I am saving this code in case someone needs to reuse or reread it later.
 """
 
-import litellm
-from astrapy import DataAPIClient, Collection
+import asyncio
 from dotenv import load_dotenv
 import os
 import yaml
 from pathlib import Path
 from icecream import ic
-from math import ceil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+from src.cache.EmbeddingCache import get_embedding_cache
+from src.cache.LRUCache import LRUCache
+from src.clients.ClientRegistry import get_client_registry
+from src.loaders.OASChunker import chunk_endpoint
+from src.telemetry.Timings import run_in_context, stage
+from src.retrieval.Backends import (
+    AstraBackend,
+    LocalBackend,
+    RetrievalBackend,
+    export_snapshot,
+)
+
+if TYPE_CHECKING:
+    from astrapy import Collection
 
 load_dotenv()
 
-client = DataAPIClient(os.getenv("ASTRA_DB_APPLICATION_TOKEN"))
-database = client.get_database(os.getenv("ASTRA_DB_API_ENDPOINT"))
+COLLECTION_NAME = "HMRC_API_ROTOTYPE1_CHUNKED"
+LOCAL_SNAPSHOT_PATH = "data/hmrc_snapshot.npz"
+
+
+def get_database():
+    "The AstraDB database, connected on first use"
+    return get_client_registry().astra_database()
+
+
+def get_collection(name: str = COLLECTION_NAME) -> "Collection":
+    return get_client_registry().astra_collection(name)
 
 
 def create_astradb_collection(name="HMRC_API_ROTOTYPE1_CHUNKED"):
-    database.create_collection(
+    get_database().create_collection(
         name=name, dimension=1536
     )  # the embeddings will come from openai's ada-02 model
 
@@ -67,98 +91,276 @@ def get_endpoints(api_dict):
     return [d for d in api_dict["paths"].items()]
 
 
-def embed(input: str) -> list[float]:
-    "A function that calls the embed client to get the vector embedding of a given string"
-    embedding = litellm.embedding(
-        "azure/text-embedding-ada-002",
+EMBEDDING_MODEL = "azure/text-embedding-ada-002"
+
+
+def _embed_uncached(input: str) -> list[float]:
+    llm = get_client_registry().litellm()
+    return llm.embedding(
+        EMBEDDING_MODEL,
         input=input,
     ).data[0]["embedding"]
-    return embedding
 
 
-def make_db_entries(endpoint_t: tuple[str, dict]):
-    "given the dict representation of an endpoint, return an object ready for loading to astradb as kwargs including the vector"
-    path, endpoint = endpoint_t
+async def _aembed_uncached(input: str) -> list[float]:
+    llm = get_client_registry().litellm()
+    response = await llm.aembedding(
+        EMBEDDING_MODEL,
+        input=input,
+    )
+    return response.data[0]["embedding"]
+
+
+def embed(input: str) -> list[float]:
+    "A function that calls the embed client to get the vector embedding of a given string (cached)"
+    return get_embedding_cache().get_or_compute(EMBEDDING_MODEL, input, _embed_uncached)
+
+
+async def aembed(input: str) -> list[float]:
+    "Async version of `embed`"
+    return await get_embedding_cache().aget_or_compute(
+        EMBEDDING_MODEL, input, _aembed_uncached
+    )
+
+
+async def aembed_many(inputs: list[str]) -> list[list[float]]:
+    "Embeds many strings with a single embedding call (only those missing from the cache)"
+    cache = get_embedding_cache()
+    embeddings = await cache.aget_many(EMBEDDING_MODEL, inputs)
+    missing = [i for i, e in enumerate(embeddings) if e is None]
+    if missing:
+        llm = get_client_registry().litellm()
+        response = await llm.aembedding(
+            EMBEDDING_MODEL, input=[inputs[i] for i in missing]
+        )
+        for item in response.data:
+            embeddings[missing[item["index"]]] = item["embedding"]
+        await cache.aput_many(
+            EMBEDDING_MODEL,
+            [inputs[i] for i in missing],
+            [embeddings[i] for i in missing],
+        )
+    return embeddings
+
+
+def describe(operation: dict) -> str:
+    "The text that is embedded for an endpoint operation: its description, or else its summary"
     try:
-        description = f"{list(endpoint.values())[0]["description"]}"
+        return f"{operation['description']}"
     except Exception:
         try:
-            description = f"{list(endpoint.values())[0]["summary"]}"
+            return f"{operation['summary']}"
         except Exception as ee:
-            ic(list(endpoint.values())[0].keys())
+            ic(operation.keys())
             raise ee
-    embedding = embed(description)
-    payload = yaml.dump(endpoint)
-    entry = {"path": path, "$vector": embedding}
-    chunks = [
-        {"path": path, "content": payload[3000 * i : 3000 * (i + 1)], "chunk": i}
-        for i in range(ceil(len(payload) / 3000))
-    ]
-    chunks.append(entry)
-    return chunks
-
-
-def extra_embeddings(endpoint_t: tuple[str, dict]):
-    "given the dict representation of an endpoint, return an object ready for loading to astradb as kwargs including the vectors for all the other requests you can make"
-    path, endpoint = endpoint_t
-    vecs = []
-    for d in list(endpoint.values())[1:]:
-        try:
-            description = f"{d["description"]}"
-        except Exception:
-            try:
-                description = f"{d["summary"]}"
-            except Exception as ee:
-                ic(d.keys())
-                raise ee
-        embedding = embed(description)
 
-        entry = {"path": path, "$vector": embedding, "description": description}
-        vecs.append(entry)
 
-    ic(path, len(vecs))
-    return vecs
+def endpoint_chunks(
+    path: str, endpoint: dict, spec: Optional[dict] = None
+) -> list[dict]:
+    "The chunks of an endpoint, one per operation section (see OASChunker)"
+    return chunk_endpoint(path, endpoint, spec)
+
+
+@lru_cache(maxsize=1)
+def get_retrieval_backend() -> RetrievalBackend:
+    """
+    The backend used by `retrieve` when none is given, selected by HMRC_RETRIEVAL_BACKEND:
+    - "astra" (default): every lookup is a query to the AstraDB collection
+    - "local": the snapshot at HMRC_LOCAL_SNAPSHOT (see `export_local_snapshot`) is loaded
+      once and searched in-process
+    """
+    kind = os.getenv("HMRC_RETRIEVAL_BACKEND", "astra").lower()
+    if kind == "local":
+        return LocalBackend.from_snapshot(
+            os.getenv("HMRC_LOCAL_SNAPSHOT", LOCAL_SNAPSHOT_PATH)
+        )
+    if kind == "astra":
+        return AstraBackend(
+            get_collection(),
+            get_client_registry().async_astra_collection(COLLECTION_NAME),
+        )
+    raise ValueError(f"Unknown HMRC_RETRIEVAL_BACKEND: {kind}")
+
+
+def export_local_snapshot(path: str = LOCAL_SNAPSHOT_PATH):
+    "Write a snapshot of the collection for the local backend"
+    backend = export_snapshot(get_collection(), path)
+    ic(len(backend.apis), len(backend.endpoint_paths), path)
+
+
+def assemble_endpoint(path: str, chunks: list[dict]) -> str:
+    "Put the chunks of an endpoint back together behind its path"
+    cs: list[dict] = sorted(chunks, key=lambda x: x.get("chunk", -1))
+    return path + "".join(ch.get("content", "") for ch in cs)
+
+
+@lru_cache(maxsize=1)
+def get_endpoint_cache() -> LRUCache:
+    """
+    Cache of assembled endpoint YAML keyed by path, so that hot endpoints are not fetched
+    again (HMRC_ENDPOINT_CACHE_SIZE entries, expiring after HMRC_ENDPOINT_CACHE_TTL seconds)
+    """
+    return LRUCache(
+        max_entries=int(os.getenv("HMRC_ENDPOINT_CACHE_SIZE", "1000")),
+        ttl_seconds=float(os.getenv("HMRC_ENDPOINT_CACHE_TTL", "3600")),
+    )
+
 
+def _cached_endpoints(paths: list[str]) -> tuple[dict[str, str], list[str]]:
+    "Split the paths into those already assembled in the cache and those to fetch"
+    cache = get_endpoint_cache()
+    found, missing = {}, []
+    for path in dict.fromkeys(paths):
+        endpoint = cache.get(path)
+        if endpoint is None:
+            missing.append(path)
+        else:
+            found[path] = endpoint
+    return found, missing
+
+
+def _assemble_and_cache(
+    found: dict[str, str], chunks: dict[str, list[dict]], paths: list[str]
+) -> list[str]:
+    cache = get_endpoint_cache()
+    for path, cs in chunks.items():
+        found[path] = assemble_endpoint(path, cs)
+        cache.put(path, found[path])
+    return [found[path] for path in paths if path in found]
+
+
+def fetch_endpoints(
+    paths: list[str], backend: Optional[RetrievalBackend] = None
+) -> list[str]:
+    "Return the assembled YAML of each endpoint, fetching every uncached path in one query"
+    found, missing = _cached_endpoints(paths)
+    chunks = (
+        (backend or get_retrieval_backend()).fetch_chunks(missing) if missing else {}
+    )
+    return _assemble_and_cache(found, chunks, paths)
+
+
+async def afetch_endpoints(
+    paths: list[str], backend: Optional[RetrievalBackend] = None
+) -> list[str]:
+    "Async version of `fetch_endpoints`"
+    found, missing = _cached_endpoints(paths)
+    chunks = (
+        await (backend or get_retrieval_backend()).afetch_chunks(missing)
+        if missing
+        else {}
+    )
+    return _assemble_and_cache(found, chunks, paths)
 
-def load_to_db(collection: Collection, entries: list[dict]):
-    insert_result = collection.insert_many(entries)
-    print(insert_result)
+
+@lru_cache(maxsize=1)
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    "The thread pool shared by the sync retrieval stages (HMRC_RETRIEVAL_THREADS workers)"
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("HMRC_RETRIEVAL_THREADS", "8")),
+        thread_name_prefix="hmrc-retrieval",
+    )
+
+
+def retrieves_sections() -> bool:
+    """
+    HMRC_RETRIEVAL_GRANULARITY selects what is retrieved for the endpoints:
+    - "endpoint" (default): the whole YAML of the closest endpoints
+    - "section": only the closest sections of operations (parameters, request body,
+      responses...), within HMRC_SECTION_LIMIT sections and HMRC_SECTION_TOKEN_BUDGET tokens
+    """
+    return os.getenv("HMRC_RETRIEVAL_GRANULARITY", "endpoint").lower() == "section"
+
+
+def assemble_sections(
+    sections: list[dict], token_budget: Optional[int] = None
+) -> list[str]:
+    """
+    Put the best sections that fit in the token budget (and at least the best one) back
+    together, one text per path in the order the paths were first matched
+    """
+    if token_budget is None:
+        token_budget = int(os.getenv("HMRC_SECTION_TOKEN_BUDGET", "1500"))
+    chosen, used = [], 0
+    for section in sections:
+        tokens = section.get("tokens", 0)
+        if chosen and used + tokens > token_budget:
+            continue
+        chosen.append(section)
+        used += tokens
+    grouped: dict[str, list[dict]] = {}
+    for section in chosen:
+        grouped.setdefault(section["path"], []).append(section)
+    return [assemble_endpoint(path, cs) for path, cs in grouped.items()]
+
+
+def _section_limit() -> int:
+    return int(os.getenv("HMRC_SECTION_LIMIT", "8"))
+
+
+def _endpoint_stages(
+    embedding: list[float], backend: RetrievalBackend, endpoint_limit: int
+) -> list[str]:
+    if retrieves_sections():
+        with stage("section_search"):
+            return assemble_sections(backend.find_sections(embedding, _section_limit()))
+    with stage("endpoint_search"):
+        paths = backend.find_endpoint_paths(embedding, endpoint_limit)
+    with stage("chunk_fetch"):
+        return fetch_endpoints(paths, backend)
+
+
+def _api_stage(embedding: list[float], backend: RetrievalBackend) -> str:
+    with stage("api_search"):
+        return backend.find_api(embedding)
 
 
 def retrieve(
     query: str,
-    collection: Collection = database.get_collection("HMRC_API_ROTOTYPE1_CHUNKED"),
+    backend: Optional[RetrievalBackend] = None,
     endpoint_limit=1,
 ):
-    "A special retriever to deal with the chunking"
-    embedding = embed(query)
-    api = retrieve_api(embedding, collection=collection)
-    endpoints = collection.find(
-        {"path": {"$exists": True}},
-        sort={"$vector": embedding},
-        limit=endpoint_limit,
-    )
-    ls = [api]
-    for p in endpoints:
-        path = p["path"]
-        chunks = collection.find({"path": path}, limit=20)
-        cs: list[dict] = sorted(list(chunks), key=lambda x: x.get("chunk", -1))
-        c = cs[0]["path"]
-        for ch in cs[1:]:
-            c += ch.get("content", "")
-
-        ls.append(c)
-    return ls
-
-
-def retrieve_api(
-    query_embedding: list[float],
-    collection: Collection = database.get_collection("HMRC_API_ROTOTYPE1_CHUNKED"),
+    """
+    A special retriever to deal with the chunking
+
+    The API description lookup and the endpoint search (followed by its chunk fetch) are
+    independent, so they run concurrently on the shared retrieval thread pool.
+    """
+    backend = backend or get_retrieval_backend()
+    with stage("embed"):
+        embedding = embed(query)
+    api = run_in_context(get_retrieval_executor(), _api_stage, embedding, backend)
+    endpoints = _endpoint_stages(embedding, backend, endpoint_limit)
+    return [api.result()] + endpoints
+
+
+async def aretrieve(
+    query: str,
+    backend: Optional[RetrievalBackend] = None,
+    endpoint_limit=1,
 ):
-    api = collection.find_one(
-        {"api": {"$exists": True}}, sort={"$vector": query_embedding}
-    )
-    return api["api"]
+    "Async version of `retrieve`, the API lookup and the endpoint stages run concurrently"
+    backend = backend or get_retrieval_backend()
+    with stage("embed"):
+        embedding = await aembed(query)
+
+    async def api_stage() -> str:
+        with stage("api_search"):
+            return await backend.afind_api(embedding)
+
+    async def endpoint_stages() -> list[str]:
+        if retrieves_sections():
+            with stage("section_search"):
+                sections = await backend.afind_sections(embedding, _section_limit())
+            return assemble_sections(sections)
+        with stage("endpoint_search"):
+            paths = await backend.afind_endpoint_paths(embedding, endpoint_limit)
+        with stage("chunk_fetch"):
+            return await afetch_endpoints(paths, backend)
+
+    api, endpoints = await asyncio.gather(api_stage(), endpoint_stages())
+    return [api] + endpoints
 
 
 ### here we will manually load the api descriptions (this is just a stopgap solution for demo purposes)
@@ -201,9 +403,10 @@ APIs = [agent_auth, IRR, CTC]
 
 
 def load_APIs(
-    collection: Collection = database.get_collection("HMRC_API_ROTOTYPE1_CHUNKED"),
+    collection: Optional["Collection"] = None,
     apis: list[str] = APIs,
 ):
+    collection = collection or get_collection()
     data = []
     for api in apis:
         emb = embed(api)
@@ -214,35 +417,8 @@ def load_APIs(
 
 
 if __name__ == "__main__":
-    # create_astradb_collection()
-    yaml_dicts = load_yamls()
-    endpoints = [ep for api in yaml_dicts for ep in get_endpoints(api)]
-    # entries = map(make_db_entries, endpoints)
-    extra_vectors = map(extra_embeddings, endpoints)
-    docs = [d for ep in extra_vectors for d in ep]
-    # with open(
-    #     "/Users/juliusvidal/code/rag-poc-backend/src/loaders/data/hmrc_prototype1/extra_vectors.json",
-    #     "w",
-    # ) as f:
-    #     json.dump(list(docs), f)
-    # load_APIs()
-    # ic(retreive("initialise and agent")[0])
-
-    # with open(
-    #     "/Users/juliusvidal/code/rag-poc-backend/src/loaders/data/hmrc_prototype1/stored_db_entries.json",
-    #     "r",
-    # ) as f:
-    #     entries = json.load(f)
-    # ic(retrieve("id like to grant authorisation to an agent"))
-    # # sizes = [(sys.getsizeof(obj["content"]), obj) for obj in entries]
-    # # sizes.sort(key=lambda x: x[0], reverse=True)
-    # # ic([d[0] for d in sizes])
-    # # biggest = sizes[0][1]["content"]
-    # # ic(len(biggest))
-    # # ic(biggest[:100])
-
-    collection = database.get_collection(name="HMRC_API_ROTOTYPE1_CHUNKED")
-
-    load_to_db(collection=collection, entries=docs)
-
-    # ic(collection.count_documents({}, upper_bound=500))
+    # the batched, concurrent pipeline replaced the one embedding call per description
+    # that used to run here
+    from src.loaders.Ingestion import main
+
+    main()
@@ -0,0 +1,321 @@
+"""
+A compact text digest of an OpenAPI specification: what an LLM needs to review its design
+(operations, parameters, responses, schema shapes) at a fraction of the tokens of the file.
+
+The digest of a very large spec can still be too long for one prompt, so it can either be
+cut to a token budget (`bounded_digest`) or split into shards of the operations of each tag,
+with the schemas they use (`spec_shards`), to be reviewed separately.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Any
+
+from src.loaders.OASChunker import HTTP_METHODS
+from src.telemetry.Tokens import count_tokens
+
+MAX_DESCRIPTION_CHARS = 120
+UNTAGGED = "untagged"
+
+
+@dataclass
+class Shard:
+    name: str
+    digest: str
+    # "METHOD /path" of the operations it covers
+    operations: list[str] = field(default_factory=list)
+
+
+def payload_summary(content: str) -> str:
+    "What to log about a posted document instead of the document itself"
+    data = content.encode()
+    return f"{len(data)} bytes, sha256 {hashlib.sha256(data).hexdigest()[:12]}"
+
+
+def _short(text: Any) -> str:
+    text = " ".join(str(text or "").split())
+    if len(text) > MAX_DESCRIPTION_CHARS:
+        return text[: MAX_DESCRIPTION_CHARS - 3] + "..."
+    return text
+
+
+def _ref_name(node: Any) -> str:
+    if isinstance(node, dict) and "$ref" in node:
+        return str(node["$ref"]).rsplit("/", 1)[-1]
+    return ""
+
+
+def _list(node: Any) -> list:
+    "A field that should be a list, none if it is not one"
+    return node if isinstance(node, list) else []
+
+
+def _dict(node: Any) -> dict:
+    "A field that should be an object, empty if it is not one"
+    return node if isinstance(node, dict) else {}
+
+
+def _schema_type(schema: Any) -> str:
+    if not isinstance(schema, dict):
+        return "?"
+    if "$ref" in schema:
+        return _ref_name(schema)
+    if schema.get("type") == "array":
+        return f"{_schema_type(schema.get('items'))}[]"
+    for combiner in ("oneOf", "anyOf", "allOf"):
+        if combiner in schema:
+            return f"{combiner}({', '.join(_schema_type(s) for s in _list(schema[combiner]))})"
+    kind = str(schema.get("type", "object"))
+    if "format" in schema:
+        kind += f"<{schema['format']}>"
+    if _list(schema.get("enum")):
+        kind += f"{{{'|'.join(str(v) for v in schema['enum'][:8])}}}"
+    return kind
+
+
+def _parameters(parameters: Any) -> str:
+    described = []
+    for p in _list(parameters):
+        if not isinstance(p, dict):
+            continue
+        if "$ref" in p:
+            described.append(_ref_name(p))
+            continue
+        flags = str(p.get("in", "?")) + (",required" if p.get("required") else "")
+        described.append(f"{p.get('name', '?')}({flags})")
+    return ", ".join(described)
+
+
+def _content_types(node: Any) -> str:
+    content = node.get("content") if isinstance(node, dict) else None
+    if not isinstance(content, dict):
+        return ""
+    return ", ".join(
+        f"{media} {_schema_type(body.get('schema') if isinstance(body, dict) else None)}"
+        for media, body in content.items()
+    )
+
+
+def _tags(operation: dict) -> list[str]:
+    return [str(tag) for tag in _list(operation.get("tags"))]
+
+
+def operation_digest(path: str, method: str, operation: dict, path_item: dict) -> str:
+    "One or two lines describing an operation"
+    line = f"{method.upper()} {path}"
+    if operation.get("operationId"):
+        line += f" [{operation['operationId']}]"
+    if _tags(operation):
+        line += f" tags: {', '.join(_tags(operation))}"
+    summary = _short(operation.get("summary") or operation.get("description"))
+    if summary:
+        line += f' "{summary}"'
+    details = []
+    parameters = _parameters(
+        _list(path_item.get("parameters")) + _list(operation.get("parameters"))
+    )
+    if parameters:
+        details.append(f"params: {parameters}")
+    body = operation.get("requestBody")
+    if body:
+        details.append(f"body: {_ref_name(body) or _content_types(body)}")
+    responses = operation.get("responses")
+    if isinstance(responses, dict):
+        details.append(
+            "responses: "
+            + ", ".join(
+                f"{code} {_ref_name(r) or _content_types(r)}".strip()
+                for code, r in responses.items()
+            )
+        )
+    if operation.get("security") is not None:
+        details.append(f"security: {operation['security']}")
+    return line + ("\n  " + "; ".join(details) if details else "")
+
+
+def schema_digest(name: str, schema: Any) -> str:
+    "One line per component schema: its properties and their types, required ones starred"
+    if not isinstance(schema, dict) or not isinstance(schema.get("properties"), dict):
+        return f"{name}: {_schema_type(schema)}"
+    required = {r for r in _list(schema.get("required")) if isinstance(r, str)}
+    properties = ", ".join(
+        f"{prop}{'*' if prop in required else ''}:{_schema_type(s)}"
+        for prop, s in schema["properties"].items()
+    )
+    return f"{name}: {properties}"
+
+
+def _schemas(spec: dict) -> dict:
+    components = (
+        spec.get("components") if isinstance(spec.get("components"), dict) else {}
+    )
+    schemas = components.get("schemas") or spec.get("definitions") or {}
+    return schemas if isinstance(schemas, dict) else {}
+
+
+def header_digest(spec: dict) -> str:
+    info = spec.get("info") if isinstance(spec.get("info"), dict) else {}
+    version = spec.get("openapi") or spec.get("swagger")
+    paths = spec.get("paths") if isinstance(spec.get("paths"), dict) else {}
+    lines = [
+        f"OAS {version} | {info.get('title')} {info.get('version')} | "
+        f"domain: {info.get('domain')} | sub-domain: {info.get('sub-domain')}",
+        f"size: {len(paths)} paths, {sum(1 for _ in operations(spec))} operations, "
+        f"{len(_schemas(spec))} schemas",
+    ]
+    if info.get("description"):
+        lines.append(f"description: {_short(info['description'])}")
+    servers = _list(spec.get("servers"))
+    if servers:
+        lines.append(
+            "servers: "
+            + ", ".join(str(s.get("url")) for s in servers if isinstance(s, dict))
+        )
+    components = (
+        spec.get("components") if isinstance(spec.get("components"), dict) else {}
+    )
+    schemes = _dict(
+        components.get("securitySchemes") or spec.get("securityDefinitions")
+    )
+    if schemes:
+        lines.append(
+            "security schemes: "
+            + ", ".join(
+                f"{name} ({s.get('type') if isinstance(s, dict) else '?'})"
+                for name, s in schemes.items()
+            )
+        )
+    if spec.get("security") is not None:
+        lines.append(f"security: {spec['security']}")
+    return "\n".join(lines)
+
+
+def operations(spec: dict):
+    "The (path, method, operation, path item) of every operation of a spec"
+    paths = spec.get("paths") if isinstance(spec.get("paths"), dict) else {}
+    for path, path_item in paths.items():
+        if not isinstance(path_item, dict):
+            continue
+        for method in HTTP_METHODS:
+            operation = path_item.get(method)
+            if isinstance(operation, dict):
+                yield path, method, operation, path_item
+
+
+def spec_digest(spec: dict) -> str:
+    schemas = _schemas(spec)
+    parts = [
+        header_digest(spec),
+        "operations:",
+        *(operation_digest(*o) for o in operations(spec)),
+    ]
+    if schemas:
+        parts += ["schemas:", *(schema_digest(n, s) for n, s in schemas.items())]
+    return "\n".join(parts)
+
+
+def bounded_digest(spec: dict, max_tokens: int) -> str:
+    "The digest, leaving out the operations and then schemas that do not fit in `max_tokens`"
+    parts = [header_digest(spec), "operations:"]
+    used = count_tokens("\n".join(parts))
+    all_operations = list(operations(spec))
+    for i, operation in enumerate(all_operations):
+        line = operation_digest(*operation)
+        used += count_tokens(line)
+        if used > max_tokens:
+            parts.append(f"... and {len(all_operations) - i} more operations")
+            return "\n".join(parts)
+        parts.append(line)
+    schemas = _schemas(spec)
+    if schemas:
+        parts.append("schemas:")
+        for i, (name, schema) in enumerate(schemas.items()):
+            line = schema_digest(name, schema)
+            used += count_tokens(line)
+            if used > max_tokens:
+                parts.append(f"... and {len(schemas) - i} more schemas")
+                break
+            parts.append(line)
+    return "\n".join(parts)
+
+
+def _schema_refs(node: Any) -> set[str]:
+    "Names of the component schemas a node references"
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if isinstance(ref, str) and ref.startswith(
+                ("#/components/schemas/", "#/definitions/")
+            ):
+                names.add(ref.rsplit("/", 1)[-1])
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return names
+
+
+def _used_schemas(nodes: list, schemas: dict) -> list[str]:
+    "The schemas the nodes reference, directly or through other schemas"
+    used: set[str] = set()
+    pending = set().union(*(_schema_refs(n) for n in nodes)) if nodes else set()
+    while pending:
+        name = pending.pop()
+        if name in used or name not in schemas:
+            continue
+        used.add(name)
+        pending |= _schema_refs(schemas[name])
+    return [name for name in schemas if name in used]
+
+
+def spec_shards(spec: dict, max_tokens: int) -> list[Shard]:
+    """
+    Split the digest into shards of at most about `max_tokens`: the operations of each tag (by
+    their first tag), split further when a tag has too many, each with the spec's header
+    and the schemas its operations use.
+    """
+    schemas = _schemas(spec)
+    header = header_digest(spec)
+    by_tag: dict[str, list] = {}
+    for operation in operations(spec):
+        tags = _tags(operation[2]) or [UNTAGGED]
+        by_tag.setdefault(tags[0], []).append(operation)
+
+    shards = []
+    for tag, tag_operations in by_tag.items():
+        groups: list[list] = [[]]
+        used = count_tokens(header)
+        for operation in tag_operations:
+            tokens = count_tokens(operation_digest(*operation))
+            if groups[-1] and used + tokens > max_tokens:
+                groups.append([])
+                used = count_tokens(header)
+            groups[-1].append(operation)
+            used += tokens
+
+        for i, group in enumerate(groups):
+            title = (
+                "operations without a tag:"
+                if tag == UNTAGGED
+                else f"operations tagged {tag}:"
+            )
+            lines = [header, title]
+            lines += [operation_digest(*o) for o in group]
+            used_schemas = _used_schemas(
+                [o[2] for o in group] + [o[3] for o in group], schemas
+            )
+            if used_schemas:
+                lines.append("schemas used:")
+                lines += [schema_digest(n, schemas[n]) for n in used_schemas]
+            shards.append(
+                Shard(
+                    name=tag if len(groups) == 1 else f"{tag} ({i + 1}/{len(groups)})",
+                    digest="\n".join(lines),
+                    operations=[
+                        f"{method.upper()} {path}" for path, method, _, _ in group
+                    ],
+                )
+            )
+    return shards
@@ -0,0 +1,133 @@
+"""
+Parsing of the OpenAPI specifications posted to the OAS endpoints (or generated by the LLM).
+
+- JSON documents are parsed with orjson
+- YAML documents with the libyaml C loader when PyYAML was built with it
+- documents over a size limit are rejected before parsing, and parsed documents deeper than a
+  depth limit or with too many nodes (counting every use of a YAML alias, so "billion laughs"
+  documents are caught) are rejected too
+- parsed documents are cached by content hash, as the same spec is parsed by the router and
+  then by the chat: they are shared, so must not be modified
+
+Run `python -m src.oas.Parsing <spec>...` to compare it with plain `yaml.safe_load`.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import time
+from typing import Any
+
+import orjson
+import yaml
+
+from src.cache.LRUCache import LRUCache
+from src.telemetry.Timings import stage
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+MAX_SPEC_BYTES = int(os.getenv("OAS_MAX_SPEC_BYTES", str(5 * 1024 * 1024)))
+MAX_SPEC_DEPTH = int(os.getenv("OAS_MAX_SPEC_DEPTH", "64"))
+MAX_SPEC_NODES = int(os.getenv("OAS_MAX_SPEC_NODES", "1000000"))
+
+LOOKS_LIKE_JSON = re.compile(rb"\A\s*[\[{]")
+
+_parsed = LRUCache(max_entries=int(os.getenv("OAS_PARSE_CACHE_SIZE", "32")))
+
+
+class SpecParseError(ValueError):
+    "The document is not valid YAML / JSON or goes over one of the limits"
+
+
+def _check_shape(document: Any, max_depth: int, max_nodes: int):
+    "Walk the document (without recursion) checking its depth and number of nodes"
+    nodes = 0
+    stack = [(document, 1)]
+    while stack:
+        node, depth = stack.pop()
+        nodes += 1
+        if nodes > max_nodes:
+            raise SpecParseError(f"The document has more than {max_nodes} nodes")
+        if isinstance(node, dict):
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            continue
+        if depth > max_depth:
+            raise SpecParseError(f"The document is nested deeper than {max_depth}")
+        stack.extend((child, depth + 1) for child in children)
+
+
+def parse_spec(
+    content: str | bytes,
+    max_bytes: int = MAX_SPEC_BYTES,
+    max_depth: int = MAX_SPEC_DEPTH,
+    max_nodes: int = MAX_SPEC_NODES,
+) -> Any:
+    "Parse a JSON or YAML document, raising SpecParseError if it is invalid or too big"
+    data = content.encode() if isinstance(content, str) else content
+    if len(data) > max_bytes:
+        raise SpecParseError(f"The document is larger than {max_bytes} bytes")
+
+    key = (hashlib.sha256(data).hexdigest(), max_depth, max_nodes)
+    document = _parsed.get(key)
+    if document is not None:
+        return document
+
+    with stage("oas_parse"):
+        document = None
+        parsed = False
+        if LOOKS_LIKE_JSON.match(data):
+            try:
+                document = orjson.loads(data)
+                parsed = True
+            except orjson.JSONDecodeError:
+                pass  # YAML flow mappings start with "{" too
+        if not parsed:
+            try:
+                document = yaml.load(data, Loader=YAML_LOADER)
+            except yaml.YAMLError as e:
+                raise SpecParseError(f"Invalid YAML: {e}") from e
+            except RecursionError as e:
+                raise SpecParseError(
+                    f"The document is nested deeper than {max_depth}"
+                ) from e
+        _check_shape(document, max_depth, max_nodes)
+    _parsed.put(key, document)
+    return document
+
+
+def _parse_uncached(content: bytes):
+    _parsed.clear()
+    return parse_spec(content, max_bytes=len(content))
+
+
+def _benchmark(paths: list[str], repeat: int):
+    print(f"{'document':40} {'bytes':>10} {'safe_load ms':>14} {'parse_spec ms':>14}")
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        timings = {}
+        for name, parse in [
+            ("safe_load", yaml.safe_load),
+            ("parse_spec", lambda c: _parse_uncached(c)),
+        ]:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                parse(content)
+            timings[name] = (time.perf_counter() - started) * 1000 / repeat
+        print(
+            f"{os.path.basename(path)[:40]:40} {len(content):>10} "
+            f"{timings['safe_load']:>14.2f} {timings['parse_spec']:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark parse_spec against yaml.safe_load"
+    )
+    parser.add_argument("paths", nargs="+", help="YAML or JSON specifications")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    _benchmark(args.paths, args.repeat)
@@ -0,0 +1,218 @@
+"""
+Targeted repair of generated OpenAPI specifications.
+
+A generated spec that does not parse or validate is not regenerated as a whole. Only the part
+holding the errors is sent back to the LLM, with the errors, and the corrected part is spliced
+into the document before it is validated again:
+- YAML errors: the lines around the error are replaced by their corrected version
+- validation errors: the smallest object of the spec holding each error is replaced
+- errors about the document as a whole (no location in it) fall back to repairing all of it
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Optional
+
+import yaml
+
+from src.cache.EmbeddingCache import normalize_text
+from src.oas.Parsing import SpecParseError, parse_spec
+from src.prompts import OASRepairPrompt
+
+logger = logging.getLogger(__name__)
+
+FENCED = re.compile(r"^\s*```[\w-]*[ \t]*\n(.*?)\n\s*```\s*$", re.DOTALL)
+# lines given on each side of a YAML error
+CONTEXT_LINES = 10
+
+
+@dataclass
+class Patch:
+    "A part of a generated spec to repair"
+
+    # "lines" or "document" patches are always repaired alone, "node" ones in any number
+    kind: str  # "lines", "node" or "document"
+    fragment: str
+    errors: list[str]
+    # (first, last) line for "lines", the keys leading to the object for "node"
+    location: tuple = ()
+
+    def describe(self) -> str:
+        if self.kind == "lines":
+            return f"lines {self.location[0] + 1} to {self.location[1]}"
+        if self.kind == "node":
+            return " > ".join(str(key) for key in self.location)
+        return "the whole file"
+
+
+@dataclass
+class Generation:
+    "The outcome of generating (and repairing) a spec"
+
+    content: str
+    valid: bool
+    attempts: int = 1
+    errors: list[str] = field(default_factory=list)
+    cached: bool = False
+
+
+@lru_cache(maxsize=1)
+def get_repair_executor() -> ThreadPoolExecutor:
+    "The thread pool the sync repairs of this process go through (OAS_REPAIR_THREADS workers)"
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("OAS_REPAIR_THREADS", "8")),
+        thread_name_prefix="oas-repair",
+    )
+
+
+def request_key(text: str) -> str:
+    "Cache key of a generation request, the same for requests differing only in case or spacing"
+    return hashlib.sha256(normalize_text(text).lower().encode()).hexdigest()
+
+
+def strip_fences(text: str) -> str:
+    "The content of a markdown code block, which LLMs like to wrap YAML in"
+    match = FENCED.match(text or "")
+    return match.group(1) if match else (text or "")
+
+
+def _dump(node: Any) -> str:
+    return yaml.safe_dump(node, sort_keys=False, allow_unicode=True)
+
+
+def resolve_path(spec: Any, path: str) -> list:
+    """
+    The keys of an error path such as "paths//pets/{id}/get/responses" (the segments of the
+    validator, joined by "/" even when the keys contain "/"), as far as they exist in the spec.
+    """
+    segments = path.split("/")
+    keys: list = []
+    node = spec
+    i = 0
+    while i < len(segments):
+        if isinstance(node, dict):
+            # the longest key made of the next segments, e.g. "/pets/{id}"
+            for j in range(len(segments), i, -1):
+                key = "/".join(segments[i:j])
+                if key in node:
+                    break
+            else:
+                break
+            node = node[key]
+            keys.append(key)
+            i = j
+        elif isinstance(node, list) and segments[i].isdigit():
+            index = int(segments[i])
+            if index >= len(node):
+                break
+            node = node[index]
+            keys.append(index)
+            i += 1
+        else:
+            break
+    return keys
+
+
+def _node(spec: Any, keys: list) -> Any:
+    for key in keys:
+        spec = spec[key]
+    return spec
+
+
+def error_location(spec: Any, error: str) -> Optional[tuple]:
+    "The keys of the smallest object holding a validation error, None if it is about the document"
+    path, separator, _ = error.partition(": ")
+    if not separator or " " in path:
+        return None
+    keys = resolve_path(spec, path)
+    while keys and not isinstance(_node(spec, keys), (dict, list)):
+        keys.pop()
+    return tuple(keys) or None
+
+
+def line_patch(content: str, error: SpecParseError) -> Optional[Patch]:
+    """
+    The lines around a YAML error, None if the error has no position (e.g. a size limit). A
+    document that does not parse has a single error, so this is the only patch of its repair.
+    """
+    cause = error.__cause__
+    mark = getattr(cause, "problem_mark", None) or getattr(cause, "context_mark", None)
+    if mark is None:
+        return None
+    lines = content.splitlines()
+    first = max(0, mark.line - CONTEXT_LINES)
+    last = min(len(lines), mark.line + CONTEXT_LINES + 1)
+    return Patch(
+        kind="lines",
+        fragment="\n".join(lines[first:last]),
+        errors=[str(error)],
+        location=(first, last),
+    )
+
+
+def node_patches(spec: Any, errors: list[str]) -> list[Patch]:
+    "One patch per object holding validation errors, or a single one of the whole document"
+    located = [(error_location(spec, error), error) for error in errors]
+    if any(keys is None for keys, _ in located):
+        return [Patch(kind="document", fragment=_dump(spec), errors=errors)]
+
+    groups: dict[tuple, list[str]] = {}
+    # outer objects first, so that errors inside them are repaired with them
+    for keys, error in sorted(located, key=lambda pair: len(pair[0])):
+        outer = next((g for g in groups if keys[: len(g)] == g), keys)
+        groups.setdefault(outer, []).append(error)
+    return [
+        Patch(
+            kind="node", fragment=_dump(_node(spec, keys)), errors=group, location=keys
+        )
+        for keys, group in groups.items()
+    ]
+
+
+def repair_messages(patch: Patch) -> list[dict]:
+    errors = "\n".join(f"- {error}" for error in patch.errors)
+    return [
+        {"role": "system", "content": OASRepairPrompt},
+        {
+            "role": "user",
+            "content": f"Errors:\n{errors}\n\nLocation: {patch.describe()}\n\n"
+            f"{patch.fragment}",
+        },
+    ]
+
+
+def apply_patches(
+    content: str, spec: Any, patches: list[Patch], answers: list[str]
+) -> str:
+    """
+    Splice the corrected parts into the document (parts that cannot be parsed are left as they
+    were). A "lines" or "document" patch must be the only one.
+    """
+    if len(patches) != len(answers):
+        raise ValueError(f"{len(answers)} answers for {len(patches)} patches")
+    if len(patches) > 1 and any(p.kind != "node" for p in patches):
+        raise ValueError('"lines" and "document" patches must be applied alone')
+    answers = [strip_fences(answer) for answer in answers]
+    if patches[0].kind == "document":
+        return answers[0]
+    if patches[0].kind == "lines":
+        first, last = patches[0].location
+        lines = content.splitlines()
+        return "\n".join(lines[:first] + answers[0].splitlines() + lines[last:])
+
+    spec = copy.deepcopy(spec)
+    for patch, answer in zip(patches, answers):
+        try:
+            replacement = parse_spec(answer)
+        except SpecParseError as e:
+            logger.warning(f"Unusable repair of {patch.describe()}: {e}")
+            continue
+        *parents, key = patch.location
+        _node(spec, parents)[key] = replacement
+    return _dump(spec)
@@ -0,0 +1,160 @@
+"""
+Map-reduce review of an OpenAPI specification.
+
+The spec is partitioned by path and operation (the chunks of src/loaders/OASChunker.py, with
+their references resolved, packed into partitions of a token budget). Each partition is
+reviewed by its own LLM call, all of them concurrently but never more than
+OAS_REVIEW_CONCURRENCY at a time across the whole process (per event loop for the async
+reviews, in a shared thread pool for the sync ones), and each call answers with
+structured findings. The reducer then merges the findings, so that an issue found in many
+operations is reported once with all of its locations.
+
+The wall-clock time is that of the slowest partition (times the number of rounds the
+concurrency limit imposes) instead of growing with the size of one huge completion.
+"""
+
+import asyncio
+import json
+import os
+import re
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+from src.loaders.OASChunker import chunk_endpoint
+from src.oas.Digest import operations
+
+SEVERITIES = ("error", "warning", "info")
+JSON_ARRAY = re.compile(r"\[.*\]", re.DOTALL)
+
+_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def review_slots() -> asyncio.Semaphore:
+    "The semaphore every partition review of this process (and event loop) goes through"
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = asyncio.Semaphore(int(os.getenv("OAS_REVIEW_CONCURRENCY", "8")))
+    return _slots[loop]
+
+
+@lru_cache(maxsize=1)
+def get_review_executor() -> ThreadPoolExecutor:
+    "The thread pool every sync partition review of this process goes through"
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("OAS_REVIEW_CONCURRENCY", "8")),
+        thread_name_prefix="oas-review",
+    )
+
+
+@dataclass
+class Partition:
+    content: str
+    tokens: int
+    # "METHOD /path" of the operations it covers (in part or whole)
+    operations: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ReviewFinding:
+    severity: str
+    location: str
+    issue: str
+    suggestion: str = ""
+
+
+@dataclass
+class MergedFinding:
+    severity: str
+    issue: str
+    locations: list[str]
+    suggestions: list[str]
+
+
+def partition_spec(spec: dict, max_tokens: int) -> list[Partition]:
+    "Pack the chunks of the spec's operations, in order, into partitions of about `max_tokens`"
+    partitions: list[Partition] = []
+    paths = {path: item for path, _, _, item in operations(spec)}
+    for path, path_item in paths.items():
+        for chunk in chunk_endpoint(path, path_item, spec, max_tokens=max_tokens):
+            operation = f"{chunk['method'].upper()} {path}"
+            if not partitions or partitions[-1].tokens + chunk["tokens"] > max_tokens:
+                partitions.append(Partition(content="", tokens=0))
+            current = partitions[-1]
+            current.content += chunk["content"]
+            current.tokens += chunk["tokens"]
+            if operation not in current.operations:
+                current.operations.append(operation)
+    return partitions
+
+
+def parse_findings(
+    text: str, partition: Optional[Partition] = None
+) -> list[ReviewFinding]:
+    """
+    The findings of a partition review, answered as a JSON array of
+    {"severity", "location", "issue", "suggestion"} (possibly in a code block). An answer that
+    cannot be parsed is kept as a single finding, so that nothing the LLM said is lost.
+    """
+    match = JSON_ARRAY.search(text or "")
+    try:
+        items = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        items = None
+    if not isinstance(items, list):
+        location = ", ".join(partition.operations) if partition else ""
+        return [ReviewFinding("info", location, (text or "").strip())] if text else []
+
+    findings = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get("issue"):
+            continue
+        severity = str(item.get("severity", "info")).lower()
+        findings.append(
+            ReviewFinding(
+                severity=severity if severity in SEVERITIES else "info",
+                location=str(item.get("location", "")),
+                issue=" ".join(str(item["issue"]).split()),
+                suggestion=" ".join(str(item.get("suggestion", "")).split()),
+            )
+        )
+    return findings
+
+
+def reduce_findings(findings: list[ReviewFinding]) -> list[MergedFinding]:
+    "Merge the findings with the same severity and issue, most severe and most widespread first"
+    merged: dict[tuple[str, str], MergedFinding] = {}
+    for f in findings:
+        key = (f.severity, f.issue.lower().rstrip("."))
+        if key not in merged:
+            merged[key] = MergedFinding(f.severity, f.issue, [], [])
+        m = merged[key]
+        if f.location and f.location not in m.locations:
+            m.locations.append(f.location)
+        if f.suggestion and f.suggestion not in m.suggestions:
+            m.suggestions.append(f.suggestion)
+    return sorted(
+        merged.values(),
+        key=lambda m: (SEVERITIES.index(m.severity), -len(m.locations)),
+    )
+
+
+def format_review(merged: list[MergedFinding], max_locations: int = 5) -> str:
+    if not merged:
+        return "### Review\nThe review found nothing more to improve."
+    lines = ["### Review"]
+    for m in merged:
+        where = ", ".join(f"`{loc}`" for loc in m.locations[:max_locations])
+        if len(m.locations) > max_locations:
+            where += f" and {len(m.locations) - max_locations} more"
+        line = f"- **{m.severity}** {m.issue}"
+        if where:
+            line += f" ({where})"
+        if m.suggestions:
+            line += f"\n  Suggestion: {m.suggestions[0]}"
+        lines.append(line)
+    return "\n".join(lines)
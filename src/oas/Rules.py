@@ -0,0 +1,239 @@
+"""
+Deterministic checks of an OpenAPI specification, run before (and instead of asking) the LLM.
+
+The mechanical problems (the mandatory `info.domain` / `info.sub-domain`, missing servers,
+responses without descriptions, duplicate operation ids, undeclared path parameters,
+broken references...) are found in a single walk of the parsed spec, in milliseconds, and
+reported as structured findings. Only the questions that need judgement go to the LLM.
+"""
+
+import re
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from src.oas.Digest import operations
+from src.oas.Validation import ValidationResult
+
+ERROR = "error"
+WARNING = "warning"
+
+MANDATORY_INFO_FIELDS = ("domain", "sub-domain")
+PATH_TEMPLATE = re.compile(r"{([^}/]+)}")
+
+
+@dataclass
+class Finding:
+    rule: str
+    severity: str
+    location: str
+    message: str
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _resolve(spec: dict, node: Any) -> Any:
+    "Follow a local `$ref` (one level), returning None if it does not resolve"
+    if not (isinstance(node, dict) and isinstance(node.get("$ref"), str)):
+        return node
+    ref = node["$ref"]
+    if not ref.startswith("#/"):
+        return node  # external references are not followed
+    target = spec
+    for part in ref[2:].split("/"):
+        part = part.replace("~1", "/").replace("~0", "~")
+        if not isinstance(target, dict) or part not in target:
+            return None
+        target = target[part]
+    return target
+
+
+def _references(spec: dict) -> list[tuple[str, str]]:
+    "Every (location, local $ref) of the spec"
+    found = []
+    stack = [("#", spec)]
+    while stack:
+        location, node = stack.pop()
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if isinstance(ref, str) and ref.startswith("#/"):
+                found.append((location, ref))
+            stack.extend((f"{location}/{k}", v) for k, v in node.items())
+        elif isinstance(node, list):
+            stack.extend((f"{location}/{i}", v) for i, v in enumerate(node))
+    return found
+
+
+def _check_info(spec: dict) -> list[Finding]:
+    info = spec.get("info") if isinstance(spec.get("info"), dict) else {}
+    findings = [
+        Finding(
+            f"info-{name}",
+            ERROR,
+            "info",
+            f"info.{name} is mandatory for our APIs",
+        )
+        for name in MANDATORY_INFO_FIELDS
+        if not info.get(name)
+    ]
+    if not info.get("description"):
+        findings.append(
+            Finding("info-description", WARNING, "info", "info.description is missing")
+        )
+    return findings
+
+
+def _check_servers(spec: dict) -> list[Finding]:
+    if "swagger" in spec:
+        return (
+            []
+            if spec.get("host")
+            else [Finding("servers", WARNING, "host", "No host is declared")]
+        )
+    servers = spec.get("servers")
+    if not servers:
+        return [Finding("servers", WARNING, "servers", "No servers are declared")]
+    return [
+        Finding(
+            "servers-https",
+            WARNING,
+            f"servers/{i}",
+            f"Server {s.get('url')} does not use https",
+        )
+        for i, s in enumerate(servers)
+        if isinstance(s, dict) and str(s.get("url", "")).startswith("http://")
+    ]
+
+
+def _check_security(spec: dict) -> list[Finding]:
+    components = (
+        spec.get("components") if isinstance(spec.get("components"), dict) else {}
+    )
+    if components.get("securitySchemes") or spec.get("securityDefinitions"):
+        return []
+    return [
+        Finding("security", WARNING, "components", "No security schemes are declared")
+    ]
+
+
+def _parameters(node: dict) -> list:
+    "The parameters of a path item or operation, none if they are not a list"
+    parameters = node.get("parameters")
+    return parameters if isinstance(parameters, list) else []
+
+
+def _check_operation(
+    spec: dict, path: str, method: str, operation: dict, path_item: dict
+) -> list[Finding]:
+    location = f"{method.upper()} {path}"
+    findings = []
+    if not operation.get("operationId"):
+        findings.append(
+            Finding(
+                "operation-id", WARNING, location, "The operation has no operationId"
+            )
+        )
+    if not (operation.get("summary") or operation.get("description")):
+        findings.append(
+            Finding(
+                "operation-summary",
+                WARNING,
+                location,
+                "The operation has no summary or description",
+            )
+        )
+
+    declared = set()
+    for p in _parameters(path_item) + _parameters(operation):
+        p = _resolve(spec, p)
+        if isinstance(p, dict) and p.get("in") == "path":
+            declared.add(p.get("name"))
+    for name in PATH_TEMPLATE.findall(str(path)):
+        if name not in declared:
+            findings.append(
+                Finding(
+                    "path-parameter",
+                    ERROR,
+                    location,
+                    f"Path parameter '{name}' is not declared in the parameters",
+                )
+            )
+
+    responses = operation.get("responses")
+    if not isinstance(responses, dict) or not responses:
+        findings.append(
+            Finding("responses", ERROR, location, "The operation has no responses")
+        )
+        return findings
+    if not any(str(code).startswith(("2", "3")) for code in responses):
+        findings.append(
+            Finding(
+                "success-response",
+                WARNING,
+                f"{location} responses",
+                "No success (2xx or 3xx) response is documented",
+            )
+        )
+    for code, response in responses.items():
+        response = _resolve(spec, response)
+        if isinstance(response, dict) and not response.get("description"):
+            findings.append(
+                Finding(
+                    "response-description",
+                    ERROR,
+                    f"{location} responses/{code}",
+                    "The response has no description",
+                )
+            )
+    return findings
+
+
+def check_spec(
+    spec: dict, validation: Optional[ValidationResult] = None
+) -> list[Finding]:
+    """
+    Run every rule on a parsed spec. If it was validated, the validation errors are reported
+    as "schema" findings first.
+    """
+    findings = [
+        Finding("schema", ERROR, "", error)
+        for error in (validation.errors if validation else [])
+    ]
+    findings += _check_info(spec) + _check_servers(spec) + _check_security(spec)
+
+    operation_ids: dict[str, str] = {}
+    for path, method, operation, path_item in operations(spec):
+        findings += _check_operation(spec, path, method, operation, path_item)
+        operation_id = operation.get("operationId")
+        if not isinstance(operation_id, str):
+            continue  # missing ids are reported by _check_operation, others by the validator
+        if operation_id in operation_ids:
+            findings.append(
+                Finding(
+                    "operation-id-unique",
+                    ERROR,
+                    f"{method.upper()} {path}",
+                    f"operationId '{operation_id}' is also used by {operation_ids[operation_id]}",
+                )
+            )
+        elif operation_id:
+            operation_ids[operation_id] = f"{method.upper()} {path}"
+
+    for location, ref in _references(spec):
+        if _resolve(spec, {"$ref": ref}) is None:
+            findings.append(
+                Finding("reference", ERROR, location[2:], f"{ref} does not resolve")
+            )
+    return findings
+
+
+def format_findings(findings: list[Finding]) -> str:
+    "The findings as a markdown list, errors first"
+    if not findings:
+        return "### Automated checks\nNo problems were found by the automated checks."
+    ordered = sorted(findings, key=lambda f: f.severity != ERROR)
+    lines = ["### Automated checks"]
+    for f in ordered:
+        where = f" `{f.location}`" if f.location else ""
+        lines.append(f"- **{f.severity}**{where}: {f.message}")
+    return "\n".join(lines)
@@ -0,0 +1,121 @@
+"""
+Incremental parsing of a spec while it is being generated.
+
+A top-level block of a YAML document (`info:`, `paths:`, ...) is complete as soon as the next
+one starts, so each block is parsed, and the spec received so far validated, while the rest is
+still being generated. Errors show up early instead of after the whole generation.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from src.oas.Parsing import SpecParseError, parse_spec
+from src.oas.Validation import get_validation_engine
+
+# what the blocks still to come are replaced by when validating a partial spec
+PLACEHOLDERS = {
+    "openapi": "3.0.3",
+    "info": {"title": "placeholder", "version": "placeholder"},
+    "paths": {},
+}
+
+
+@dataclass
+class Block:
+    key: Optional[str]
+    content: str
+    # 1-based number of its first line in the document
+    line: int
+    value: Any = None
+    errors: list[str] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return {
+            "key": self.key,
+            "line": self.line,
+            "valid": not self.errors,
+            "errors": self.errors,
+        }
+
+
+class BlockParser:
+    "Fed the pieces of a streamed YAML document, returns its top-level blocks once complete"
+
+    def __init__(self):
+        self._partial = ""  # the last line, until its end arrives
+        self._lines: list[str] = []
+        self._line = 0  # number of the last complete line
+        self._block_line = 1
+        self._started = False  # whether the current block's key line has arrived
+        self.blocks: dict[str, Any] = {}
+
+    def feed(self, text: str) -> list[Block]:
+        *lines, self._partial = (self._partial + text).split("\n")
+        blocks = []
+        for line in lines:
+            self._line += 1
+            if line.startswith("```"):
+                # code fence around the document
+                continue
+            if self._starts_block(line):
+                if self._started:
+                    blocks.append(self._close_block())
+                self._started = True
+            if not self._lines:
+                self._block_line = self._line
+            self._lines.append(line)
+        return [b for b in blocks if b.key is not None]
+
+    def close(self) -> list[Block]:
+        "The blocks still open at the end of the document"
+        blocks = self.feed("\n") if self._partial else []
+        if self._lines:
+            blocks.append(self._close_block())
+        return [b for b in blocks if b.key is not None]
+
+    @staticmethod
+    def _starts_block(line: str) -> bool:
+        return bool(line) and not line[0].isspace() and line[0] not in "#-."
+
+    def _close_block(self) -> Block:
+        content = "\n".join(self._lines)
+        block = Block(key=None, content=content, line=self._block_line)
+        first = next(filter(self._starts_block, self._lines), "")
+        self._lines = []
+        self._started = False
+        try:
+            value = parse_spec(content)
+        except SpecParseError as e:
+            block.key = first.split(":", 1)[0]
+            block.errors.append(f"Block starting at line {block.line}: {e}")
+            return block
+        if isinstance(value, dict) and len(value) == 1:
+            [(block.key, block.value)] = value.items()
+            self.blocks[block.key] = block.value
+        elif value is not None:
+            block.key = first.split(":", 1)[0]
+            block.errors.append(
+                f"Block starting at line {block.line} is not a top-level field"
+            )
+        return block
+
+
+def partial_spec(blocks: dict[str, Any]) -> dict:
+    "The blocks received so far, with placeholders for the required ones still to come"
+    return {**PLACEHOLDERS, **blocks}
+
+
+async def acheck_block(block: Block, blocks: dict[str, Any]) -> Block:
+    """
+    Validate the spec received so far and add the errors located in `block` to it. Errors
+    without a location (e.g. references to components still to come) are left for the final
+    validation.
+    """
+    if block.errors:
+        return block
+    result = await get_validation_engine().avalidate(partial_spec(blocks))
+    for error in result.errors:
+        path, separator, _ = error.partition(": ")
+        if separator and path.split("/")[0] == block.key:
+            block.errors.append(error)
+    return block
@@ -0,0 +1,203 @@
+"""
+OpenAPI specification validation off the event loop.
+
+Validating a large specification is hundreds of milliseconds of CPU, so:
+- the validators (built by openapi_spec_validator when it is imported) are imported and
+  warmed up when a worker process starts
+- results are cached by the hash of the specification's content, and concurrent validations
+  of the same specification share one run. `avalidate` hashes in a thread, serialising a
+  large specification takes tens of milliseconds
+- `avalidate` runs validations in a process pool, so they neither block the event loop nor
+  hold the GIL that request handling needs
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Optional
+
+from src.cache.LRUCache import LRUCache
+from src.telemetry.Timings import stage
+
+logger = logging.getLogger(__name__)
+
+MAX_ERRORS = 20
+MAX_ERROR_CHARS = 300
+
+# the smallest valid document of each version, validated when a worker starts
+WARM_UP_SPECS = [
+    {"swagger": "2.0", "info": {"title": "warm up", "version": "1"}, "paths": {}},
+    {"openapi": "3.0.3", "info": {"title": "warm up", "version": "1"}, "paths": {}},
+    {"openapi": "3.1.0", "info": {"title": "warm up", "version": "1"}, "paths": {}},
+]
+
+
+@dataclass
+class ValidationResult:
+    valid: bool
+    version: Optional[str] = None
+    errors: list[str] = field(default_factory=list)
+    duration_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "valid": self.valid,
+            "version": self.version,
+            "errors": self.errors,
+            "duration_ms": round(self.duration_ms, 1),
+        }
+
+
+def spec_hash(spec: Any) -> str:
+    "Hash of a parsed specification's content, independent of key order"
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _truncate(message: str) -> str:
+    "Some messages quote the whole document"
+    if len(message) > MAX_ERROR_CHARS:
+        return message[: MAX_ERROR_CHARS - 3] + "..."
+    return message
+
+
+def _describe(error) -> str:
+    path = "/".join(str(p) for p in getattr(error, "absolute_path", []))
+    message = _truncate(getattr(error, "message", None) or str(error))
+    return f"{path}: {message}" if path else message
+
+
+def validate_spec(spec: Any) -> ValidationResult:
+    "Validate a parsed specification in this process (see ValidationEngine for the cached versions)"
+    # slow to import, so only loaded once a spec is validated
+    from jsonschema_path import SchemaPath
+    from openapi_spec_validator.shortcuts import SPEC2VALIDATOR
+    from openapi_spec_validator.versions.exceptions import OpenAPIVersionNotFound
+    from openapi_spec_validator.versions.shortcuts import get_spec_version
+
+    started = time.perf_counter()
+    if not isinstance(spec, dict):
+        return ValidationResult(valid=False, errors=["The document is not a mapping"])
+    try:
+        version = get_spec_version(spec)
+    except OpenAPIVersionNotFound:
+        return ValidationResult(
+            valid=False, errors=["No supported swagger or openapi version found"]
+        )
+
+    errors = []
+    try:
+        validator = SPEC2VALIDATOR[version](SchemaPath.from_dict(spec))
+        for error in validator.iter_errors():
+            errors.append(_describe(error))
+            if len(errors) >= MAX_ERRORS:
+                break
+    except Exception as e:
+        # malformed documents can break the validator itself (e.g. unresolvable $refs)
+        errors.append(_truncate(f"{type(e).__name__}: {e}"))
+    return ValidationResult(
+        valid=not errors,
+        version=f"{version.major}.{version.minor}",
+        errors=errors,
+        duration_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def warm_up():
+    "Import the validators and run each version once (in each worker process)"
+    for spec in WARM_UP_SPECS:
+        validate_spec(spec)
+
+
+class ValidationEngine:
+    """
+    Args:
+        workers: size of the process pool used by `avalidate`, 0 to validate in a thread instead
+        cache_size: how many results are kept
+    """
+
+    def __init__(self, workers: int = 2, cache_size: int = 256):
+        self.workers = workers
+        self.results = LRUCache(max_entries=cache_size)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> "ValidationEngine":
+        "Configured by OAS_VALIDATION_WORKERS and OAS_VALIDATION_CACHE_SIZE"
+        return cls(
+            workers=int(os.getenv("OAS_VALIDATION_WORKERS", "2")),
+            cache_size=int(os.getenv("OAS_VALIDATION_CACHE_SIZE", "256")),
+        )
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawned rather than forked: the app process has threads (and open sockets)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up,
+            )
+        return self._pool
+
+    def start(self):
+        "Start the worker processes now rather than on the first validation"
+        if self.workers > 0:
+            pool = self._get_pool()
+            for _ in range(self.workers):
+                pool.submit(int)
+
+    def validate(self, spec: Any) -> ValidationResult:
+        "Validate in the calling thread, using the cache"
+        key = spec_hash(spec)
+        result = self.results.get(key)
+        if result is None:
+            with stage("oas_validation"):
+                result = validate_spec(spec)
+            self.results.put(key, result)
+        return result
+
+    async def _run(self, spec: Any) -> ValidationResult:
+        if self.workers <= 0:
+            return await asyncio.to_thread(validate_spec, spec)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), validate_spec, spec)
+        except BrokenProcessPool:
+            logger.warning("The validation pool broke, validating in a thread instead")
+            self._pool = None
+            return await asyncio.to_thread(validate_spec, spec)
+
+    async def avalidate(self, spec: Any) -> ValidationResult:
+        "Validate in the process pool, using the cache and sharing concurrent runs"
+        key = await asyncio.to_thread(spec_hash, spec)
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._run(spec))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        with stage("oas_validation"):
+            result = await asyncio.shield(pending)
+        self.results.put(key, result)
+        return result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+@lru_cache(maxsize=1)
+def get_validation_engine() -> ValidationEngine:
+    return ValidationEngine.from_env()
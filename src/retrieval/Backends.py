@@ -0,0 +1,264 @@
+"""
+Retrieval backends for the HMRC collection.
+
+The HMRC collection holds three kinds of documents:
+- API descriptions: {"api": str, "$vector": [...]}
+- endpoint vectors: {"path": str, "$vector": [...]} (one per method description)
+- endpoint chunks: {"path": str, "content": str, "chunk": int}, those written by the
+  OASChunker are sections of an operation with their own vector:
+  {"path", "method", "section", "content", "tokens", "chunk", "$vector"}
+
+A backend answers the lookups that `hmrcLoader1.retrieve` needs, either against AstraDB or
+in-process from a snapshot of the collection.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from src.retrieval.LocalVectorIndex import build_index
+
+if TYPE_CHECKING:
+    from astrapy import AsyncCollection, Collection
+
+ENDPOINT_FILTER = {"path": {"$exists": True}}
+API_FILTER = {"api": {"$exists": True}}
+SECTION_FILTER = {"section": {"$exists": True}}
+MAX_CHUNKS_PER_PATH = 100
+# section vectors also have a path, so a search for `limit` distinct paths reads more hits
+PATH_OVERFETCH = 4
+
+
+def distinct_paths(documents, limit: int) -> list[str]:
+    "The first `limit` distinct paths of the documents, in order"
+    return list(dict.fromkeys(d["path"] for d in documents))[:limit]
+
+
+def group_by_path(documents) -> dict[str, list[dict]]:
+    grouped: dict[str, list[dict]] = {}
+    for doc in documents:
+        grouped.setdefault(doc["path"], []).append(doc)
+    return grouped
+
+
+class RetrievalBackend(ABC):
+    "This is the Abstract Base Class for the places we can retrieve HMRC documents from"
+
+    @abstractmethod
+    def find_api(self, embedding: list[float]) -> str:
+        "Return the description of the API closest to the embedding"
+        pass
+
+    @abstractmethod
+    def find_endpoint_paths(self, embedding: list[float], limit: int = 1) -> list[str]:
+        "Return the paths of the `limit` endpoint vectors closest to the embedding"
+        pass
+
+    @abstractmethod
+    def fetch_chunks(self, paths: list[str]) -> dict[str, list[dict]]:
+        "Return every document stored for each of the paths, in a single lookup"
+        pass
+
+    @abstractmethod
+    def find_sections(self, embedding: list[float], limit: int = 8) -> list[dict]:
+        "Return the `limit` endpoint sections closest to the embedding, best first"
+        pass
+
+    async def afind_api(self, embedding: list[float]) -> str:
+        return self.find_api(embedding)
+
+    async def afind_endpoint_paths(
+        self, embedding: list[float], limit: int = 1
+    ) -> list[str]:
+        return self.find_endpoint_paths(embedding, limit)
+
+    async def afetch_chunks(self, paths: list[str]) -> dict[str, list[dict]]:
+        return self.fetch_chunks(paths)
+
+    async def afind_sections(
+        self, embedding: list[float], limit: int = 8
+    ) -> list[dict]:
+        return self.find_sections(embedding, limit)
+
+
+class AstraBackend(RetrievalBackend):
+    "Runs every lookup against the AstraDB collection"
+
+    def __init__(
+        self,
+        collection: "Collection",
+        async_collection: Optional["AsyncCollection"] = None,
+    ):
+        self.collection = collection
+        self.async_collection = async_collection or collection.to_async()
+
+    def find_api(self, embedding: list[float]) -> str:
+        return self.collection.find_one(API_FILTER, sort={"$vector": embedding})["api"]
+
+    def find_endpoint_paths(self, embedding: list[float], limit: int = 1) -> list[str]:
+        endpoints = self.collection.find(
+            ENDPOINT_FILTER, sort={"$vector": embedding}, limit=limit * PATH_OVERFETCH
+        )
+        return distinct_paths(endpoints, limit)
+
+    def fetch_chunks(self, paths: list[str]) -> dict[str, list[dict]]:
+        documents = self.collection.find(
+            {"path": {"$in": paths}}, limit=MAX_CHUNKS_PER_PATH * len(paths)
+        )
+        return group_by_path(documents)
+
+    def find_sections(self, embedding: list[float], limit: int = 8) -> list[dict]:
+        return list(
+            self.collection.find(
+                SECTION_FILTER, sort={"$vector": embedding}, limit=limit
+            )
+        )
+
+    async def afind_api(self, embedding: list[float]) -> str:
+        api = await self.async_collection.find_one(
+            API_FILTER, sort={"$vector": embedding}
+        )
+        return api["api"]
+
+    async def afind_endpoint_paths(
+        self, embedding: list[float], limit: int = 1
+    ) -> list[str]:
+        endpoints = self.async_collection.find(
+            ENDPOINT_FILTER, sort={"$vector": embedding}, limit=limit * PATH_OVERFETCH
+        )
+        return distinct_paths([p async for p in endpoints], limit)
+
+    async def afetch_chunks(self, paths: list[str]) -> dict[str, list[dict]]:
+        documents = self.async_collection.find(
+            {"path": {"$in": paths}}, limit=MAX_CHUNKS_PER_PATH * len(paths)
+        )
+        return group_by_path([d async for d in documents])
+
+    async def afind_sections(
+        self, embedding: list[float], limit: int = 8
+    ) -> list[dict]:
+        sections = self.async_collection.find(
+            SECTION_FILTER, sort={"$vector": embedding}, limit=limit
+        )
+        return [s async for s in sections]
+
+
+class LocalBackend(RetrievalBackend):
+    """
+    Answers every lookup in-process from a snapshot of the collection: the vectors are held
+    in normalised float32 matrices and searched with a dot product.
+    """
+
+    def __init__(
+        self,
+        apis: list[str],
+        api_vectors,
+        endpoint_paths: list[str],
+        endpoint_vectors,
+        chunks: list[dict],
+        sections: Optional[list[dict]] = None,
+        section_vectors=None,
+    ):
+        self.apis = apis
+        self.endpoint_paths = endpoint_paths
+        self.api_index = build_index(api_vectors)
+        self.endpoint_index = build_index(endpoint_vectors)
+        self.chunks_by_path = group_by_path(chunks)
+        self.sections = sections or []
+        self.section_index = build_index(
+            section_vectors
+            if section_vectors is not None
+            else np.zeros((0, self.endpoint_index.vectors.shape[1]), dtype=np.float32)
+        )
+
+    @classmethod
+    def from_documents(cls, documents: list[dict]) -> "LocalBackend":
+        "Build the backend from the raw documents of the collection"
+        apis, api_vectors = [], []
+        endpoint_paths, endpoint_vectors = [], []
+        chunks = []
+        sections, section_vectors = [], []
+        for doc in documents:
+            vector = doc.get("$vector")
+            if "api" in doc and vector is not None:
+                apis.append(doc["api"])
+                api_vectors.append(vector)
+            elif "path" in doc:
+                chunk = {k: v for k, v in doc.items() if k != "$vector"}
+                if vector is not None:
+                    endpoint_paths.append(doc["path"])
+                    endpoint_vectors.append(vector)
+                    if "section" in doc:
+                        sections.append(chunk)
+                        section_vectors.append(vector)
+                chunks.append(chunk)
+        dimension = len((api_vectors or endpoint_vectors or [[]])[0])
+        return cls(
+            apis,
+            np.asarray(api_vectors, dtype=np.float32).reshape(-1, dimension),
+            endpoint_paths,
+            np.asarray(endpoint_vectors, dtype=np.float32).reshape(-1, dimension),
+            chunks,
+            sections,
+            np.asarray(section_vectors, dtype=np.float32).reshape(-1, dimension),
+        )
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> "LocalBackend":
+        "Load a snapshot written by `export_snapshot`"
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode())
+            return cls(
+                meta["apis"],
+                data["api_vectors"],
+                meta["endpoint_paths"],
+                data["endpoint_vectors"],
+                meta["chunks"],
+                meta.get("sections"),
+                data["section_vectors"] if "section_vectors" in data.files else None,
+            )
+
+    def find_api(self, embedding: list[float]) -> str:
+        return self.apis[self.api_index.search(embedding, 1)[0][0]]
+
+    def find_endpoint_paths(self, embedding: list[float], limit: int = 1) -> list[str]:
+        hits = self.endpoint_index.search(embedding, limit * PATH_OVERFETCH)
+        return distinct_paths(
+            ({"path": self.endpoint_paths[i]} for i, _ in hits), limit
+        )
+
+    def fetch_chunks(self, paths: list[str]) -> dict[str, list[dict]]:
+        return {p: list(self.chunks_by_path.get(p, [])) for p in paths}
+
+    def find_sections(self, embedding: list[float], limit: int = 8) -> list[dict]:
+        return [
+            self.sections[i] for i, _ in self.section_index.search(embedding, limit)
+        ]
+
+
+def export_snapshot(collection: "Collection", path: str) -> LocalBackend:
+    """
+    Dump the whole collection to a .npz snapshot that `LocalBackend.from_snapshot` can load:
+    the vectors are stored as float32 matrices and the documents as json
+    """
+    documents = list(collection.find({}, projection={"*": True}))
+    backend = LocalBackend.from_documents(documents)
+    meta = {
+        "apis": backend.apis,
+        "endpoint_paths": backend.endpoint_paths,
+        "chunks": [c for cs in backend.chunks_by_path.values() for c in cs],
+        "sections": backend.sections,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            api_vectors=backend.api_index.vectors,
+            endpoint_vectors=backend.endpoint_index.vectors,
+            section_vectors=backend.section_index.vectors,
+            meta=np.frombuffer(json.dumps(meta, default=str).encode(), dtype=np.uint8),
+        )
+    return backend
@@ -0,0 +1,376 @@
+"""
+An in-process similarity index over the deployed API catalogue, used by /discover.
+
+The catalogue (output.json: id, apiType and deploymentTimestamp of every deployed API) and
+the spec of each API are ingested once into a snapshot
+(`python -m src.retrieval.DiscoveryIndex <directory of specs>`, see `--help`) holding for
+every API:
+- the embedding of a description of it (title, description and operation summaries)
+- structural fingerprints: its normalised paths, its schema names and a MinHash signature of
+  its operation signatures ("get /returns/{}")
+
+A posted spec is fingerprinted and embedded the same way and the catalogue is ranked on a
+weighted sum of the similarities, in-process and in a few milliseconds, so the LLM is only
+asked to explain the matches.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+
+from src.oas.Digest import operations
+from src.oas.Parsing import SpecParseError, parse_spec
+from src.retrieval.LocalVectorIndex import normalize, top_k
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_PATH = "output.json"
+INDEX_PATH = os.getenv("DISCOVERY_INDEX_PATH", "data/discovery_index.npz")
+
+# how much each similarity counts when the query is a spec (a text query only has the embedding)
+WEIGHTS = {"embedding": 0.4, "operations": 0.3, "paths": 0.2, "schemas": 0.1}
+# the most summaries that go into the text embedded for an API
+MAX_SUMMARIES = 50
+
+PATH_PARAMETER = re.compile(r"\{[^}]*\}")
+# the largest prime below 2**32, so that a * x (with a, x below it) fits in 64 bits
+PRIME = 4294967291
+EMPTY = np.iinfo(np.uint64).max
+
+
+def normalize_path(path: str) -> str:
+    "Paths that only differ by the names of their parameters (or case) are the same path"
+    return PATH_PARAMETER.sub("{}", path.strip().lower()).rstrip("/") or "/"
+
+
+@dataclass
+class Fingerprint:
+    paths: frozenset[str]
+    schemas: frozenset[str]
+    operations: frozenset[str]
+
+
+def fingerprint(spec: dict) -> Fingerprint:
+    signatures = {
+        f"{method} {normalize_path(path)}" for path, method, _, _ in operations(spec)
+    }
+    components = spec.get("components") or {}
+    schemas = (components if isinstance(components, dict) else {}).get("schemas")
+    if not isinstance(schemas, dict):
+        schemas = spec.get("definitions") or {}  # swagger 2.0
+    return Fingerprint(
+        paths=frozenset(signature.split(" ", 1)[1] for signature in signatures),
+        schemas=frozenset(str(name).lower() for name in schemas),
+        operations=frozenset(signatures),
+    )
+
+
+def describe_spec(spec: dict) -> str:
+    "The text embedded for a spec"
+    info = spec.get("info") if isinstance(spec.get("info"), dict) else {}
+    summaries = []
+    for _, _, operation, _ in operations(spec):
+        summary = operation.get("summary") or operation.get("description")
+        if summary and len(summaries) < MAX_SUMMARIES:
+            summaries.append(str(summary).strip())
+    parts = [str(info.get("title", "")), str(info.get("description", ""))] + summaries
+    return "\n".join(p for p in parts if p)
+
+
+def describe_entry(entry: dict) -> str:
+    "The text embedded for an API of the catalogue without a spec: the words of its id"
+    return " ".join(entry["id"].removeprefix("apim-").split("-"))
+
+
+class MinHasher:
+    "MinHash signatures, whose agreement estimates the Jaccard similarity of two sets"
+
+    def __init__(self, num_perm: int = 64, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, tokens: frozenset[str]) -> np.ndarray:
+        if not tokens:
+            return np.full(self.a.shape, EMPTY, dtype=np.uint64)
+        hashes = np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(t.encode(), digest_size=4).digest(), "little"
+                )
+                for t in sorted(tokens)
+            ],
+            dtype=np.uint64,
+        ) % np.uint64(PRIME)
+        permuted = (np.outer(hashes, self.a) % PRIME + self.b) % PRIME
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def similarity(signatures: np.ndarray, signature: np.ndarray) -> np.ndarray:
+        "The estimated Jaccard similarity of `signature` with every row (0 for empty sets)"
+        if signature[0] == EMPTY:
+            return np.zeros(signatures.shape[0])
+        agreement = (signatures == signature).mean(axis=1)
+        agreement[signatures[:, 0] == EMPTY] = 0.0
+        return agreement
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+@dataclass
+class DiscoveryMatch:
+    id: str
+    api_type: str
+    deployed: str
+    score: float
+    similarity: float
+    operation_overlap: float = 0.0
+    path_overlap: float = 0.0
+    schema_overlap: float = 0.0
+    shared_paths: tuple[str, ...] = ()
+    shared_schemas: tuple[str, ...] = ()
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "api_type": self.api_type,
+            "deployed": self.deployed,
+            "score": round(self.score, 3),
+            "similarity": round(self.similarity, 3),
+            "operation_overlap": round(self.operation_overlap, 3),
+            "path_overlap": round(self.path_overlap, 3),
+            "schema_overlap": round(self.schema_overlap, 3),
+            "shared_paths": list(self.shared_paths),
+            "shared_schemas": list(self.shared_schemas),
+        }
+
+    def describe(self) -> str:
+        "A line of the context given to the LLM"
+        text = (
+            f"{self.id} ({self.api_type} API, deployed {self.deployed}): score {self.score:.2f}, "
+            f"description similarity {self.similarity:.2f}, operation overlap "
+            f"{self.operation_overlap:.2f}, path overlap {self.path_overlap:.2f}, "
+            f"schema overlap {self.schema_overlap:.2f}"
+        )
+        if self.shared_paths:
+            text += f"; shared paths: {', '.join(self.shared_paths)}"
+        if self.shared_schemas:
+            text += f"; shared schemas: {', '.join(self.shared_schemas)}"
+        return text
+
+
+class DiscoveryIndex:
+    """
+    Args:
+        entries: the catalogue entries (id, apiType, deploymentTimestamp)
+        vectors: the embedding of each entry, one row per entry
+        fingerprints: the fingerprint of each entry's spec, empty for entries without one
+    """
+
+    def __init__(
+        self,
+        entries: list[dict],
+        vectors,
+        fingerprints: list[Fingerprint],
+        hasher: Optional[MinHasher] = None,
+        signatures: Optional[np.ndarray] = None,
+    ):
+        self.entries = entries
+        self.vectors = normalize(vectors)
+        self.fingerprints = fingerprints
+        self.hasher = hasher or MinHasher()
+        if signatures is None:
+            signatures = np.array(
+                [self.hasher.signature(f.operations) for f in fingerprints],
+                dtype=np.uint64,
+            ).reshape(len(fingerprints), len(self.hasher.a))
+        self.signatures = signatures
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(
+        self, embedding, query: Optional[Fingerprint] = None, k: int = 5
+    ) -> list[DiscoveryMatch]:
+        "The k entries closest to the query, on their embeddings and (for specs) their fingerprints"
+        if not self.entries:
+            return []
+        similarity = np.clip(self.vectors @ normalize(embedding)[0], 0.0, 1.0)
+        scores = similarity
+        if query is not None:
+            operation_overlap = MinHasher.similarity(
+                self.signatures, self.hasher.signature(query.operations)
+            )
+            path_overlap = np.array(
+                [jaccard(query.paths, f.paths) for f in self.fingerprints]
+            )
+            schema_overlap = np.array(
+                [jaccard(query.schemas, f.schemas) for f in self.fingerprints]
+            )
+            scores = (
+                WEIGHTS["embedding"] * similarity
+                + WEIGHTS["operations"] * operation_overlap
+                + WEIGHTS["paths"] * path_overlap
+                + WEIGHTS["schemas"] * schema_overlap
+            )
+
+        matches = []
+        for i in top_k(scores, k):
+            entry = self.entries[i]
+            match = DiscoveryMatch(
+                id=entry["id"],
+                api_type=entry.get("apiType", ""),
+                deployed=entry.get("deploymentTimestamp", ""),
+                score=float(scores[i]),
+                similarity=float(similarity[i]),
+            )
+            if query is not None:
+                match.operation_overlap = float(operation_overlap[i])
+                match.path_overlap = float(path_overlap[i])
+                match.schema_overlap = float(schema_overlap[i])
+                match.shared_paths = tuple(
+                    sorted(query.paths & self.fingerprints[i].paths)
+                )
+                match.shared_schemas = tuple(
+                    sorted(query.schemas & self.fingerprints[i].schemas)
+                )
+            matches.append(match)
+        return matches
+
+    @classmethod
+    async def abuild(
+        cls,
+        entries: list[dict],
+        specs: dict[str, dict],
+        aembed_many: Callable[[list[str]], Awaitable[list[list[float]]]],
+        batch_size: int = 64,
+    ) -> "DiscoveryIndex":
+        "Embed and fingerprint the catalogue, `specs` maps API ids to their parsed specs"
+        texts, fingerprints = [], []
+        for entry in entries:
+            spec = specs.get(entry["id"])
+            if spec is None:
+                texts.append(describe_entry(entry))
+                fingerprints.append(Fingerprint(frozenset(), frozenset(), frozenset()))
+            else:
+                texts.append(describe_spec(spec) or describe_entry(entry))
+                fingerprints.append(fingerprint(spec))
+        vectors = []
+        for i in range(0, len(texts), batch_size):
+            vectors.extend(await aembed_many(texts[i : i + batch_size]))
+        return cls(entries, np.asarray(vectors, dtype=np.float32), fingerprints)
+
+    def save(self, path: str = INDEX_PATH):
+        "Written to a temporary file first, so a failed run never leaves half an index"
+        meta = {
+            "entries": self.entries,
+            "paths": [sorted(f.paths) for f in self.fingerprints],
+            "schemas": [sorted(f.schemas) for f in self.fingerprints],
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                vectors=self.vectors,
+                signatures=self.signatures,
+                hasher=np.stack([self.hasher.a, self.hasher.b]),
+                meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH) -> "DiscoveryIndex":
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode())
+            hasher = MinHasher(num_perm=data["hasher"].shape[1])
+            hasher.a, hasher.b = data["hasher"]
+            fingerprints = [
+                # the operations are only kept as their MinHash signatures
+                Fingerprint(frozenset(paths), frozenset(schemas), frozenset())
+                for paths, schemas in zip(meta["paths"], meta["schemas"])
+            ]
+            return cls(
+                meta["entries"],
+                data["vectors"],
+                fingerprints,
+                hasher=hasher,
+                signatures=data["signatures"],
+            )
+
+
+@lru_cache(maxsize=1)
+def get_discovery_index() -> Optional[DiscoveryIndex]:
+    "The index at DISCOVERY_INDEX_PATH, None if it has not been built"
+    if not Path(INDEX_PATH).is_file():
+        logger.info(f"No discovery index at {INDEX_PATH}, /discover uses the RAG")
+        return None
+    index = DiscoveryIndex.load(INDEX_PATH)
+    logger.info(f"Loaded the discovery index of {len(index)} APIs")
+    return index
+
+
+def load_catalogue(path: str = CATALOGUE_PATH) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_specs(directory: str, ids: set[str]) -> dict[str, Any]:
+    "The specs of the catalogue, in files named after the API ids (`<id>.yaml`, .yml or .json)"
+    specs = {}
+    for file_path in Path(directory).iterdir():
+        if file_path.stem not in ids or file_path.suffix.lower() not in (
+            ".yaml",
+            ".yml",
+            ".json",
+        ):
+            continue
+        try:
+            spec = parse_spec(file_path.read_bytes())
+        except SpecParseError as e:
+            logger.warning(f"Skipping the spec of {file_path.stem}: {e}")
+            continue
+        if isinstance(spec, dict):
+            specs[file_path.stem] = spec
+    return specs
+
+
+def main(argv: Optional[list[str]] = None):
+    from src.loaders import hmrcLoader1
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("specs", help="directory of the specs, named after the API ids")
+    parser.add_argument("--catalogue", default=CATALOGUE_PATH)
+    parser.add_argument("--output", default=INDEX_PATH)
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="texts per embedding call"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    entries = load_catalogue(args.catalogue)
+    specs = load_specs(args.specs, {entry["id"] for entry in entries})
+    logger.info(f"{len(specs)} of the {len(entries)} catalogue APIs have a spec")
+    index = asyncio.run(
+        DiscoveryIndex.abuild(
+            entries, specs, hmrcLoader1.aembed_many, batch_size=args.batch_size
+        )
+    )
+    index.save(args.output)
+    logger.info(f"Discovery index written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
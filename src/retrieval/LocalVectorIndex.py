@@ -0,0 +1,109 @@
+"""
+In-process vector indexes used to answer vector searches without a network round trip.
+
+Vectors are L2 normalised float32 rows so that a dot product is the cosine similarity
+(the metric of our AstraDB collections). A flat (exact) index is plenty for a few thousand
+vectors, the IVF index trades a little recall for speed on much larger corpora.
+"""
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    "Return float32 rows scaled to unit length (zero rows are left as zeros)"
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    "Indices of the k largest scores, best first"
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorIndex(ABC):
+    "This is the Abstract Base Class for the local vector indexes"
+
+    @abstractmethod
+    def search(self, vector, k: int = 1) -> list[tuple[int, float]]:
+        "Return the (row, cosine similarity) of the k nearest rows, best first"
+        pass
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+
+class FlatIndex(VectorIndex):
+    "Exact search: one matrix-vector product over every row"
+
+    def __init__(self, vectors):
+        self.vectors = normalize(vectors)
+
+    def search(self, vector, k: int = 1) -> list[tuple[int, float]]:
+        if len(self) == 0:
+            return []
+        scores = self.vectors @ normalize(vector)[0]
+        return [(int(i), float(scores[i])) for i in top_k(scores, k)]
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted file index: rows are clustered with spherical k-means and a query is only
+    compared against the rows of its `nprobe` closest clusters.
+    """
+
+    def __init__(
+        self,
+        vectors,
+        n_lists: int = 0,
+        nprobe: int = 8,
+        iterations: int = 10,
+        seed: int = 0,
+    ):
+        self.vectors = normalize(vectors)
+        n = len(self)
+        self.n_lists = min(n_lists or max(1, int(np.sqrt(n))), max(n, 1))
+        self.nprobe = min(nprobe, self.n_lists)
+        self.centroids = self._train(iterations, np.random.default_rng(seed))
+        assignments = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assignments == c) for c in range(self.n_lists)]
+
+    def _train(self, iterations: int, rng: np.random.Generator) -> np.ndarray:
+        if len(self) == 0:
+            return np.zeros((1, self.vectors.shape[1]), dtype=np.float32)
+        centroids = self.vectors[rng.choice(len(self), self.n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, self.vectors)
+            empty = ~sums.any(axis=1)
+            # reseed empty clusters so that every list is used
+            sums[empty] = self.vectors[rng.choice(len(self), int(empty.sum()))]
+            centroids = normalize(sums)
+        return centroids
+
+    def search(self, vector, k: int = 1) -> list[tuple[int, float]]:
+        if len(self) == 0:
+            return []
+        query = normalize(vector)[0]
+        probes = top_k(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate([self.lists[c] for c in probes])
+        scores = self.vectors[candidates] @ query
+        return [(int(candidates[i]), float(scores[i])) for i in top_k(scores, k)]
+
+
+def build_index(vectors, ivf_threshold: int = 50000) -> VectorIndex:
+    "A flat index for small corpora and an IVF index above `ivf_threshold` rows"
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 2 and vectors.shape[0] >= ivf_threshold:
+        return IVFIndex(vectors)
+    return FlatIndex(vectors)
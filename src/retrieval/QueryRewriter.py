@@ -0,0 +1,205 @@
+"""
+Rewrites the latest user message into a standalone retrieval query using the chat history.
+
+The rewrite is a whole LLM round trip before retrieval can start, so it is avoided where
+possible:
+- it is skipped when the latest user message looks self-contained
+- rewrites are cached on the window of recent turns they were computed from
+- in speculative mode retrieval starts on the raw message while the rewrite runs, and the
+  rewrite is only used if it arrives before a deadline
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+from typing import Awaitable, Callable, Optional
+
+from src.cache.EmbeddingCache import normalize_text
+from src.cache.LRUCache import LRUCache
+from src.clients.ClientRegistry import get_client_registry
+from src.prompts import HistoryRetrievalPrompt
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import stage
+
+# words that usually point back at something earlier in the conversation
+FOLLOW_UP_WORDS = {
+    "it",
+    "its",
+    "it's",
+    "that",
+    "this",
+    "these",
+    "those",
+    "they",
+    "them",
+    "their",
+    "there",
+    "he",
+    "she",
+    "one",
+    "ones",
+    "above",
+    "previous",
+    "earlier",
+    "same",
+    "also",
+    "else",
+    "instead",
+    "again",
+    "more",
+    "another",
+    "other",
+}
+FOLLOW_UP_OPENINGS = ("and ", "but ", "what about", "how about", "so ", "then ", "why")
+MIN_SELF_CONTAINED_WORDS = 5
+
+WORD = re.compile(r"[a-z']+")
+
+
+def last_user_message(chat_history: list[ChatMessage]) -> str:
+    for message in reversed(chat_history):
+        if message.role == "user":
+            return message.content
+    return chat_history[-1].content if chat_history else ""
+
+
+def looks_self_contained(text: str) -> bool:
+    "A cheap heuristic: long enough, not opening like a follow-up and without back references"
+    lowered = normalize_text(text).lower()
+    words = WORD.findall(lowered)
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    if lowered.startswith(FOLLOW_UP_OPENINGS):
+        return False
+    return not FOLLOW_UP_WORDS.intersection(words)
+
+
+class QueryRewriter:
+    """
+    Produces the retrieval query for a chat history.
+
+    Args:
+        llm: the litellm module (or anything with `completion` / `acompletion`), by default
+            the one from the client registry
+        window: how many of the most recent messages are given to the rewrite (and key the cache)
+        speculative: start retrieval on the raw message while the rewrite is running
+        deadline_seconds: how long speculative retrieval waits for the rewrite
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        window: int = 6,
+        cache: Optional[LRUCache] = None,
+        speculative: Optional[bool] = None,
+        deadline_seconds: Optional[float] = None,
+    ):
+        self.llm = llm or get_client_registry().litellm()
+        self.window = window
+        self.cache = cache if cache is not None else LRUCache(max_entries=2000)
+        self.speculative = (
+            speculative
+            if speculative is not None
+            else os.getenv("HMRC_REWRITE_SPECULATIVE", "false").lower() == "true"
+        )
+        self.deadline_seconds = (
+            deadline_seconds
+            if deadline_seconds is not None
+            else float(os.getenv("HMRC_REWRITE_DEADLINE_SECONDS", "1.5"))
+        )
+
+    def needs_rewrite(self, chat_history: list[ChatMessage]) -> bool:
+        "Only longer conversations whose latest user turn depends on earlier ones need a rewrite"
+        return len(chat_history) > 2 and not looks_self_contained(
+            last_user_message(chat_history)
+        )
+
+    def window_key(self, chat_history: list[ChatMessage]) -> str:
+        h = hashlib.sha256()
+        for m in chat_history[-self.window :]:
+            h.update(f"{m.role}\0{normalize_text(m.content)}\0".encode())
+        return h.hexdigest()
+
+    def prompt(self, chat_history: list[ChatMessage]) -> list[dict]:
+        return [
+            {
+                "role": "user",
+                "content": HistoryRetrievalPrompt + str(chat_history[-self.window :]),
+            }
+        ]
+
+    def rewrite(self, chat_history: list[ChatMessage]) -> str:
+        "Return the retrieval query, calling the LLM only when needed and not cached"
+        if not self.needs_rewrite(chat_history):
+            return last_user_message(chat_history)
+        key = self.window_key(chat_history)
+        query = self.cache.get(key)
+        if query is None:
+            with stage("rewrite"):
+                response = self.llm.completion(
+                    "azure/rag_pocs",
+                    messages=self.prompt(chat_history),
+                    temperature=0,
+                    max_tokens=200,
+                )
+            query = response.choices[0].message.content
+            self.cache.put(key, query)
+        return query
+
+    async def arewrite(self, chat_history: list[ChatMessage]) -> str:
+        "Async version of `rewrite`"
+        if not self.needs_rewrite(chat_history):
+            return last_user_message(chat_history)
+        key = self.window_key(chat_history)
+        query = self.cache.get(key)
+        if query is None:
+            with stage("rewrite"):
+                response = await self.llm.acompletion(
+                    "azure/rag_pocs",
+                    messages=self.prompt(chat_history),
+                    temperature=0,
+                    max_tokens=200,
+                )
+            query = response.choices[0].message.content
+            self.cache.put(key, query)
+        return query
+
+    async def aretrieve(
+        self,
+        chat_history: list[ChatMessage],
+        retrieve: Callable[[str], Awaitable[list]],
+    ) -> list:
+        """
+        Run `retrieve` on the best query available.
+
+        Without speculation (or when no LLM call is needed) this is just
+        `retrieve(await self.arewrite(chat_history))`. With speculation, retrieval on the raw
+        message and the rewrite start together; if the rewrite is ready within the deadline
+        retrieval is redone on it, otherwise the raw results are used (and the rewrite still
+        finishes in the background so it is cached for the next turn).
+        """
+        raw = last_user_message(chat_history)
+        if (
+            not self.speculative
+            or not self.needs_rewrite(chat_history)
+            or self.cache.get(self.window_key(chat_history)) is not None
+        ):
+            return await retrieve(await self.arewrite(chat_history))
+
+        raw_task = asyncio.ensure_future(retrieve(raw))
+        rewrite_task = asyncio.ensure_future(self.arewrite(chat_history))
+        # the rewrite may outlive this call, make sure its errors are not reported as unhandled
+        rewrite_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            query = await asyncio.wait_for(
+                asyncio.shield(rewrite_task), self.deadline_seconds
+            )
+        except Exception:
+            # too slow (or failed): fall back to the results for the raw message
+            return await raw_task
+
+        if normalize_text(query).lower() == normalize_text(raw).lower():
+            return await raw_task
+        raw_task.cancel()
+        return await retrieve(query)
@@ -0,0 +1,120 @@
+"""
+Exports what was recorded for each request (see Timings) as Prometheus metrics and as
+OpenTelemetry spans: one span for the request with a child span per stage.
+
+The metrics are served by the /metrics router. Spans go through the globally configured
+tracer provider; `configure_tracing` sets one up that exports over OTLP when
+OTEL_EXPORTER_OTLP_ENDPOINT is set, otherwise the OpenTelemetry API is a no-op.
+"""
+
+import logging
+import os
+
+from opentelemetry import trace
+from prometheus_client import Counter, Histogram
+
+from src.telemetry.Timings import RequestTimings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+BYTE_BUCKETS = (1e3, 5e3, 1e4, 5e4, 1e5, 5e5, 1e6)
+
+REQUEST_SECONDS = Histogram(
+    "rag_request_duration_seconds",
+    "Time to serve a request, including streaming the answer",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of a request (rewrite, embed, searches, completion...)",
+    ["route", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+MARK_SECONDS = Histogram(
+    "rag_request_mark_seconds",
+    "Time from the start of a request to the first and last token of the answer",
+    ["route", "mark"],
+    buckets=LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "rag_prompt_tokens",
+    "Tokens sent to the LLM per request",
+    ["route"],
+    buckets=TOKEN_BUCKETS,
+)
+COMPLETION_TOKENS = Histogram(
+    "rag_completion_tokens",
+    "Tokens generated by the LLM per request",
+    ["route"],
+    buckets=TOKEN_BUCKETS,
+)
+RETRIEVED_BYTES = Histogram(
+    "rag_retrieved_bytes",
+    "Size of the retrieved context per request",
+    ["route"],
+    buckets=BYTE_BUCKETS,
+)
+LLM_CALLS = Counter("rag_llm_calls", "LLM completion calls", ["route"])
+
+COUNT_HISTOGRAMS = {
+    "prompt_tokens": PROMPT_TOKENS,
+    "completion_tokens": COMPLETION_TOKENS,
+    "retrieved_bytes": RETRIEVED_BYTES,
+}
+
+
+def configure_tracing():
+    "Export spans over OTLP if OTEL_EXPORTER_OTLP_ENDPOINT is set (OTEL_SERVICE_NAME names the service)"
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(
+        resource=Resource.create(
+            {"service.name": os.getenv("OTEL_SERVICE_NAME", "rag-poc-hmrc")}
+        )
+    )
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    logger.info("Exporting traces over OTLP")
+
+
+def _observe(route: str, timings: RequestTimings, total_seconds: float):
+    REQUEST_SECONDS.labels(route).observe(total_seconds)
+    for name, ms in timings.durations().items():
+        STAGE_SECONDS.labels(route, name).observe(ms / 1000)
+    for name, ms in timings.marks.items():
+        MARK_SECONDS.labels(route, name).observe(ms / 1000)
+    for name, histogram in COUNT_HISTOGRAMS.items():
+        if name in timings.counts:
+            histogram.labels(route).observe(timings.counts[name])
+    if "llm_calls" in timings.counts:
+        LLM_CALLS.labels(route).inc(timings.counts["llm_calls"])
+
+
+def _spans(route: str, timings: RequestTimings, total_seconds: float):
+    tracer = trace.get_tracer(__name__)
+    start = timings.started_ns
+    root = tracer.start_span(route, start_time=start)
+    for name, value in timings.counts.items():
+        root.set_attribute(f"rag.{name}", value)
+    for name, ms in timings.marks.items():
+        root.set_attribute(f"rag.{name}_ms", ms)
+    context = trace.set_span_in_context(root)
+    for s in timings.stages:
+        stage_start = start + int(s.start_ms * 1e6)
+        span = tracer.start_span(s.name, context=context, start_time=stage_start)
+        span.end(end_time=stage_start + int(s.duration_ms * 1e6))
+    root.end(end_time=start + int(total_seconds * 1e9))
+
+
+def export_request(route: str, timings: RequestTimings, total_seconds: float):
+    "Record a finished request in the Prometheus metrics and as spans"
+    _observe(route, timings, total_seconds)
+    _spans(route, timings, total_seconds)
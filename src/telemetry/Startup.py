@@ -0,0 +1,92 @@
+"""
+A report of what starting the app costs.
+
+Slow imports and initialisers are wrapped in `startup_step(...)` (or imported with
+`timed_import`) and recorded in one process wide report, which the app logs once it has
+started. Steps run lazily on first use are recorded too, so the report also shows what the
+first request to each endpoint paid for.
+
+Run `python -m src.telemetry.Startup` for the report of importing main and building every
+chat object.
+"""
+
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+PROCESS_STARTED = time.perf_counter()
+
+
+@dataclass
+class StartupStep:
+    name: str
+    kind: str
+    duration_ms: float
+
+
+@dataclass
+class StartupReport:
+    steps: list[StartupStep] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, name: str, kind: str, duration_ms: float):
+        with self._lock:
+            self.steps.append(StartupStep(name, kind, duration_ms))
+
+    def as_dict(self) -> dict:
+        return {
+            "since_process_start_ms": round(
+                (time.perf_counter() - PROCESS_STARTED) * 1000, 1
+            ),
+            "steps": [
+                {"name": s.name, "kind": s.kind, "duration_ms": round(s.duration_ms, 1)}
+                for s in self.steps
+            ],
+        }
+
+    def format(self) -> str:
+        "The steps as a table, slowest first"
+        lines = [f"{'step':<50} {'kind':<8} {'ms':>9}"]
+        for s in sorted(self.steps, key=lambda s: s.duration_ms, reverse=True):
+            lines.append(f"{s.name:<50} {s.kind:<8} {s.duration_ms:>9.1f}")
+        return "\n".join(lines)
+
+
+@lru_cache(maxsize=1)
+def get_startup_report() -> StartupReport:
+    return StartupReport()
+
+
+@contextmanager
+def startup_step(name: str, kind: str = "init"):
+    "Record how long the enclosed block took in the startup report"
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_startup_report().record(name, kind, (time.perf_counter() - start) * 1000)
+
+
+def timed_import(module_name: str):
+    "Import a module, recording how long the import took"
+    with startup_step(module_name, "import"):
+        return importlib.import_module(module_name)
+
+
+def report_startup() -> str:
+    "Import main, build every chat object and return the report"
+    main = timed_import("main")
+    for lazy in main.LAZY_CHAT_OBJECTS:
+        lazy.get()
+    return get_startup_report().format()
+
+
+if __name__ == "__main__":
+    # run as a script this module is `__main__`, the report main records to is in the
+    # imported `src.telemetry.Startup`
+    from src.telemetry.Startup import report_startup
+
+    print(report_startup())
@@ -0,0 +1,131 @@
+"""
+Per-request stage timings.
+
+A RequestTimings object is bound to the current request through a context variable (which
+asyncio tasks and `run_in_context` threads inherit), and code anywhere in the request path
+records how long its stage took with `with stage("embed"): ...`. Stages record their start
+offset as well as their duration, so overlapping stages and the critical path are visible.
+
+Alongside the stages a request keeps counts (`count("prompt_tokens", n)`) and marks, the
+offsets of moments such as the first streamed token (`mark("first_token")`).
+"""
+
+import contextvars
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+
+@dataclass
+class StageTiming:
+    name: str
+    start_ms: float
+    duration_ms: float
+
+
+@dataclass
+class RequestTimings:
+    started: float = field(default_factory=time.perf_counter)
+    started_ns: int = field(default_factory=time.time_ns)
+    stages: list[StageTiming] = field(default_factory=list)
+    counts: dict[str, float] = field(default_factory=dict)
+    marks: dict[str, float] = field(default_factory=dict)
+
+    def record(self, name: str, start: float, end: float):
+        "Record a stage from two `time.perf_counter()` readings"
+        self.stages.append(
+            StageTiming(
+                name=name,
+                start_ms=(start - self.started) * 1000,
+                duration_ms=(end - start) * 1000,
+            )
+        )
+
+    def count(self, name: str, value: float = 1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def mark(self, name: str):
+        "Record the current offset (in ms) under `name`, the first time only"
+        if name not in self.marks:
+            self.marks[name] = (time.perf_counter() - self.started) * 1000
+
+    @property
+    def empty(self) -> bool:
+        return not (self.stages or self.counts or self.marks)
+
+    def durations(self) -> dict[str, float]:
+        "Total milliseconds spent in each stage"
+        totals: dict[str, float] = {}
+        for s in self.stages:
+            totals[s.name] = totals.get(s.name, 0.0) + s.duration_ms
+        return totals
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": [
+                {
+                    "name": s.name,
+                    "start_ms": round(s.start_ms, 1),
+                    "duration_ms": round(s.duration_ms, 1),
+                }
+                for s in sorted(self.stages, key=lambda s: s.start_ms)
+            ],
+            "counts": dict(self.counts),
+            "marks_ms": {name: round(ms, 1) for name, ms in self.marks.items()},
+        }
+
+    def server_timing(self) -> str:
+        "The stages formatted as a Server-Timing header"
+        return ", ".join(
+            f"{name};dur={duration:.1f}" for name, duration in self.durations().items()
+        )
+
+
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = (
+    contextvars.ContextVar("request_timings", default=None)
+)
+
+
+def start_timings() -> RequestTimings:
+    "Bind a fresh RequestTimings to the current context and return it"
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+
+@contextmanager
+def stage(name: str):
+    "Time the enclosed block as a stage of the current request (a no-op outside of one)"
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.record(name, start, time.perf_counter())
+
+
+def count(name: str, value: float = 1):
+    "Add to a count of the current request (a no-op outside of one)"
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.count(name, value)
+
+
+def mark(name: str):
+    "Mark a moment of the current request (a no-op outside of one)"
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.mark(name)
+
+
+def run_in_context(executor: ThreadPoolExecutor, fn: Callable, *args) -> Future:
+    "Submit `fn` to a thread pool with the caller's context, so its stages are recorded"
+    return executor.submit(contextvars.copy_context().run, fn, *args)
@@ -0,0 +1,48 @@
+"""
+Token counting with the cl100k_base tokenizer (the encoding of the azure gpt/ada models),
+shared by the history budget, the usage accounting, the spec digests and the ingestion.
+
+Counts of short texts (history messages, chunks, digest lines) are cached since they are
+counted again and again; long ones such as whole prompts or specs are not, so that the
+cache never holds on to more than TOKEN_COUNT_CACHE_SIZE * TOKEN_COUNT_CACHE_MAX_CHARS.
+"""
+
+import logging
+import os
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_CHARS = int(os.getenv("TOKEN_COUNT_CACHE_MAX_CHARS", "2000"))
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    "The tokenizer, or None when it cannot be loaded (tiktoken downloads it on first use)"
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"cl100k_base is unavailable, token counts are estimated: {e}")
+        return None
+
+
+def _count(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        # about four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+_cached_count = lru_cache(maxsize=int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096")))(
+    _count
+)
+
+
+def count_tokens(text: str) -> int:
+    "Number of cl100k_base tokens in a string"
+    if len(text) <= CACHE_MAX_CHARS:
+        return _cached_count(text)
+    return _count(text)
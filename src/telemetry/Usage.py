@@ -0,0 +1,65 @@
+"""
+Token and size accounting of the LLM calls, recorded on the current request (see Timings):
+- prompt_tokens / completion_tokens: what is sent to and generated by the LLM
+- retrieved_bytes: the size of the retrieved context put in the prompt
+- first_token / last_token marks: when the answer starts and finishes arriving
+"""
+
+from typing import AsyncGenerator, Generator
+
+from src.telemetry.Timings import count, mark
+from src.telemetry.Tokens import count_tokens
+
+
+def _text(content) -> str:
+    "Message content is either a string or a list of parts such as {'type': 'text', 'text': ...}"
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return content or ""
+
+
+def record_prompt(messages: list[dict]) -> int:
+    tokens = sum(count_tokens(_text(m.get("content"))) for m in messages)
+    count("prompt_tokens", tokens)
+    count("llm_calls")
+    return tokens
+
+
+def record_retrieved(chunks: list) -> int:
+    size = sum(len(str(c).encode()) for c in chunks)
+    count("retrieved_bytes", size)
+    return size
+
+
+def record_completion(response) -> int:
+    "For a complete (not streamed) response, using the usage the API reports if there is one"
+    mark("first_token")
+    mark("last_token")
+    usage = getattr(response, "usage", None)
+    tokens = getattr(usage, "completion_tokens", None)
+    if tokens is None:
+        tokens = count_tokens(_text(response.choices[0].message.content))
+    count("completion_tokens", tokens)
+    return tokens
+
+
+def instrument_stream(stream) -> Generator[str, None, None]:
+    "Pass a stream of text through, recording when it starts, ends and its tokens"
+    pieces = []
+    for piece in stream:
+        mark("first_token")
+        pieces.append(piece)
+        yield piece
+    mark("last_token")
+    count("completion_tokens", count_tokens("".join(pieces)))
+
+
+async def ainstrument_stream(stream) -> AsyncGenerator[str, None]:
+    "Async version of `instrument_stream`"
+    pieces = []
+    async for piece in stream:
+        mark("first_token")
+        pieces.append(piece)
+        yield piece
+    mark("last_token")
+    count("completion_tokens", count_tokens("".join(pieces)))
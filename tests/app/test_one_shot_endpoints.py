@@ -46,7 +46,7 @@ paths:
 DEBUG = os.getenv("DEBUG_RESPONSES") == "1"
 
 def test_oas_checker_one_shot_history(client):
-    client.app.state.HistoryObjectOASChecker._history.clear()
+    client.app.state.HistoryObjectOASChecker.clear()
 
     r1 = client.post("/oas-checker", json={"content": VALID_OAS, "streaming": False})
     assert r1.status_code == 200
@@ -63,7 +63,7 @@ def test_oas_checker_one_shot_history(client):
     assert client.app.state.HistoryObjectOASChecker.get_context_history()[0].content == "not-an-oas"
 
 def test_oas_checker_valid_vs_gibberish(client):
-    client.app.state.HistoryObjectOASChecker._history.clear()
+    client.app.state.HistoryObjectOASChecker.clear()
 
     rv = client.post("/oas-checker", json={"content": VALID_OAS, "streaming": False})
     assert rv.status_code == 200
@@ -77,7 +77,7 @@ def test_oas_checker_valid_vs_gibberish(client):
     assert "please provide" in txt and "open api specification" in txt
 
 def test_discovery_one_shot_history(client):
-    client.app.state.HistoryObjectDiscovery._history.clear()
+    client.app.state.HistoryObjectDiscovery.clear()
 
     r1 = client.post("/discover", json={"content": VALID_OAS, "streaming": False})
     assert r1.status_code == 200
@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from src.cache.EmbeddingCache import EmbeddingCache
+
+MODEL = "azure/text-embedding-ada-002"
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return [float(len(text)), 0.5, -1.0]
+
+
+@pytest.fixture
+def embedder():
+    return CountingEmbedder()
+
+
+def test_repeated_and_normalized_queries_hit(embedder):
+    cache = EmbeddingCache()
+    first = cache.get_or_compute(MODEL, "What is  the IRR API?", embedder)
+    second = cache.get_or_compute(MODEL, "  What is the IRR API? ", embedder)
+    assert first == second
+    assert embedder.calls == 1
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_model_is_part_of_the_key(embedder):
+    cache = EmbeddingCache()
+    cache.get_or_compute(MODEL, "hello", embedder)
+    cache.get_or_compute("other-model", "hello", embedder)
+    assert embedder.calls == 2
+
+
+def test_lru_eviction(embedder):
+    cache = EmbeddingCache(max_entries=1)
+    cache.get_or_compute(MODEL, "a", embedder)
+    cache.get_or_compute(MODEL, "b", embedder)
+    assert cache.get(MODEL, "a") is None
+    assert cache.get(MODEL, "b") is not None
+
+
+def test_persistent_tier_survives_restart(embedder, tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    EmbeddingCache(path=path).get_or_compute(MODEL, "hello", embedder)
+    cache = EmbeddingCache(path=path)
+    assert cache.get_or_compute(MODEL, "hello", embedder) == [5.0, 0.5, -1.0]
+    assert embedder.calls == 1
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_async_get_or_compute(embedder):
+    async def aembedder(text):
+        return embedder(text)
+
+    cache = EmbeddingCache()
+    asyncio.run(cache.aget_or_compute(MODEL, "hello", aembedder))
+    asyncio.run(cache.aget_or_compute(MODEL, "hello", aembedder))
+    assert embedder.calls == 1
+
+
+def test_async_lookups_use_the_persistent_tier(embedder, tmp_path):
+    async def aembedder(text):
+        return embedder(text)
+
+    path = str(tmp_path / "embeddings.sqlite3")
+    asyncio.run(EmbeddingCache(path=path).aget_or_compute(MODEL, "hello", aembedder))
+    cache = EmbeddingCache(path=path)
+    assert asyncio.run(cache.aget(MODEL, "hello")) == [5.0, 0.5, -1.0]
+    assert asyncio.run(cache.aget(MODEL, "other")) is None
+    assert embedder.calls == 1
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_batched_async_lookups(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    asyncio.run(EmbeddingCache(path=path).aput_many(MODEL, ["a", "b"], [[1.0], [2.0]]))
+    cache = EmbeddingCache(path=path)
+    cache.put(MODEL, "c", [3.0])
+    assert asyncio.run(cache.aget_many(MODEL, ["a", "c", "d", "b"])) == [
+        [1.0],
+        [3.0],
+        None,
+        [2.0],
+    ]
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["disk_hits"] == 2
+    assert cache.stats()["misses"] == 1
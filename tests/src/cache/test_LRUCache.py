@@ -0,0 +1,24 @@
+import time
+from src.cache.LRUCache import LRUCache
+
+
+def test_get_put_and_eviction():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl():
+    cache = LRUCache(ttl_seconds=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a", "missing") == "missing"
+    assert cache.items() == []
+    assert len(cache) == 0
@@ -0,0 +1,43 @@
+import asyncio
+import time
+from src.cache.ResponseCache import (
+    SemanticResponseCache,
+    areplay,
+    document_ids,
+    replay,
+)
+
+
+def test_similar_query_with_same_documents_hits():
+    cache = SemanticResponseCache(similarity_threshold=0.9)
+    ids = document_ids(["api description", "endpoint yaml"])
+    cache.store([1.0, 0.0], ids, "the answer")
+    assert cache.lookup([0.99, 0.05], ids) == "the answer"
+    assert cache.lookup([0.0, 1.0], ids) is None
+    assert cache.lookup([1.0, 0.0], document_ids(["another api"])) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_eviction_and_ttl():
+    cache = SemanticResponseCache(max_entries=1)
+    cache.store([1.0, 0.0], ("a",), "first")
+    cache.store([1.0, 0.0], ("b",), "second")
+    assert cache.lookup([1.0, 0.0], ("a",)) is None
+    assert cache.lookup([1.0, 0.0], ("b",)) == "second"
+
+    cache = SemanticResponseCache(ttl_seconds=0.01)
+    cache.store([1.0, 0.0], ("a",), "first")
+    time.sleep(0.02)
+    assert cache.lookup([1.0, 0.0], ("a",)) is None
+
+
+def test_replay_reproduces_the_answer():
+    answer = "Use the  Agent Authorisation API.\nIt needs a token."
+    assert "".join(replay(answer)) == answer
+    assert len(list(replay(answer))) > 1
+
+    async def collect():
+        return [piece async for piece in areplay(answer)]
+
+    assert "".join(asyncio.run(collect())) == answer
@@ -0,0 +1,29 @@
+import asyncio
+import pytest
+from src.chat.TestChat import TestChat
+from src.schemas.ChatSchemas import ChatMessage
+
+
+class StreamingTestChat(TestChat):
+    def chat_query(self, chat_history, streamed=False):
+        if streamed:
+            return iter(["Echo: ", chat_history[-1].content])
+        return super().chat_query(chat_history)
+
+
+@pytest.fixture
+def chat_history():
+    return [ChatMessage(role="user", content="Hello")]
+
+
+def test_default_achat_query(chat_history):
+    response = asyncio.run(TestChat().achat_query(chat_history))
+    assert response == ChatMessage(role="assistant", content="Echo: Hello")
+
+
+def test_default_achat_query_streamed(chat_history):
+    async def collect():
+        stream = await StreamingTestChat().achat_query(chat_history, streamed=True)
+        return [chunk async for chunk in stream]
+
+    assert asyncio.run(collect()) == ["Echo: ", "Hello"]
@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+from src.chat.Chat import Chat
+from src.chat.CoalescingChat import Broadcast, CoalescingChat
+from src.schemas.ChatSchemas import ChatMessage
+
+
+class SlowChat(Chat):
+    "Counts the queries it answers, each taking a little while"
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    def chat_query(self, chat_history, streamed=False):
+        raise NotImplementedError
+
+    async def achat_query(self, chat_history, streamed=False):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("LLM unavailable")
+        if not streamed:
+            return ChatMessage(role="assistant", content="answer")
+
+        async def stream():
+            for piece in ["an", "sw", "er"]:
+                await asyncio.sleep(0.005)
+                yield piece
+
+        return stream()
+
+
+def history(content):
+    return [ChatMessage(role="user", content=content)]
+
+
+async def collect(chat, chat_history, streamed):
+    response = await chat.achat_query(chat_history, streamed=streamed)
+    if streamed:
+        return "".join([piece async for piece in response])
+    return response.content
+
+
+def test_identical_concurrent_queries_share_one_computation():
+    inner = SlowChat()
+    chat = CoalescingChat(inner)
+
+    async def run():
+        return await asyncio.gather(
+            collect(chat, history("What is VAT?"), False),
+            collect(chat, history("  What   is VAT? "), False),
+            collect(chat, history("Something else"), False),
+        )
+
+    assert asyncio.run(run()) == ["answer"] * 3
+    assert inner.calls == 2
+    assert chat._in_flight == {}
+
+
+def test_a_streamed_answer_is_fanned_out_to_every_caller():
+    inner = SlowChat()
+    chat = CoalescingChat(inner)
+
+    async def run():
+        first = asyncio.ensure_future(collect(chat, history("q"), True))
+        await asyncio.sleep(0.015)  # join while the first answer is streaming
+        second = await collect(chat, history("q"), True)
+        return await first, second
+
+    assert asyncio.run(run()) == ("answer", "answer")
+    assert inner.calls == 1
+
+
+def test_queries_after_the_answer_are_not_coalesced():
+    inner = SlowChat()
+    chat = CoalescingChat(inner)
+
+    async def run():
+        await collect(chat, history("q"), True)
+        await collect(chat, history("q"), True)
+
+    asyncio.run(run())
+    assert inner.calls == 2
+
+
+def test_failures_reach_every_caller_and_are_not_kept():
+    inner = SlowChat(fail=True)
+    chat = CoalescingChat(inner)
+
+    async def run():
+        return await asyncio.gather(
+            collect(chat, history("q"), False),
+            collect(chat, history("q"), False),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert inner.calls == 1
+    assert chat._in_flight == {}
+
+
+def test_broadcast_raises_stream_errors_to_subscribers():
+    async def source():
+        yield "a"
+        raise ValueError("broken")
+
+    async def run():
+        broadcast = Broadcast(source())
+        return [piece async for piece in broadcast.subscribe()]
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_a_cancelled_stream_is_an_error_for_subscribers_not_a_cancellation():
+    async def source():
+        yield "a"
+        await asyncio.sleep(10)
+
+    async def run():
+        broadcast = Broadcast(source())
+        await asyncio.sleep(0)
+        broadcast.finished.cancel()
+        with pytest.raises(RuntimeError, match="cancelled"):
+            [piece async for piece in broadcast.subscribe()]
+        return broadcast.finished.cancelled()
+
+    assert asyncio.run(run())
+
+
+def test_other_attributes_are_delegated():
+    inner = SlowChat()
+    assert CoalescingChat(inner).calls == 0
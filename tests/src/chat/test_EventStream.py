@@ -0,0 +1,142 @@
+import asyncio
+import json
+from src.chat.EventStream import chat_events, spec_events
+from src.chat.SingleShotAgentOASCreate import SingleShotAgentCreate
+from src.clients.ClientRegistry import ClientRegistry
+from src.schemas.ChatSchemas import ChatMessage
+from src.telemetry.Timings import start_timings
+
+
+def parse(events):
+    parsed = []
+    for e in events:
+        name, data = e.strip().split("\n")
+        parsed.append((name.removeprefix("event: "), json.loads(data[len("data: ") :])))
+    return parsed
+
+
+def collect(answer, on_complete=None):
+    async def run():
+        return [e async for e in chat_events(answer, on_complete)]
+
+    return parse(asyncio.run(run()))
+
+
+def test_events_stream_the_answer_in_order():
+    completed = []
+
+    async def answer():
+        async def stream():
+            yield "Hello"
+            yield " world"
+
+        return stream()
+
+    events = collect(answer(), completed.append)
+    assert [name for name, _ in events] == [
+        "start",
+        "retrieval-done",
+        "token",
+        "token",
+        "done",
+    ]
+    assert events[-1][1]["content"] == "Hello world"
+    assert events[-1][1]["ttft_ms"] is not None
+    assert completed == ["Hello world"]
+
+
+def test_start_is_sent_before_the_answer_is_awaited():
+    started = []
+
+    async def answer():
+        started.append(True)
+        return ChatMessage(role="assistant", content="cached")
+
+    async def first_event():
+        events = chat_events(answer())
+        first = await events.__anext__()
+        await events.aclose()
+        return first
+
+    assert asyncio.run(first_event()).startswith("event: start")
+    assert started == []
+
+
+def test_a_complete_message_is_sent_as_one_token():
+    async def answer():
+        return ChatMessage(role="assistant", content="cached")
+
+    events = collect(answer())
+    assert events[2] == ("token", {"text": "cached"})
+    assert events[3][1]["content"] == "cached"
+
+
+def test_failures_are_sent_as_an_error_event():
+    completed = []
+
+    async def answer():
+        async def stream():
+            yield "Hel"
+            raise RuntimeError("connection reset")
+
+        return stream()
+
+    events = collect(answer(), completed.append)
+    assert events[-1] == ("error", {"message": "connection reset"})
+    assert completed == []
+
+
+def test_time_to_first_token_is_recorded_on_the_request():
+    async def request():
+        timings = start_timings()
+
+        async def answer():
+            return ChatMessage(role="assistant", content="hi")
+
+        [e async for e in chat_events(answer())]
+        return timings
+
+    assert "first_token" in asyncio.run(request()).marks
+
+
+def test_spec_events_check_blocks_and_end_with_the_validated_spec(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT_OAS", "oas")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    agent = SingleShotAgentCreate(sysPromptContent="create", clients=ClientRegistry())
+    spec = "openapi: 3.0.3\ninfo:\n  title: Pets\npaths: {}\n"
+
+    async def acomplete(messages, streamed=False):
+        if not streamed:
+            # the repair of the info block
+            return ChatMessage(role="assistant", content="title: Pets\nversion: '1'")
+
+        async def stream():
+            for line in spec.splitlines(keepends=True):
+                yield line
+
+        return stream()
+
+    agent.acomplete = acomplete
+    history = [ChatMessage(role="user", content="A pet store API")]
+    completed = []
+
+    async def run():
+        return [e async for e in spec_events(agent, history, completed.append)]
+
+    events = parse(asyncio.run(run()))
+    names = [name for name, _ in events]
+    assert names[0] == "start" and names[-1] == "done"
+    assert names.count("token") == 4
+    blocks = {data["key"]: data for name, data in events if name == "block"}
+    assert blocks["openapi"]["valid"] and blocks["paths"]["valid"]
+    assert blocks["info"]["errors"] == ["info: 'version' is a required property"]
+
+    done = events[-1][1]
+    assert done["valid"] and done["attempts"] == 2 and not done["cached"]
+    assert completed == [done["content"]]
+
+    # the next identical request is answered from the cache
+    events = parse(asyncio.run(run()))
+    assert [name for name, _ in events] == ["start", "token", "done"]
+    assert events[-1][1]["cached"]
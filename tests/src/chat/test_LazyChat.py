@@ -0,0 +1,30 @@
+import asyncio
+from src.chat.CoalescingChat import CoalescingChat
+from src.chat.LazyChat import LazyChat
+from src.chat.TestChat import TestChat
+from src.telemetry.Startup import get_startup_report
+
+
+def test_built_once_on_first_use():
+    lazy = LazyChat("src.chat.TestChat.TestChat")
+    assert not lazy.built
+    chat = lazy.get()
+    assert isinstance(chat, TestChat)
+    assert lazy.get() is chat
+    assert asyncio.run(lazy.aget()) is chat
+    names = [s.name for s in get_startup_report().steps]
+    assert "src.chat.TestChat" in names
+    assert "TestChat" in names
+
+
+def test_aget_builds_in_a_thread():
+    lazy = LazyChat("src.chat.TestChat.TestChat")
+    assert isinstance(asyncio.run(lazy.aget()), TestChat)
+    assert lazy.built
+
+
+def test_coalesce_wraps_the_chat():
+    lazy = LazyChat("src.chat.TestChat.TestChat", coalesce=True)
+    chat = lazy.get()
+    assert isinstance(chat, CoalescingChat)
+    assert isinstance(chat.chat, TestChat)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import pytest
+import threading
+import time
+import yaml
+from src.chat.OASChecker import OASCheckerAgent
+from src.clients.ClientRegistry import ClientRegistry
+from src.schemas.ChatSchemas import ChatMessage
+
+SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "VAT", "version": "1.0"},
+    "paths": {"/returns": {"get": {"responses": {"200": {"description": "ok"}}}}},
+}
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT_OAS", "oas")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    agent = OASCheckerAgent(sysPromptContent="checker", clients=ClientRegistry())
+    agent.sent = []
+
+    async def acomplete(messages, streamed=False):
+        agent.sent.append(messages)
+        if not streamed:
+            return ChatMessage(role="assistant", content="review")
+
+        async def stream():
+            yield "rev"
+            yield "iew"
+
+        return stream()
+
+    agent.acomplete = acomplete
+    return agent
+
+
+def ask(agent, content, streamed=False):
+    async def run():
+        response = await agent.achat_query(
+            [ChatMessage(role="user", content=content)], streamed=streamed
+        )
+        if streamed:
+            return "".join([piece async for piece in response])
+        return response.content
+
+    return asyncio.run(run())
+
+
+def test_the_llm_gets_the_digest_and_findings_not_the_spec(agent):
+    answer = ask(agent, yaml.safe_dump(SPEC))
+    assert answer.startswith("### Automated checks")
+    assert "info.domain is mandatory" in answer
+    assert answer.endswith("review")
+
+    system, user = agent.sent[0]
+    assert system is OASCheckerAgent.reviewprompt
+    assert "GET /returns" in user["content"]
+    assert "info.sub-domain is mandatory" in user["content"]
+
+
+def test_streamed_answers_start_with_the_findings(agent):
+    answer = ask(agent, yaml.safe_dump(SPEC), streamed=True)
+    assert answer.startswith("### Automated checks")
+    assert answer.endswith("review")
+
+
+def test_other_messages_use_the_system_prompt(agent):
+    ask(agent, "not-an-oas")
+    assert agent.sent[0][0] is agent.systemprompt
+    assert agent.sent[0][1]["content"] == "not-an-oas"
+
+
+def test_large_specs_are_reviewed_in_shards(agent):
+    spec = {
+        **SPEC,
+        "paths": {
+            f"/{tag}/{i}": {"get": {"tags": [tag], "responses": {"200": {}}}}
+            for tag in ("returns", "payments")
+            for i in range(10)
+        },
+    }
+    agent.max_digest_tokens = 200
+    answer = ask(agent, yaml.safe_dump(spec), streamed=True)
+    assert "#### Review of returns" in answer
+    assert "#### Review of payments" in answer
+    assert len(agent.sent) >= 2
+    for _, user in agent.sent:
+        # only the findings about the shard's own operations
+        assert "info.domain is mandatory" not in user["content"]
+        assert "responses/200" in user["content"]
+        assert ("/returns/" in user["content"]) != ("/payments/" in user["content"])
+
+
+def test_map_reduce_reviews_merge_the_findings_of_every_partition(agent):
+    spec = {
+        **SPEC,
+        "paths": {
+            f"/returns/{i}": {"get": {"responses": {"200": {"description": "ok"}}}}
+            for i in range(6)
+        },
+    }
+    agent.review_mode = "map-reduce"
+    agent.partition_tokens = 80
+
+    async def acomplete(messages, streamed=False):
+        agent.sent.append(messages)
+        finding = {
+            "severity": "warning",
+            "location": "GET /returns",
+            "issue": "No 404 response",
+            "suggestion": "Add a 404",
+        }
+        return ChatMessage(role="assistant", content=json.dumps([finding]))
+
+    agent.acomplete = acomplete
+    answer = ask(agent, yaml.safe_dump(spec), streamed=True)
+    assert answer.startswith("### Automated checks")
+    assert len(agent.sent) > 1
+    assert all(system is OASCheckerAgent.partitionprompt for system, _ in agent.sent)
+    assert answer.count("No 404 response") == 1
+    assert "### Review" in answer
+
+
+def test_sync_map_reduce_reviews_use_the_shared_review_threads(agent):
+    spec = {
+        **SPEC,
+        "paths": {
+            f"/returns/{i}": {"get": {"responses": {"200": {"description": "ok"}}}}
+            for i in range(6)
+        },
+    }
+    agent.review_mode = "map-reduce"
+    agent.partition_tokens = 80
+    threads = set()
+
+    def complete(messages, streamed=False):
+        threads.add(threading.current_thread().name)
+        agent.sent.append(messages)
+        finding = {"severity": "warning", "location": "GET /returns", "issue": "No 404"}
+        return ChatMessage(role="assistant", content=json.dumps([finding]))
+
+    agent.complete = complete
+    answer = agent.chat_query([ChatMessage(role="user", content=yaml.safe_dump(spec))])
+    assert answer.content.startswith("### Automated checks")
+    assert answer.content.count("No 404") == 1
+    assert len(agent.sent) > 1
+    assert all(name.startswith("oas-review") for name in threads)
+
+
+def test_sync_shard_reviews_run_concurrently_within_the_limit(agent):
+    spec = {
+        **SPEC,
+        "paths": {
+            f"/{tag}/{i}": {"get": {"tags": [tag], "responses": {"200": {}}}}
+            for tag in ("returns", "payments", "agents", "traders")
+            for i in range(10)
+        },
+    }
+    agent.max_digest_tokens = 200
+    agent.shard_concurrency = 2
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def complete(messages, streamed=False):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return ChatMessage(role="assistant", content="review")
+
+    agent.complete = complete
+    answer = agent.chat_query([ChatMessage(role="user", content=yaml.safe_dump(spec))])
+    for tag in ("returns", "payments", "agents", "traders"):
+        assert f"#### Review of {tag}" in answer.content
+    assert peak[0] == 2
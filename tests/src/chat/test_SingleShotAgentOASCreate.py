@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+import yaml
+
+from src.chat.SingleShotAgentOASCreate import SingleShotAgentCreate
+from src.clients.ClientRegistry import ClientRegistry
+from src.oas.Parsing import parse_spec
+from src.schemas.ChatSchemas import ChatMessage
+
+VALID = {
+    "openapi": "3.0.3",
+    "info": {"title": "Pets", "version": "1.0"},
+    "paths": {"/pets": {"get": {"responses": {"200": {"description": "ok"}}}}},
+}
+BROKEN = {
+    **VALID,
+    "paths": {"/pets": {"get": {"responses": {"200": {"content": {}}}}}},
+}
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT_OAS", "oas")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    agent = SingleShotAgentCreate(sysPromptContent="create", clients=ClientRegistry())
+    agent.sent = []
+    agent.answers = []
+
+    async def acomplete(messages, streamed=False):
+        agent.sent.append(messages)
+        return ChatMessage(role="assistant", content=agent.answers.pop(0))
+
+    agent.acomplete = acomplete
+    return agent
+
+
+def create(agent, content="A pet store API"):
+    return asyncio.run(agent.acreate([ChatMessage(role="user", content=content)]))
+
+
+def test_valid_generations_are_cached(agent):
+    agent.answers = [f"```yaml\n{yaml.safe_dump(VALID)}```"]
+    generation = create(agent)
+    assert generation.valid and generation.attempts == 1
+    assert parse_spec(generation.content) == VALID
+
+    again = create(agent, "a pet  store api")
+    assert again.cached and again.content == generation.content
+    assert len(agent.sent) == 1
+
+
+def test_only_the_broken_part_is_sent_for_repair(agent):
+    agent.answers = [yaml.safe_dump(BROKEN), "description: ok\ncontent: {}"]
+    generation = create(agent)
+    assert generation.valid and generation.attempts == 2
+
+    repair = agent.sent[1][1]["content"]
+    assert "paths > /pets > get > responses > 200" in repair
+    assert "openapi" not in repair
+    assert parse_spec(generation.content)["paths"]["/pets"]["get"]["responses"][
+        "200"
+    ] == {"description": "ok", "content": {}}
+
+
+def test_repairs_are_bounded(agent):
+    agent.max_repairs = 1
+    agent.answers = [yaml.safe_dump(BROKEN), "content: {}"]
+    generation = create(agent)
+    assert not generation.valid
+    assert generation.attempts == 2
+    assert generation.errors
+    assert len(agent.sent) == 2
+
+    # nothing invalid is cached
+    agent.answers = [yaml.safe_dump(VALID)]
+    assert not create(agent).cached
+
+
+def test_repairs_stop_at_the_time_budget(agent):
+    agent.time_budget = 0
+    agent.answers = [yaml.safe_dump(BROKEN)]
+    generation = create(agent)
+    assert not generation.valid
+    assert len(agent.sent) == 1
+
+
+def test_sync_create_runs_the_same_loop_and_cache(agent):
+    def complete(messages, streamed=False):
+        agent.sent.append(messages)
+        return ChatMessage(role="assistant", content=agent.answers.pop(0))
+
+    agent.complete = complete
+    agent.answers = [yaml.safe_dump(BROKEN), "description: ok\ncontent: {}"]
+    history = [ChatMessage(role="user", content="A pet store API")]
+    generation = agent.create(history)
+    assert generation.valid and generation.attempts == 2
+    assert "paths > /pets > get > responses > 200" in agent.sent[1][1]["content"]
+
+    # cached for the async path too
+    assert create(agent).cached
+    assert len(agent.sent) == 2
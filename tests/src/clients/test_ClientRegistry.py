@@ -0,0 +1,72 @@
+import asyncio
+import httpx
+from astrapy.api_commander import APICommander
+from src.clients.ClientRegistry import ClientRegistry, ClientSettings
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("HTTP_READ_TIMEOUT", "12")
+    monkeypatch.setenv("HTTP2", "false")
+    settings = ClientSettings.from_env()
+    assert settings.max_connections == 7
+    assert settings.timeout().read == 12
+    assert settings.http2 is False
+
+
+def test_clients_share_the_pools(monkeypatch):
+    monkeypatch.setattr(APICommander, "client", APICommander.client)
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    monkeypatch.setenv("ASTRA_DB_APPLICATION_TOKEN", "AstraCS:token")
+    monkeypatch.setenv(
+        "ASTRA_DB_API_ENDPOINT",
+        "https://01234567-89ab-cdef-0123-456789abcdef-eu-west-1.apps.astra.datastax.com",
+    )
+    registry = ClientRegistry(ClientSettings(max_connections=3))
+
+    http = registry.http_client()
+    assert registry.http_client() is http
+    assert http._transport._pool._max_connections == 3
+    assert registry.azure_openai()._client is http
+    assert registry.async_azure_openai()._client is registry.async_http_client()
+
+    llm = registry.litellm()
+    assert llm.client_session is http
+    assert llm.aclient_session is registry.async_http_client()
+
+    collection = registry.async_astra_collection("c")
+    assert registry.async_astra_collection("c") is collection
+    assert collection._api_commander.async_client is registry.async_http_client()
+
+    asyncio.run(registry.aclose())
+    assert http.is_closed
+    assert registry.http_client() is not http
+    registry.close()
+
+
+def test_astra_requests_go_through_the_pooled_clients(monkeypatch):
+    monkeypatch.setattr(APICommander, "client", APICommander.client)
+    monkeypatch.setenv("ASTRA_DB_APPLICATION_TOKEN", "AstraCS:token")
+    monkeypatch.setenv(
+        "ASTRA_DB_API_ENDPOINT",
+        "https://01234567-89ab-cdef-0123-456789abcdef-eu-west-1.apps.astra.datastax.com",
+    )
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(
+            200, json={"data": {"documents": [], "nextPageState": None}}
+        )
+
+    registry = ClientRegistry()
+    registry._clients["http"] = httpx.Client(transport=httpx.MockTransport(handler))
+    registry._clients["async_http"] = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler)
+    )
+
+    assert registry.astra_collection("c").find_one({}) is None
+    assert asyncio.run(registry.async_astra_collection("c").find_one({})) is None
+    assert len(requests) == 2
+    assert all(path.endswith("/c") for path in requests)
@@ -0,0 +1,71 @@
+import time
+import pytest
+from src.history.BasicHistory import BaseHistory, OneShotHistory
+from src.history.HistoryStore import InMemoryHistoryStore, SQLiteHistoryStore
+from src.schemas.ChatSchemas import ChatMessage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryHistoryStore(max_sessions=2, max_messages=3)
+    return SQLiteHistoryStore(path=str(tmp_path / "history.sqlite3"), max_messages=3)
+
+
+def message(i: int) -> ChatMessage:
+    return ChatMessage(role="user", content=f"message {i}")
+
+
+def test_sessions_are_isolated(store):
+    store.append_message("a", message(1))
+    store.append_message("b", message(2))
+    assert store.get_messages("a") == [message(1)]
+    assert store.get_messages("b") == [message(2)]
+    assert store.get_messages("c") == []
+
+
+def test_max_messages_keeps_newest(store):
+    for i in range(5):
+        store.append_message("a", message(i))
+    assert store.get_messages("a") == [message(2), message(3), message(4)]
+
+
+def test_clear(store):
+    store.append_message("a", message(1))
+    store.append_message("b", message(2))
+    store.clear("a")
+    assert store.get_messages("a") == []
+    assert store.get_messages("b") == [message(2)]
+    store.clear()
+    assert store.get_messages("b") == []
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = InMemoryHistoryStore(max_sessions=2)
+    store.append_message("a", message(1))
+    store.append_message("b", message(2))
+    store.get_messages("a")
+    store.append_message("c", message(3))
+    assert store.get_messages("a") == [message(1)]
+    assert store.get_messages("b") == []
+
+
+def test_memory_store_ttl():
+    store = InMemoryHistoryStore(ttl_seconds=0.01)
+    store.append_message("a", message(1))
+    time.sleep(0.02)
+    assert store.get_messages("a") == []
+
+
+def test_sqlite_store_shared_between_connections(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    SQLiteHistoryStore(path=path).append_message("a", message(1))
+    assert SQLiteHistoryStore(path=path).get_messages("a") == [message(1)]
+
+
+def test_history_objects_keyed_by_session():
+    history = OneShotHistory(store=InMemoryHistoryStore())
+    history.record_message(message(1), session_id="a")
+    history.record_message(message(2), session_id="b")
+    assert history.get_context_history("a") == [message(1)]
+    assert BaseHistory().get_history("a") == []
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from src.history.HistoryStore import InMemoryHistoryStore
+from src.history.TokenBudgetHistory import SUMMARY_PREFIX, TokenBudgetHistory
+from src.schemas.ChatSchemas import ChatMessage
+
+
+class RecordingSummariser:
+    "Summarises by concatenating and remembers what it was asked to fold in"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, summary, messages):
+        self.calls.append([m.content for m in messages])
+        return " ".join([summary] + [m.content for m in messages]).strip()
+
+
+@pytest.fixture
+def summariser():
+    return RecordingSummariser()
+
+
+@pytest.fixture
+def history(summariser):
+    # every message costs 1 word + 4 overhead = 5 tokens, so 3 messages fit in 15
+    return TokenBudgetHistory(
+        store=InMemoryHistoryStore(max_messages=100),
+        max_context_tokens=15,
+        summariser=summariser,
+        token_counter=lambda text: len(text.split()),
+    )
+
+
+def record_turns(history, n, start=0):
+    for i in range(start, start + n):
+        history.record_message(ChatMessage(role="user", content=f"q{i}"))
+        history.record_message(ChatMessage(role="assistant", content=f"a{i}"))
+
+
+def test_short_history_is_returned_unchanged(history, summariser):
+    history.record_message(ChatMessage(role="user", content="q0"))
+    assert history.get_context_history() == [ChatMessage(role="user", content="q0")]
+    assert summariser.calls == []
+
+
+def test_window_starts_on_user_turn_and_summarises_the_rest(history, summariser):
+    record_turns(history, 3)
+    history.record_message(ChatMessage(role="user", content="q3"))
+    context = history.get_context_history()
+    assert [m.content for m in context[1:]] == ["q2", "a2", "q3"]
+    assert context[0].content == SUMMARY_PREFIX + "q0 a0 q1 a1"
+    assert summariser.calls == [["q0", "a0", "q1", "a1"]]
+
+
+def test_summary_is_incremental(history, summariser):
+    record_turns(history, 3)
+    history.get_context_history()
+    history.get_context_history()
+    assert len(summariser.calls) == 1
+    record_turns(history, 1, start=3)
+    context = history.get_context_history()
+    assert summariser.calls[-1] == ["q2", "a2"]
+    assert context[0].content == SUMMARY_PREFIX + "q0 a0 q1 a1 q2 a2"
+
+
+def test_async_context_history(summariser):
+    async def asummariser(summary, messages):
+        return summariser(summary, messages)
+
+    history = TokenBudgetHistory(
+        max_context_tokens=15,
+        asummariser=asummariser,
+        token_counter=lambda text: len(text.split()),
+    )
+    record_turns(history, 3)
+    context = asyncio.run(history.aget_context_history())
+    assert context[0].content.startswith(SUMMARY_PREFIX)
+    assert len(summariser.calls) == 1
@@ -0,0 +1,20 @@
+from src.loaders.IndexManifest import IndexManifest, content_hash
+
+
+def test_content_hash_ignores_id_and_vector():
+    document = {"path": "/a", "content": "x"}
+    assert content_hash(document) == content_hash(
+        {**document, "_id": "1", "$vector": [0.1]}
+    )
+    assert content_hash(document) != content_hash(document, "embedded text")
+
+
+def test_save_load_and_diff(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    assert IndexManifest.load(path).hashes == {}
+    IndexManifest({"a": "1", "b": "2"}).save(path)
+    diff = IndexManifest.load(path).diff({"a": "1", "b": "3", "c": "4"})
+    assert diff.added == ["c"]
+    assert diff.changed == ["b"]
+    assert diff.removed == []
+    assert diff.unchanged == 1
@@ -0,0 +1,174 @@
+import asyncio
+import time
+import pytest
+from src.loaders.IndexManifest import IndexManifest, document_id
+from src.loaders.Ingestion import (
+    RateLimiter,
+    endpoint_documents,
+    ingest,
+    manifest_hashes,
+    plan_incremental,
+    retry_with_backoff,
+    spec_documents,
+    upsert_many,
+)
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_retry_with_backoff():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RateLimited()
+        return "ok"
+
+    assert asyncio.run(retry_with_backoff(flaky, base_delay=0.001)) == "ok"
+    assert len(calls) == 3
+
+    async def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        asyncio.run(retry_with_backoff(broken, base_delay=0.001))
+    assert len(calls) == 1
+
+
+def test_rate_limiter_waits_for_the_budget():
+    async def run():
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60000)
+        limiter.available["requests"] = 0
+        start = time.monotonic()
+        await limiter.acquire(10)
+        return time.monotonic() - start
+
+    # one request refills in 0.1s at 600 per minute
+    assert asyncio.run(run()) >= 0.08
+
+
+def test_endpoint_documents():
+    endpoint = {
+        "get": {"description": "Fetch an agent"},
+        "parameters": [{"name": "arn"}],
+        "post": {"summary": "Create an agent"},
+    }
+    to_embed = endpoint_documents("/agents", endpoint, "Agents API")
+    assert to_embed[:2] == [
+        (
+            {"path": "/agents", "_id": document_id("Agents API", "/agents", "get")},
+            "Fetch an agent",
+        ),
+        (
+            {
+                "path": "/agents",
+                "description": "Create an agent",
+                "_id": document_id("Agents API", "/agents", "post"),
+            },
+            "Create an agent",
+        ),
+    ]
+    sections = [d for d, _ in to_embed[2:]]
+    assert [(d["method"], d["section"]) for d in sections] == [
+        ("get", "operation"),
+        ("get", "parameters"),
+        ("post", "operation"),
+        ("post", "parameters"),
+    ]
+    assert sections[1]["_id"] == document_id(
+        "Agents API", "/agents", "get", "parameters"
+    )
+    # only the API description documents have an "api" field
+    assert all("api" not in d for d, _ in to_embed)
+
+
+def test_plan_incremental_only_keeps_what_changed():
+    spec = {
+        "info": {"title": "Agents API"},
+        "paths": {
+            "/a": {"get": {"description": "A"}},
+            "/b": {"get": {"description": "B"}},
+        },
+    }
+    manifest = IndexManifest(
+        manifest_hashes(spec_documents([spec], ["the agents api"]))
+    )
+
+    spec["paths"]["/b"]["get"]["description"] = "B, changed"
+    del spec["paths"]["/a"]
+    spec["paths"]["/c"] = {"get": {"description": "C"}}
+    to_embed, diff, hashes = plan_incremental(
+        spec_documents([spec], ["the agents api"]), manifest
+    )
+    assert sorted(d["path"] for d, _ in to_embed) == ["/b", "/b", "/c", "/c"]
+    assert "B, changed" in [text for _, text in to_embed]
+    assert diff.summary() == {"added": 2, "changed": 2, "removed": 2, "unchanged": 1}
+    assert manifest.diff(hashes).removed == diff.removed
+
+
+def test_ingest_batches_embeddings_and_bounds_inserts():
+    embed_calls, inserts = [], []
+
+    async def embed_many(texts):
+        embed_calls.append(texts)
+        return [[float(len(t))] for t in texts]
+
+    async def insert(chunk):
+        inserts.append(chunk)
+
+    to_embed = [({"path": f"/p{i}"}, "t" * i) for i in range(1, 9)]
+    report = asyncio.run(
+        ingest(
+            to_embed,
+            insert,
+            embed_many=embed_many,
+            batch_size=3,
+            insert_chunk_size=2,
+        )
+    )
+    assert [len(c) for c in embed_calls] == [3, 3, 2]
+    assert all(len(c) <= 2 for c in inserts)
+    inserted = [d for c in inserts for d in c]
+    assert len(inserted) == 8
+    assert {"path": "/p5", "$vector": [5.0]} in inserted
+    assert report["documents"] == 8
+    assert report["embedding_calls"] == 3
+    assert report["tokens"] > 0
+
+
+def test_upsert_many_replaces_documents_already_inserted():
+    from astrapy.exceptions import DataAPIErrorDescriptor, InsertManyException
+    from astrapy.results import InsertManyResult
+
+    class Collection:
+        def __init__(self):
+            self.documents = {"b": {"_id": "b", "v": 0}, "c": {"_id": "c", "v": 0}}
+
+        async def insert_many(self, documents, ordered):
+            inserted = [d["_id"] for d in documents if d["_id"] not in self.documents]
+            for d in documents:
+                self.documents.setdefault(d["_id"], d)
+            if len(inserted) < len(documents):
+                raise InsertManyException(
+                    text="duplicates",
+                    partial_result=InsertManyResult(
+                        raw_results=[], inserted_ids=inserted
+                    ),
+                    error_descriptors=[
+                        DataAPIErrorDescriptor({"errorCode": "DOCUMENT_ALREADY_EXISTS"})
+                    ],
+                    detailed_error_descriptors=[],
+                )
+
+        async def replace_one(self, filter, document, upsert):
+            self.documents[filter["_id"]] = document
+
+    collection = Collection()
+    documents = [{"_id": i, "v": 1} for i in "abc"]
+    asyncio.run(upsert_many(collection, documents, {"c"}))
+    assert collection.documents == {d["_id"]: d for d in documents}
@@ -0,0 +1,80 @@
+from src.loaders.OASChunker import chunk_endpoint, resolve_refs
+
+SPEC = {
+    "components": {
+        "schemas": {
+            "Agent": {
+                "type": "object",
+                "properties": {"arn": {"type": "string"}},
+            },
+            "Node": {
+                "type": "object",
+                "properties": {"child": {"$ref": "#/components/schemas/Node"}},
+            },
+        },
+        "parameters": {"Arn": {"name": "arn", "in": "path", "required": True}},
+    }
+}
+
+ENDPOINT = {
+    "parameters": [{"$ref": "#/components/parameters/Arn"}],
+    "get": {
+        "summary": "Fetch an agent",
+        "responses": {
+            "200": {
+                "description": "The agent",
+                "content": {
+                    "application/json": {
+                        "schema": {"$ref": "#/components/schemas/Agent"}
+                    }
+                },
+            },
+            "404": {"description": "Not found"},
+        },
+    },
+    "post": {
+        "summary": "Create an agent",
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": {"$ref": "#/components/schemas/Agent"}}
+            }
+        },
+        "responses": {"201": {"description": "Created"}},
+    },
+}
+
+
+def test_resolve_refs_handles_recursion():
+    resolved = resolve_refs({"$ref": "#/components/schemas/Node"}, SPEC)
+    assert resolved["type"] == "object"
+    assert resolved["properties"]["child"] == {"$ref": "#/components/schemas/Node"}
+    assert resolve_refs({"$ref": "#/missing"}, SPEC) == {"$ref": "#/missing"}
+
+
+def test_chunks_follow_the_operations():
+    chunks = chunk_endpoint("/agents/{arn}", ENDPOINT, SPEC)
+    assert [(c["method"], c["section"]) for c in chunks] == [
+        ("get", "operation"),
+        ("get", "parameters"),
+        ("get", "responses/200"),
+        ("get", "responses/404"),
+        ("post", "operation"),
+        ("post", "parameters"),
+        ("post", "requestBody"),
+        ("post", "responses/201"),
+    ]
+    assert [c["chunk"] for c in chunks] == list(range(8))
+    assert "arn:" in chunks[2]["content"] and "$ref" not in chunks[2]["content"]
+    assert "required: true" in chunks[1]["content"]
+    assert all(c["tokens"] > 0 for c in chunks)
+
+
+def test_long_sections_are_split_on_lines():
+    endpoint = {"get": {"parameters": [{"name": f"p{i}"} for i in range(200)]}}
+    chunks = chunk_endpoint("/long", endpoint, max_tokens=100)
+    assert len(chunks) > 1
+    assert chunks[0]["section"] == "parameters#1"
+    assert all(c["tokens"] <= 130 for c in chunks)
+    # the parts put back together are the whole section
+    body = "".join(c["content"].split("\n", 2)[2] for c in chunks)
+    assert body.count("- name: p") == 200
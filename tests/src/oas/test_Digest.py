@@ -0,0 +1,101 @@
+from src.oas.Digest import bounded_digest, payload_summary, spec_digest, spec_shards
+
+
+def operation(tag, ref=None):
+    response = {"description": "ok"}
+    if ref:
+        response["content"] = {
+            "application/json": {"schema": {"$ref": f"#/components/schemas/{ref}"}}
+        }
+    return {
+        "tags": [tag],
+        "summary": f"An operation about {tag}",
+        "responses": {"200": response},
+    }
+
+
+SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "Big", "version": "1.0"},
+    "paths": {
+        **{f"/returns/{i}": {"get": operation("returns", "Return")} for i in range(20)},
+        **{f"/payments/{i}": {"get": operation("payments")} for i in range(5)},
+        "/health": {"get": {"responses": {"200": {"description": "ok"}}}},
+    },
+    "components": {
+        "schemas": {
+            "Return": {
+                "type": "object",
+                "properties": {"period": {"$ref": "#/components/schemas/Period"}},
+            },
+            "Period": {"type": "string", "format": "date"},
+            "Unused": {"type": "string"},
+        }
+    },
+}
+
+
+def test_the_digest_has_the_sizes_of_the_spec():
+    assert "size: 26 paths, 26 operations, 3 schemas" in spec_digest(SPEC)
+
+
+def test_bounded_digest_fits_the_budget():
+    digest = bounded_digest(SPEC, 200)
+    assert "more operations" in digest
+    assert len(digest) < len(spec_digest(SPEC))
+
+
+def test_shards_follow_the_tags_and_carry_the_schemas_they_use():
+    shards = spec_shards(SPEC, 400)
+    names = [s.name for s in shards]
+    assert "payments" in names and "untagged" in names
+    returns = [s for s in shards if s.name.startswith("returns")]
+    assert len(returns) > 1  # too many operations for one shard
+    assert sum(len(s.operations) for s in shards) == 26
+    assert "Period: string<date>" in returns[0].digest
+    assert "Unused" not in returns[0].digest
+    payments = shards[names.index("payments")]
+    assert "schemas used" not in payments.digest
+    assert payments.operations[0] == "GET /payments/0"
+
+
+def test_payload_summary_does_not_include_the_payload():
+    summary = payload_summary("openapi: 3.0.3")
+    assert summary.startswith("14 bytes, sha256 ")
+    assert "openapi" not in summary
+
+
+def test_malformed_fields_do_not_break_the_digest():
+    spec = {
+        "openapi": "3.0.3",
+        "info": {"title": "Odd", "version": "1.0"},
+        "servers": "https://example.com",
+        "components": {
+            "securitySchemes": ["basic"],
+            "schemas": {
+                "Thing": {
+                    "type": "object",
+                    "required": True,
+                    "properties": {
+                        "kind": {"type": "string", "enum": "a"},
+                        "any": {"oneOf": {"type": "string"}},
+                    },
+                }
+            },
+        },
+        "paths": {
+            "/a/{id}": {
+                "parameters": {"name": "id", "in": "path"},
+                "get": {
+                    "tags": "things",
+                    "parameters": [{"name": "q", "in": 1}],
+                    "responses": {"200": {"description": "ok"}},
+                },
+            }
+        },
+    }
+    digest = spec_digest(spec)
+    assert "GET /a/{id}" in digest
+    assert "params: q(1)" in digest
+    assert "Thing: kind:string, any:oneOf()" in digest
+    assert [shard.name for shard in spec_shards(spec, 1000)] == ["untagged"]
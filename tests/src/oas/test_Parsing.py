@@ -0,0 +1,49 @@
+import pytest
+from src.oas.Parsing import SpecParseError, parse_spec
+
+YAML_SPEC = """
+openapi: 3.0.3
+info:
+  title: VAT
+  version: "1.0"
+paths: {}
+"""
+
+
+def test_yaml_and_json_give_the_same_document():
+    document = parse_spec(YAML_SPEC)
+    assert document["info"]["title"] == "VAT"
+    assert (
+        parse_spec(
+            '{"openapi": "3.0.3", "info": {"title": "VAT", "version": "1.0"}, "paths": {}}'
+        )
+        == document
+    )
+
+
+def test_yaml_flow_mappings_are_not_mistaken_for_json():
+    assert parse_spec("{openapi: 3.0.3, paths: {}}") == {
+        "openapi": "3.0.3",
+        "paths": {},
+    }
+
+
+def test_invalid_documents():
+    with pytest.raises(SpecParseError):
+        parse_spec("openapi: [3.0.3")
+
+
+def test_size_and_depth_limits():
+    with pytest.raises(SpecParseError, match="larger"):
+        parse_spec(YAML_SPEC, max_bytes=10)
+    with pytest.raises(SpecParseError, match="deeper"):
+        parse_spec("[" * 20 + "]" * 20, max_depth=10)
+
+
+def test_alias_expansion_is_bounded():
+    laughs = ['a: &a ["lol", "lol", "lol", "lol", "lol", "lol", "lol", "lol"]']
+    for i, name in enumerate("bcdefghi"):
+        previous = "abcdefghi"[i]
+        laughs.append(f"{name}: &{name} [{', '.join([f'*{previous}'] * 8)}]")
+    with pytest.raises(SpecParseError, match="nodes"):
+        parse_spec("\n".join(laughs))
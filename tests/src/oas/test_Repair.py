@@ -0,0 +1,114 @@
+import pytest
+import yaml
+
+from src.oas.Parsing import SpecParseError, parse_spec
+from src.oas.Repair import (
+    apply_patches,
+    error_location,
+    line_patch,
+    node_patches,
+    request_key,
+    resolve_path,
+    strip_fences,
+)
+from src.oas.Validation import validate_spec
+
+SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "Pets", "version": "1.0"},
+    "paths": {
+        "/pets/{id}": {
+            "get": {
+                "parameters": [{"name": "id", "in": "path", "required": True}],
+                "responses": {"200": {}},
+            }
+        }
+    },
+}
+
+
+def test_fences_are_stripped():
+    assert strip_fences("```yaml\nopenapi: 3.0.3\n```\n") == "openapi: 3.0.3"
+    assert strip_fences("openapi: 3.0.3") == "openapi: 3.0.3"
+
+
+def test_request_keys_ignore_case_and_spacing():
+    assert request_key("A  pet store API ") == request_key("a pet store api")
+    assert request_key("a pet store API") != request_key("a bank API")
+
+
+def test_error_paths_are_resolved_through_keys_with_slashes():
+    assert resolve_path(SPEC, "paths//pets/{id}/get/responses/200") == [
+        "paths",
+        "/pets/{id}",
+        "get",
+        "responses",
+        "200",
+    ]
+    assert resolve_path(SPEC, "paths//pets/{id}/get/parameters/0/schema") == [
+        "paths",
+        "/pets/{id}",
+        "get",
+        "parameters",
+        0,
+    ]
+
+
+def test_errors_are_located_in_the_smallest_object():
+    assert error_location(SPEC, "info/version: 1 is not a string") == ("info",)
+    assert error_location(SPEC, "'paths' is a required property") is None
+    assert (
+        error_location(SPEC, "PointerToNowhere: '/components' does not exist") is None
+    )
+
+
+def test_validation_errors_are_repaired_in_place():
+    errors = validate_spec(SPEC).errors
+    patches = node_patches(SPEC, errors)
+    assert [p.kind for p in patches] == ["node"] * len(patches)
+    assert all(p.location[:2] == ("paths", "/pets/{id}") for p in patches)
+
+    answers = []
+    for patch in patches:
+        node = yaml.safe_load(patch.fragment)
+        if patch.location[-1] == "200":
+            node["description"] = "A pet"
+        else:
+            node["schema"] = {"type": "string"}
+        answers.append(f"```yaml\n{yaml.safe_dump(node)}```")
+    repaired = parse_spec(apply_patches("", SPEC, patches, answers))
+    assert validate_spec(repaired).valid
+    # the original document is left alone
+    assert SPEC["paths"]["/pets/{id}"]["get"]["responses"]["200"] == {}
+
+
+def test_document_errors_repair_the_whole_document():
+    spec = {"openapi": "3.0.3", "info": {"title": "Pets", "version": "1"}}
+    [patch] = node_patches(spec, validate_spec(spec).errors)
+    assert patch.kind == "document"
+    assert apply_patches("", spec, [patch], ["fixed: true"]) == "fixed: true"
+
+
+def test_yaml_errors_repair_the_lines_around_them():
+    lines = [f"key{i}: {i}" for i in range(30)]
+    lines[20] = "key20: [1,"
+    content = "\n".join(lines)
+    with pytest.raises(SpecParseError) as error:
+        parse_spec(content)
+    patch = line_patch(content, error.value)
+    first, last = patch.location
+    assert first <= 20 < last and last - first <= 21
+    assert "key20: [1," in patch.fragment
+
+    answer = patch.fragment.replace("key20: [1,", "key20: [1]")
+    assert parse_spec(apply_patches(content, None, [patch], [answer]))["key20"] == [1]
+
+
+def test_whole_document_and_line_patches_are_never_combined():
+    spec = {"openapi": "3.0.3", "info": {"title": "Pets", "version": "1"}}
+    [document] = node_patches(spec, validate_spec(spec).errors)
+    [node] = node_patches(SPEC, ["paths//pets/{id}/get/responses/200: bad"])
+    with pytest.raises(ValueError):
+        apply_patches("", spec, [document, node], ["fixed: true", "{}"])
+    with pytest.raises(ValueError):
+        apply_patches("", spec, [node], [])
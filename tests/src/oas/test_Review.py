@@ -0,0 +1,112 @@
+import asyncio
+
+from src.oas.Review import (
+    Partition,
+    ReviewFinding,
+    format_review,
+    parse_findings,
+    partition_spec,
+    reduce_findings,
+    review_slots,
+)
+
+SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "VAT", "version": "1.0"},
+    "paths": {
+        f"/returns/{i}": {
+            "get": {
+                "summary": f"Return {i}",
+                "responses": {"200": {"description": "ok"}},
+            },
+            "delete": {"responses": {"204": {"description": "gone"}}},
+        }
+        for i in range(6)
+    },
+}
+
+
+def test_partitions_cover_every_operation_within_the_budget():
+    partitions = partition_spec(SPEC, max_tokens=120)
+    assert len(partitions) > 1
+    covered = [op for p in partitions for op in p.operations]
+    assert sorted(covered) == sorted(
+        f"{method} /returns/{i}" for i in range(6) for method in ("GET", "DELETE")
+    )
+    assert all(p.tokens <= 120 for p in partitions)
+
+
+def test_findings_are_parsed_from_a_json_array_in_a_code_block():
+    text = """```json
+    [{"severity": "Warning", "location": "GET /a", "issue": "No 401  response",
+      "suggestion": "Document it"},
+     {"severity": "fatal", "location": "GET /b", "issue": "Odd"},
+     {"location": "GET /c"}]
+    ```"""
+    findings = parse_findings(text)
+    assert findings == [
+        ReviewFinding("warning", "GET /a", "No 401 response", "Document it"),
+        ReviewFinding("info", "GET /b", "Odd", ""),
+    ]
+
+
+def test_unparseable_answers_are_kept_as_one_finding():
+    partition = Partition("", 0, ["GET /a", "POST /a"])
+    [finding] = parse_findings("Looks fine to me.", partition)
+    assert finding.location == "GET /a, POST /a"
+    assert finding.issue == "Looks fine to me."
+    assert parse_findings("", partition) == []
+
+
+def test_the_same_issue_is_merged_across_operations():
+    merged = reduce_findings(
+        [
+            ReviewFinding("info", "GET /a", "Add examples", "x"),
+            ReviewFinding("warning", "GET /a", "No 401 response", "Add a 401"),
+            ReviewFinding("warning", "GET /b", "no 401 response.", "Add a 401"),
+            ReviewFinding("warning", "GET /c", "Vague summary", ""),
+            ReviewFinding("error", "POST /a", "Wrong verb", ""),
+        ]
+    )
+    assert [(m.severity, m.issue, m.locations) for m in merged] == [
+        ("error", "Wrong verb", ["POST /a"]),
+        ("warning", "No 401 response", ["GET /a", "GET /b"]),
+        ("warning", "Vague summary", ["GET /c"]),
+        ("info", "Add examples", ["GET /a"]),
+    ]
+    assert merged[1].suggestions == ["Add a 401"]
+
+
+def test_format_review_limits_the_locations():
+    merged = reduce_findings(
+        [
+            ReviewFinding("warning", f"GET /{i}", "No 401 response", "Add a 401")
+            for i in range(7)
+        ]
+    )
+    review = format_review(merged, max_locations=3)
+    assert "`GET /0`, `GET /1`, `GET /2` and 4 more" in review
+    assert "Suggestion: Add a 401" in review
+    assert "nothing more" in format_review([])
+
+
+def test_review_slots_are_shared_within_an_event_loop(monkeypatch):
+    monkeypatch.setenv("OAS_REVIEW_CONCURRENCY", "2")
+
+    async def run():
+        running, peak = 0, 0
+
+        async def review():
+            nonlocal running, peak
+            async with review_slots():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(review() for _ in range(6)))
+        return review_slots() is review_slots(), peak
+
+    same, peak = asyncio.run(run())
+    assert same
+    assert peak == 2
@@ -0,0 +1,93 @@
+from src.oas.Digest import spec_digest
+from src.oas.Rules import check_spec, format_findings
+from src.oas.Validation import validate_spec
+
+SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "VAT", "version": "1.0", "domain": "tax"},
+    "servers": [{"url": "http://api.example.com"}],
+    "paths": {
+        "/returns/{vrn}": {
+            "get": {
+                "operationId": "getReturns",
+                "summary": "The VAT returns of a business",
+                "responses": {
+                    "200": {"description": "The returns"},
+                    "404": {"$ref": "#/components/responses/NotFound"},
+                },
+            },
+            "post": {
+                "operationId": "getReturns",
+                "parameters": [
+                    {"name": "vrn", "in": "path", "required": True, "schema": {}}
+                ],
+                "responses": {"400": {"description": ""}},
+            },
+        }
+    },
+}
+
+
+def rules(findings):
+    return {(f.rule, f.location) for f in findings}
+
+
+def test_mechanical_problems_are_found():
+    found = rules(check_spec(SPEC))
+    assert ("info-sub-domain", "info") in found
+    assert ("info-domain", "info") not in found
+    assert ("servers-https", "servers/0") in found
+    assert ("security", "components") in found
+    assert ("path-parameter", "GET /returns/{vrn}") in found
+    assert ("path-parameter", "POST /returns/{vrn}") not in found
+    assert ("operation-id-unique", "POST /returns/{vrn}") in found
+    assert ("operation-summary", "POST /returns/{vrn}") in found
+    assert ("success-response", "POST /returns/{vrn} responses") in found
+    assert ("response-description", "POST /returns/{vrn} responses/400") in found
+    assert (
+        "reference",
+        "paths//returns/{vrn}/get/responses/404",
+    ) in found
+
+
+def test_validation_errors_come_first():
+    findings = check_spec(SPEC, validate_spec(SPEC))
+    assert findings[0].rule == "schema"
+    report = format_findings(findings)
+    assert report.startswith("### Automated checks\n- **error**")
+
+
+def test_digest_is_compact():
+    digest = spec_digest(SPEC)
+    assert "GET /returns/{vrn} [getReturns]" in digest
+    assert "sub-domain: None" in digest
+    assert "params: vrn(path,required)" in digest
+    assert "404 NotFound" in digest
+
+
+def test_malformed_specs_are_reported_not_crashed_on():
+    spec = {
+        "openapi": "3.0.3",
+        "info": {"title": "Broken", "version": "1"},
+        "paths": {
+            "/a/{id}": {
+                "parameters": {"id": {"in": "path"}},
+                "get": {
+                    "operationId": ["not", "hashable"],
+                    "parameters": [{"name": "id", "in": "path"}],
+                    "responses": {"200": {"description": "ok"}},
+                },
+                "post": {
+                    "operationId": {"also": "not"},
+                    "parameters": "id",
+                    "responses": {"200": {"description": "ok"}},
+                },
+            }
+        },
+    }
+    findings = check_spec(spec, validate_spec(spec))
+    assert any(f.rule == "schema" for f in findings)
+    assert [f.location for f in findings if f.rule == "path-parameter"] == [
+        "POST /a/{id}"
+    ]
+    assert not any(f.rule == "operation-id-unique" for f in findings)
@@ -0,0 +1,62 @@
+import asyncio
+
+from src.oas.Streaming import BlockParser, acheck_block
+
+DOCUMENT = """```yaml
+# generated
+openapi: 3.0.3
+info:
+  title: Pets
+
+paths:
+  /pets:
+    get:
+      responses:
+        "200":
+          description: ok
+tags: [pets,
+```"""
+
+
+def feed(document, size=5):
+    parser = BlockParser()
+    blocks = []
+    for i in range(0, len(document), size):
+        blocks += parser.feed(document[i : i + size])
+    return parser, blocks, parser.close()
+
+
+def test_blocks_are_returned_once_the_next_one_starts():
+    parser = BlockParser()
+    [openapi] = parser.feed("openapi: 3.0.3\ninfo:\n  title: Pets\n")
+    assert (openapi.key, openapi.value) == ("openapi", "3.0.3")
+    [info] = parser.feed("paths: {}\n")
+    assert info.value == {"title": "Pets"}
+    [paths] = parser.close()
+    assert paths.key == "paths"
+    assert parser.blocks == {"openapi": "3.0.3", "info": {"title": "Pets"}, "paths": {}}
+
+
+def test_blocks_know_their_lines_and_yaml_errors():
+    parser, streamed, closed = feed(DOCUMENT)
+    blocks = streamed + closed
+    assert [(b.key, b.line) for b in blocks] == [
+        ("openapi", 2),
+        ("info", 4),
+        ("paths", 7),
+        ("tags", 13),
+    ]
+    assert [b.key for b in blocks if b.errors] == ["tags"]
+    assert blocks[-1].errors[0].startswith("Block starting at line 13: Invalid YAML")
+    assert "tags" not in parser.blocks
+
+
+def test_validation_errors_are_reported_on_their_block():
+    parser, blocks, _ = feed(DOCUMENT)
+    info = next(b for b in blocks if b.key == "info")
+    paths = next(b for b in blocks if b.key == "paths")
+    info = asyncio.run(acheck_block(info, parser.blocks))
+    paths = asyncio.run(acheck_block(paths, parser.blocks))
+    assert info.as_dict()["valid"] is False
+    assert info.errors == ["info: 'version' is a required property"]
+    assert paths.as_dict() == {"key": "paths", "line": 7, "valid": True, "errors": []}
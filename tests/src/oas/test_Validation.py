@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from src.oas.Validation import ValidationEngine, spec_hash, validate_spec
+
+VALID_SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "VAT", "version": "1.0"},
+    "paths": {
+        "/returns": {"get": {"responses": {"200": {"description": "The VAT returns"}}}}
+    },
+}
+
+
+def test_valid_and_invalid_specs():
+    result = validate_spec(VALID_SPEC)
+    assert result.valid and result.version == "3.0"
+
+    result = validate_spec({"openapi": "3.0.3", "info": {"title": "VAT"}})
+    assert not result.valid
+    assert "'paths' is a required property" in result.errors
+    assert any(e.startswith("info:") for e in result.errors)
+
+
+def test_documents_that_are_not_specs():
+    assert validate_spec("Error converting YAML to JSON").errors == [
+        "The document is not a mapping"
+    ]
+    assert not validate_spec({"info": {}}).valid
+
+
+def test_hash_ignores_key_order():
+    reordered = {key: VALID_SPEC[key] for key in reversed(VALID_SPEC)}
+    assert spec_hash(reordered) == spec_hash(VALID_SPEC)
+    assert spec_hash({**VALID_SPEC, "openapi": "3.0.2"}) != spec_hash(VALID_SPEC)
+
+
+def test_results_are_cached_by_content(monkeypatch):
+    engine = ValidationEngine(workers=0)
+    calls = []
+    monkeypatch.setattr(
+        "src.oas.Validation.validate_spec",
+        lambda spec: calls.append(spec) or validate_spec(spec),
+    )
+
+    async def run():
+        await asyncio.gather(engine.avalidate(VALID_SPEC), engine.avalidate(VALID_SPEC))
+        return await engine.avalidate(dict(VALID_SPEC))
+
+    assert asyncio.run(run()).valid
+    assert engine.validate(VALID_SPEC).valid
+    assert len(calls) == 1
+
+
+def test_validation_in_worker_processes():
+    engine = ValidationEngine(workers=1)
+    try:
+        result = asyncio.run(engine.avalidate(VALID_SPEC))
+    finally:
+        engine.close()
+    assert result.valid
+
+
+def test_async_validation_hashes_off_the_event_loop(monkeypatch):
+    from src.oas import Validation
+
+    threads = []
+
+    def hash_spec(spec):
+        threads.append(threading.current_thread())
+        return spec_hash(spec)
+
+    monkeypatch.setattr(Validation, "spec_hash", hash_spec)
+    result = asyncio.run(ValidationEngine(workers=0).avalidate(VALID_SPEC))
+    assert result.valid
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,129 @@
+import asyncio
+import numpy as np
+import pytest
+from src.retrieval.Backends import AstraBackend, LocalBackend, export_snapshot
+
+
+def one_hot(i, dimension=4):
+    v = np.zeros(dimension)
+    v[i] = 1.0
+    return v.tolist()
+
+
+@pytest.fixture
+def documents():
+    return [
+        {"_id": "1", "api": "Agent Authorisation API", "$vector": one_hot(0)},
+        {"_id": "2", "api": "CTC Traders API", "$vector": one_hot(1)},
+        {"_id": "3", "path": "/agents", "$vector": one_hot(2)},
+        {"_id": "4", "path": "/agents", "content": "get: ", "chunk": 0},
+        {"_id": "5", "path": "/agents", "content": "summary", "chunk": 1},
+        {"_id": "6", "path": "/movements", "$vector": one_hot(3)},
+        {"_id": "7", "path": "/movements", "content": "post: ", "chunk": 0},
+    ]
+
+
+def test_local_backend_lookups(documents):
+    backend = LocalBackend.from_documents(documents)
+    assert backend.find_api(one_hot(1)) == "CTC Traders API"
+    assert backend.find_endpoint_paths([0, 0, 0.9, 0.1], limit=2) == [
+        "/agents",
+        "/movements",
+    ]
+    chunks = backend.fetch_chunks(["/agents", "/movements"])
+    assert sorted(c.get("chunk", -1) for c in chunks["/agents"]) == [-1, 0, 1]
+    assert len(chunks["/movements"]) == 2
+    assert asyncio.run(backend.afind_api(one_hot(0))) == "Agent Authorisation API"
+
+
+def test_snapshot_round_trip(documents, tmp_path):
+    class FakeCollection:
+        def find(self, filter, projection=None):
+            return iter(documents)
+
+    path = str(tmp_path / "snapshot.npz")
+    export_snapshot(FakeCollection(), path)
+    backend = LocalBackend.from_snapshot(path)
+    assert backend.find_endpoint_paths(one_hot(3)) == ["/movements"]
+    assert backend.fetch_chunks(["/movements"])["/movements"][-1]["content"] == "post: "
+
+
+def test_astra_backend_fetches_all_paths_in_one_query():
+    class FakeCollection:
+        def __init__(self):
+            self.filters = []
+
+        def find(self, filter, limit=None):
+            self.filters.append(filter)
+            return iter(
+                [
+                    {"path": "/a", "content": "x", "chunk": 0},
+                    {"path": "/b", "content": "y", "chunk": 0},
+                ]
+            )
+
+        def to_async(self):
+            return None
+
+    collection = FakeCollection()
+    chunks = AstraBackend(collection).fetch_chunks(["/a", "/b"])
+    assert collection.filters == [{"path": {"$in": ["/a", "/b"]}}]
+    assert set(chunks) == {"/a", "/b"}
+
+
+def test_sections_are_searched_and_assembled(tmp_path):
+    from src.loaders.hmrcLoader1 import assemble_sections
+
+    documents = [
+        {"_id": "1", "api": "Agent Authorisation API", "$vector": one_hot(0)},
+        {"_id": "2", "path": "/agents", "$vector": one_hot(1)},
+        {
+            "_id": "3",
+            "path": "/agents",
+            "method": "get",
+            "section": "responses/200",
+            "content": "\n# GET /agents responses/200\n...",
+            "tokens": 10,
+            "chunk": 2,
+            "$vector": one_hot(2),
+        },
+        {
+            "_id": "4",
+            "path": "/agents",
+            "method": "get",
+            "section": "operation",
+            "content": "\n# GET /agents operation\n...",
+            "tokens": 10,
+            "chunk": 0,
+            "$vector": [0, 0, 0.8, 0.2],
+        },
+        {
+            "_id": "5",
+            "path": "/movements",
+            "method": "post",
+            "section": "requestBody",
+            "content": "\n# POST /movements requestBody\n...",
+            "tokens": 50,
+            "chunk": 1,
+            "$vector": [0, 0, 0.6, 0.4],
+        },
+    ]
+    backend = LocalBackend.from_documents(documents)
+    sections = backend.find_sections(one_hot(2), limit=3)
+    assert [s["_id"] for s in sections] == ["3", "4", "5"]
+    # section vectors count for the endpoint search, each path once
+    assert backend.find_endpoint_paths(one_hot(2), limit=2) == ["/agents", "/movements"]
+
+    assembled = assemble_sections(sections, token_budget=30)
+    assert assembled == [
+        "/agents\n# GET /agents operation\n...\n# GET /agents responses/200\n..."
+    ]
+
+    class FakeCollection:
+        def find(self, filter, projection=None):
+            return iter(documents)
+
+    path = str(tmp_path / "snapshot.npz")
+    export_snapshot(FakeCollection(), path)
+    loaded = LocalBackend.from_snapshot(path)
+    assert [s["_id"] for s in loaded.find_sections(one_hot(2), limit=1)] == ["3"]
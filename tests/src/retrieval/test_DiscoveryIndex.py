@@ -0,0 +1,117 @@
+import asyncio
+
+import numpy as np
+
+from src.retrieval.DiscoveryIndex import (
+    DiscoveryIndex,
+    MinHasher,
+    describe_entry,
+    fingerprint,
+    normalize_path,
+)
+
+ENTRIES = [
+    {
+        "id": "apim-vat-returns",
+        "apiType": "simple",
+        "deploymentTimestamp": "2025-06-18",
+    },
+    {
+        "id": "apim-paye-employees",
+        "apiType": "simple",
+        "deploymentTimestamp": "2025-06-19",
+    },
+    {
+        "id": "apim-no-spec-yet",
+        "apiType": "complex",
+        "deploymentTimestamp": "2025-06-20",
+    },
+]
+
+
+def spec(title, paths, schemas=()):
+    return {
+        "openapi": "3.0.3",
+        "info": {"title": title, "version": "1"},
+        "paths": {
+            path: {"get": {"summary": f"Get {path}", "responses": {}}} for path in paths
+        },
+        "components": {"schemas": {name: {"type": "object"} for name in schemas}},
+    }
+
+
+SPECS = {
+    "apim-vat-returns": spec(
+        "VAT returns",
+        ["/vat/{vrn}/returns", "/vat/{vrn}/obligations", "/vat/{vrn}/liabilities"],
+        ["VatReturn", "Obligation"],
+    ),
+    "apim-paye-employees": spec("PAYE", ["/paye/employees", "/paye/employers/{id}"]),
+}
+
+
+async def fake_embed_many(texts):
+    "VAT texts point one way, everything else another"
+    return [[1.0, 0.0] if "VAT" in text else [0.2, 1.0] for text in texts]
+
+
+def build():
+    return asyncio.run(DiscoveryIndex.abuild(ENTRIES, SPECS, fake_embed_many))
+
+
+def test_paths_are_normalised():
+    assert normalize_path("/VAT/{vrn}/returns/") == normalize_path("/vat/{id}/returns")
+    assert describe_entry(ENTRIES[2]) == "no spec yet"
+
+
+def test_fingerprints():
+    f = fingerprint(SPECS["apim-vat-returns"])
+    assert "/vat/{}/returns" in f.paths
+    assert "get /vat/{}/obligations" in f.operations
+    assert f.schemas == {"vatreturn", "obligation"}
+
+
+def test_minhash_estimates_jaccard():
+    hasher = MinHasher(num_perm=256)
+    a = frozenset(f"op{i}" for i in range(100))
+    b = frozenset(f"op{i}" for i in range(50, 150))
+    signatures = np.stack([hasher.signature(a), hasher.signature(frozenset())])
+    similarity = MinHasher.similarity(signatures, hasher.signature(b))
+    assert abs(similarity[0] - 1 / 3) < 0.1
+    assert similarity[1] == 0.0
+
+
+def test_specs_are_ranked_on_their_structure_and_description():
+    index = build()
+    query = spec(
+        "VAT returns",
+        ["/vat/{vatNumber}/returns", "/vat/{vatNumber}/obligations"],
+        ["VatReturn"],
+    )
+    matches = index.search([1.0, 0.0], fingerprint(query), k=2)
+    best = matches[0]
+    assert best.id == "apim-vat-returns"
+    assert best.shared_paths == ("/vat/{}/obligations", "/vat/{}/returns")
+    assert best.shared_schemas == ("vatreturn",)
+    assert best.path_overlap == 2 / 3
+    assert best.score > matches[1].score
+    assert "shared paths: /vat/{}/obligations" in best.describe()
+
+
+def test_text_queries_use_the_embeddings_only():
+    matches = build().search([0.2, 1.0], k=3)
+    assert matches[0].id in ("apim-paye-employees", "apim-no-spec-yet")
+    assert matches[-1].id == "apim-vat-returns"
+    assert all(m.operation_overlap == 0.0 for m in matches)
+
+
+def test_the_index_survives_a_round_trip(tmp_path):
+    index = build()
+    path = str(tmp_path / "discovery.npz")
+    index.save(path)
+    loaded = DiscoveryIndex.load(path)
+
+    query = fingerprint(spec("VAT", ["/vat/{vrn}/returns"], ["Obligation"]))
+    assert [m.as_dict() for m in loaded.search([1.0, 0.0], query)] == [
+        m.as_dict() for m in index.search([1.0, 0.0], query)
+    ]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from src.retrieval.LocalVectorIndex import FlatIndex, IVFIndex, build_index
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(42).normal(size=(500, 16)).astype(np.float32)
+
+
+def test_flat_index_is_exact(vectors):
+    index = FlatIndex(vectors)
+    hits = index.search(vectors[7] * 3.0, k=3)
+    assert hits[0][0] == 7
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert [score for _, score in hits] == sorted(
+        [score for _, score in hits], reverse=True
+    )
+
+
+def test_ivf_index_finds_exact_matches(vectors):
+    index = IVFIndex(vectors, n_lists=10, nprobe=3)
+    for i in (0, 123, 499):
+        assert index.search(vectors[i], k=1)[0][0] == i
+
+
+def test_ivf_with_every_list_probed_equals_flat(vectors):
+    query = np.random.default_rng(1).normal(size=16)
+    flat = FlatIndex(vectors).search(query, k=5)
+    ivf = IVFIndex(vectors, n_lists=10, nprobe=10).search(query, k=5)
+    assert [i for i, _ in ivf] == [i for i, _ in flat]
+
+
+def test_build_index_and_empty_index(vectors):
+    assert isinstance(build_index(vectors, ivf_threshold=100), IVFIndex)
+    assert isinstance(build_index(vectors), FlatIndex)
+    assert FlatIndex(np.zeros((0, 16))).search(vectors[0]) == []
@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from src.retrieval.QueryRewriter import QueryRewriter, looks_self_contained
+from src.schemas.ChatSchemas import ChatMessage
+
+
+class FakeLLM:
+    def __init__(self, answer="rewritten query", delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    def _response(self):
+        self.calls += 1
+        message = SimpleNamespace(content=self.answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def completion(self, *args, **kwargs):
+        return self._response()
+
+    async def acompletion(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._response()
+
+
+def history(last: str) -> list[ChatMessage]:
+    return [
+        ChatMessage(role="user", content="Tell me about the CTC Traders API"),
+        ChatMessage(
+            role="assistant", content="It lets you send movement notifications"
+        ),
+        ChatMessage(role="user", content=last),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (
+            "How do I appoint a reporting company for interest restriction returns?",
+            True,
+        ),
+        ("What about its endpoints?", False),
+        ("And for Northern Ireland?", False),
+        ("Show me more", False),
+    ],
+)
+def test_looks_self_contained(text, expected):
+    assert looks_self_contained(text) is expected
+
+
+def test_self_contained_and_short_histories_skip_the_llm():
+    llm = FakeLLM()
+    rewriter = QueryRewriter(llm=llm)
+    standalone = "How do I cancel an agent authorisation request?"
+    assert rewriter.rewrite(history(standalone)) == standalone
+    assert rewriter.rewrite(history(standalone)[:1]) == history(standalone)[0].content
+    assert llm.calls == 0
+
+
+def test_rewrites_are_cached_on_the_recent_window():
+    llm = FakeLLM()
+    rewriter = QueryRewriter(llm=llm)
+    assert rewriter.rewrite(history("What about its endpoints?")) == "rewritten query"
+    assert asyncio.run(rewriter.arewrite(history("What about its endpoints?"))) == (
+        "rewritten query"
+    )
+    assert llm.calls == 1
+
+
+def test_speculative_uses_raw_results_when_the_rewrite_misses_the_deadline():
+    llm = FakeLLM(delay=0.2)
+    rewriter = QueryRewriter(llm=llm, speculative=True, deadline_seconds=0.01)
+
+    async def retrieve(query):
+        return [query]
+
+    async def run():
+        results = await rewriter.aretrieve(
+            history("What about its endpoints?"), retrieve
+        )
+        await asyncio.sleep(0.3)
+        return results
+
+    assert asyncio.run(run()) == ["What about its endpoints?"]
+    # the rewrite finished in the background and is cached for next time
+    assert llm.calls == 1
+    assert len(rewriter.cache) == 1
+
+
+def test_speculative_uses_the_rewrite_when_it_is_in_time():
+    rewriter = QueryRewriter(llm=FakeLLM(), speculative=True, deadline_seconds=1)
+
+    async def retrieve(query):
+        return [query]
+
+    results = asyncio.run(
+        rewriter.aretrieve(history("What about its endpoints?"), retrieve)
+    )
+    assert results == ["rewritten query"]
+
+
+def test_a_zero_deadline_is_kept(monkeypatch):
+    monkeypatch.setenv("HMRC_REWRITE_DEADLINE_SECONDS", "3")
+    assert QueryRewriter(llm=FakeLLM(), deadline_seconds=0).deadline_seconds == 0
+    assert QueryRewriter(llm=FakeLLM()).deadline_seconds == 3
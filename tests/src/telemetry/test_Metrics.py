@@ -0,0 +1,65 @@
+import asyncio
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from prometheus_client import REGISTRY
+from src.telemetry.Metrics import export_request
+from src.telemetry.Timings import count, mark, stage, start_timings
+
+
+def recorded_request():
+    async def request():
+        timings = start_timings()
+        with stage("retrieval"):
+            await asyncio.sleep(0.01)
+        count("prompt_tokens", 120)
+        mark("first_token")
+        return timings
+
+    return asyncio.run(request())
+
+
+def test_requests_are_observed_in_the_prometheus_histograms():
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    before = sample("rag_prompt_tokens_sum", route="/test-metrics")
+    stages = sample(
+        "rag_stage_duration_seconds_count", route="/test-metrics", stage="retrieval"
+    )
+
+    export_request("/test-metrics", recorded_request(), 0.05)
+
+    assert sample("rag_prompt_tokens_sum", route="/test-metrics") == before + 120
+    assert (
+        sample(
+            "rag_stage_duration_seconds_count",
+            route="/test-metrics",
+            stage="retrieval",
+        )
+        == stages + 1
+    )
+    assert sample(
+        "rag_request_mark_seconds_count", route="/test-metrics", mark="first_token"
+    )
+
+
+def test_stages_are_exported_as_child_spans(monkeypatch):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(trace, "get_tracer", provider.get_tracer)
+
+    timings = recorded_request()
+    export_request("/chat", timings, 0.05)
+
+    spans = {s.name: s for s in exporter.get_finished_spans()}
+    root, child = spans["/chat"], spans["retrieval"]
+    assert child.parent.span_id == root.context.span_id
+    assert root.start_time == timings.started_ns
+    assert root.end_time - root.start_time == 50_000_000
+    assert root.start_time <= child.start_time < child.end_time <= root.end_time
+    assert root.attributes["rag.prompt_tokens"] == 120
@@ -0,0 +1,16 @@
+from src.telemetry.Startup import StartupReport, startup_step, get_startup_report
+
+
+def test_steps_are_recorded_and_formatted():
+    with startup_step("slow thing"):
+        pass
+    report = get_startup_report()
+    assert report.steps[-1].name == "slow thing"
+    assert report.steps[-1].kind == "init"
+
+    report = StartupReport()
+    report.record("fast", "import", 1.0)
+    report.record("slow", "init", 5.0)
+    lines = report.format().splitlines()
+    assert lines[1].startswith("slow") and lines[2].startswith("fast")
+    assert [s["name"] for s in report.as_dict()["steps"]] == ["fast", "slow"]
@@ -0,0 +1,44 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from src.telemetry.Timings import current_timings, run_in_context, stage, start_timings
+
+
+def test_stage_is_a_no_op_outside_of_a_request():
+    async def outside():
+        with stage("embed"):
+            pass
+        return current_timings()
+
+    assert asyncio.run(outside()) is None
+
+
+def test_concurrent_stages_are_recorded_with_offsets():
+    async def request():
+        timings = start_timings()
+
+        async def sleep(name, seconds):
+            with stage(name):
+                await asyncio.sleep(seconds)
+
+        await asyncio.gather(sleep("api_search", 0.02), sleep("endpoint_search", 0.01))
+        return timings
+
+    timings = asyncio.run(request())
+    assert set(timings.durations()) == {"api_search", "endpoint_search"}
+    starts = [s["start_ms"] for s in timings.as_dict()["stages"]]
+    assert abs(starts[0] - starts[1]) < 10
+    assert "api_search;dur=" in timings.server_timing()
+
+
+def test_thread_pool_stages_use_the_callers_timings():
+    def work():
+        with stage("chunk_fetch"):
+            return 1
+
+    async def request():
+        timings = start_timings()
+        with ThreadPoolExecutor(1) as executor:
+            run_in_context(executor, work).result()
+        return timings
+
+    assert "chunk_fetch" in asyncio.run(request()).durations()
@@ -0,0 +1,14 @@
+from src.telemetry import Tokens
+from src.telemetry.Tokens import count_tokens
+
+
+def test_counts_tokens():
+    assert count_tokens("") == 0
+    assert 0 < count_tokens("What is the VAT returns API?") < 20
+
+
+def test_only_short_texts_are_cached():
+    Tokens._cached_count.cache_clear()
+    count_tokens("short")
+    count_tokens("long " * Tokens.CACHE_MAX_CHARS)
+    assert Tokens._cached_count.cache_info().currsize == 1
@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+from src.telemetry.Timings import start_timings
+from src.telemetry.Usage import (
+    ainstrument_stream,
+    instrument_stream,
+    record_completion,
+    record_prompt,
+    record_retrieved,
+)
+
+
+def response(content, completion_tokens=None):
+    usage = (
+        SimpleNamespace(completion_tokens=completion_tokens)
+        if completion_tokens is not None
+        else None
+    )
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=usage,
+    )
+
+
+def test_prompt_and_retrieved_context_are_counted():
+    async def request():
+        timings = start_timings()
+        record_retrieved(["ab", "cdé"])
+        record_prompt(
+            [
+                {"role": "system", "content": "You are helpful"},
+                {"role": "user", "content": [{"type": "text", "text": "hello"}]},
+            ]
+        )
+        return timings
+
+    counts = asyncio.run(request()).counts
+    assert counts["retrieved_bytes"] == 6
+    assert counts["prompt_tokens"] > 0
+    assert counts["llm_calls"] == 1
+
+
+def test_completion_uses_the_reported_usage():
+    async def request():
+        timings = start_timings()
+        record_completion(response("a longer answer than five tokens", 5))
+        return timings
+
+    timings = asyncio.run(request())
+    assert timings.counts["completion_tokens"] == 5
+    assert set(timings.marks) == {"first_token", "last_token"}
+
+
+def test_streams_are_passed_through_and_measured():
+    def request():
+        timings = start_timings()
+        assert list(instrument_stream(iter(["Hello", " world"]))) == ["Hello", " world"]
+        return timings
+
+    async def arequest():
+        timings = start_timings()
+
+        async def stream():
+            yield "Hello"
+            yield " world"
+
+        assert [p async for p in ainstrument_stream(stream())] == ["Hello", " world"]
+        return timings
+
+    for timings in (asyncio.run(asyncio.to_thread(request)), asyncio.run(arequest())):
+        assert timings.counts["completion_tokens"] > 0
+        assert timings.marks["first_token"] <= timings.marks["last_token"]
+
+
+def test_accounting_is_a_no_op_outside_of_a_request():
+    async def outside():
+        record_prompt([{"role": "user", "content": "hi"}])
+        return list(instrument_stream(iter(["a"])))
+
+    assert asyncio.run(outside()) == ["a"]